@@ -0,0 +1,61 @@
+from pathlib import Path
+from commands import lines
+from commands import compiled
+from commands import recordindex
+from benchmarks.fixtures import makeData
+
+import argparse
+import tempfile
+import time
+import json
+
+
+def timeit(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the columnar engine with the dataclass/postings path')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    data, itemdetails = makeData(args.users, args.items)
+    queries = [
+        ('findLimiteds rare', lambda: lines.findLimiteds('M400')),
+        ('findLimiteds popular', lambda: lines.findLimiteds('M0', True)),
+        ('findCollectibles', lambda: lines.findCollectibles('bmw model 1')),
+        ('getLines popular', lambda: lines.getLines(lines.findLimiteds('M0'))),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lines.DB_PATH = Path(tmp) / 'data.json'
+        lines.ITEMS_PATH = Path(tmp) / 'itemdetails.json'
+        lines.COMPILE_SNAPSHOTS = False
+        compiled.SNAPSHOT_PATH = Path(tmp) / 'data.snapshot'
+        recordindex.INDEX_PATH = Path(tmp) / 'data.index'
+        lines.DB_PATH.write_text(json.dumps(data), encoding='utf-8')
+        lines.ITEMS_PATH.write_text(json.dumps(itemdetails), encoding='utf-8')
+
+        results = {}
+        for engine in ('index', 'columns'):
+            lines.ENGINE = engine
+            lines._snapshot = None
+            build, _ = timeit(lambda: lines.getColumns(lines.loadDB()), 1)
+            print(f'{engine}: build {build:.1f} ms')
+            for name, fn in queries:
+                ms, result = timeit(fn, args.repeat)
+                results.setdefault(name, []).append(result)
+                print(f'  {name:<22} {ms:8.3f} ms')
+
+        for name, (indexed, columnar) in results.items():
+            if indexed != columnar:
+                raise SystemExit(f'{name}: engines disagree')
+
+
+if __name__ == '__main__':
+    main()
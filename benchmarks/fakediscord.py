@@ -0,0 +1,154 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from aiohttp import web
+
+import asyncio
+import discord
+
+
+# Just enough of discord.py's Context/Interaction/Message for the handlers in commands/commands.py,
+# views posted with a message are answered by clicking their real buttons.
+
+@dataclass
+class Sent:
+    content: str | None
+    embed: Any = None
+    files: List[tuple] = field(default_factory=list) # (filename, bytes)
+    edits: int = 0
+    deleted: bool = False
+
+
+class FakeMessage:
+    def __init__(self, sent: Sent):
+        self.sent = sent
+
+    async def delete(self):
+        self.sent.deleted = True
+
+    async def edit(self, content=None, embed=None, view=None):
+        self.sent.edits += 1
+        if embed is not None:
+            self.sent.embed = embed
+
+
+class FakeResponse:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.done = False
+
+    async def edit_message(self, content=None, embed=None, view=None):
+        self.done = True
+        await self.message.edit(content, embed, view)
+
+    async def send_message(self, content=None, embed=None, view=None, ephemeral=False):
+        self.done = True
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    def is_done(self):
+        return self.done
+
+
+class FakeInteraction:
+    def __init__(self, user, message: FakeMessage):
+        self.user = user
+        self.message = message
+        self.response = FakeResponse(message)
+
+
+@dataclass
+class FakeUser:
+    id: int
+    name: str = 'loadtest'
+
+
+@dataclass
+class FakeAttachment:
+    url: str
+    filename: str
+    size: int
+
+
+@dataclass
+class FakeInput:
+    attachments: List[FakeAttachment] = field(default_factory=list)
+
+
+class FakeContext:
+    # answer is what YesNoButtons get, pages is the button labels pressed on a Page view (disabled ones are skipped)
+
+    def __init__(self, bot, author: FakeUser, answer: bool = True, pages=('>', 'Last', '<', 'First'), attachments=()):
+        self.bot = bot
+        self.author = author
+        self.guild = None
+        self.command = None
+        self.interaction = None
+        self.message = FakeInput(list(attachments))
+        self.answer = answer
+        self.pages = pages
+        self.sent: List[Sent] = []
+        self.clicks = 0
+        self.answering: List[asyncio.Task] = []
+
+    async def send(self, content=None, *, embed=None, view=None, file=None, files=None, **kwargs):
+        sent = Sent(content, embed)
+        for f in ([file] if file else []) + list(files or []):
+            sent.files.append((f.filename, f.fp.read()))
+        self.sent.append(sent)
+        message = FakeMessage(sent)
+        if view is not None:
+            self.answering.append(asyncio.get_running_loop().create_task(self.click(view, message)))
+        return message
+
+    reply = send
+
+    async def click(self, view: discord.ui.View, message: FakeMessage):
+        # Yes/No prompts get one click, anything else gets the page script
+        await asyncio.sleep(0) # the handler is still between send and view.wait()
+        buttons = {item.label: item for item in view.children if isinstance(item, discord.ui.Button)}
+        labels = ['Yes' if self.answer else 'No'] if 'Yes' in buttons else self.pages
+        for label in labels:
+            button = buttons.get(label)
+            if button is None or button.disabled:
+                continue
+            await button.callback(FakeInteraction(self.author, message))
+            self.clicks += 1
+            if view.is_finished():
+                break
+        view.stop()
+
+    async def settle(self):
+        # wait for the views this command posted to be answered
+        while self.answering:
+            await self.answering.pop()
+
+
+class AttachmentServer:
+    # Serves attachment bytes from 127.0.0.1 so extractPart downloads through the real aiohttp path
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self.runner = None
+        self.base = ''
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{name}', self.serve)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f'http://127.0.0.1:{port}'
+
+    async def serve(self, request):
+        return web.Response(body=self.files[request.match_info['name']])
+
+    def add(self, name: str, data: bytes) -> FakeAttachment:
+        self.files[name] = data
+        return FakeAttachment(f'{self.base}/{name}', name, len(data))
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import random
+import json
+
+
+MAKES = ["BMW", "Toyota", "Nissan", "Porsche", "Ford", "Chevrolet", "Honda", "Mazda", "Audi", "Mercedes", "Dodge", "Lamborghini"]
+WORDS = ["car", "collector", "drift", "turbo", "garage", "rookie", "street", "classic", "boost", "apex", "redline", "track"]
+NOTE_WORDS = ["traded", "wants", "sold", "asked", "about", "the", "a", "for", "cheap", "rare", "scammer", "legit", "friend", "build", "engine", "swap", "offer", "later", "again"]
+
+
+def itemName(itemID: int) -> str:
+    return f'{MAKES[itemID % len(MAKES)]} Model {itemID}'
+
+def pickItem(rng: random.Random, items: int) -> int:
+    # Pareto skew: item 0 is owned by a large share of users, most items by a handful
+    return min(int(rng.paretovariate(1.2)) - 1, items - 1)
+
+def makeUser(rng: random.Random, userid: int, items: int) -> dict:
+    owned = {pickItem(rng, items) for _ in range(rng.randint(0, 6))}
+    return {
+        "username": f'{rng.choice(WORDS).capitalize()}{rng.choice(WORDS).capitalize()}{rng.randint(1, userid + 99)}', # repeats happen, like real names
+        "id": userid,
+        "age": str(rng.randint(13, 60)) if rng.random() < 0.3 else "",
+        "private": rng.random() < 0.2,
+        "terminated": rng.random() < 0.05,
+        "verified": rng.random() < 0.3,
+        "collectibles": [itemName(itemID) for itemID in sorted(owned)],
+        "assets": {str(itemID): [f'S{itemID}-{n}' for n in range(rng.randint(1, 3))] for itemID in sorted(owned)},
+    }
+
+def makeItems(rng: random.Random, items: int) -> dict:
+    # a few items have no price yet, they end up in the "unpriced" line
+    return {"items": {str(i): [itemName(i), f'M{i}', rng.randint(1000, 90000), rng.choice([-1, rng.randint(1000, 90000)]), 0]
+                      for i in range(items) if rng.random() > 0.01}}
+
+def makeData(users: int, items: int, seed: int = 0):
+    rng = random.Random(seed)
+    itemdetails = makeItems(rng, items)
+    data = {str(userid): makeUser(rng, userid, items) for userid in range(1, users + 1)}
+    return data, itemdetails
+
+def makeNote(rng: random.Random, userid: int) -> dict:
+    return {
+        "userid": str(userid),
+        "username": f'{rng.choice(WORDS).capitalize()}{rng.randint(1, 9999)}' if rng.random() < 0.9 else "",
+        "age": str(rng.randint(13, 60)),
+        "profilePictureRating": f'{rng.randint(1, 10)}/10',
+        "creator": f'person{rng.randint(1, 5)}',
+        "createdAt": f'2025-{rng.randint(1, 12):02}-{rng.randint(1, 28):02} {rng.randint(0, 23):02}:{rng.randint(0, 59):02}:00',
+        "message": ' '.join(rng.choice(NOTE_WORDS) for _ in range(rng.randint(3, 40))),
+    }
+
+
+def writeFixtures(directory: Path, users: int, items: int, notes: int, seed: int = 0) -> dict:
+    # Streams data.json one user at a time so a million users never sit in memory as one dict
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {"data": directory / 'data.json', "items": directory / 'itemdetails.json', "notes": directory / 'notes.json'}
+
+    with paths["items"].open('w', encoding='utf-8') as file:
+        json.dump(makeItems(rng, items), file)
+
+    with paths["data"].open('w', encoding='utf-8') as file:
+        file.write('{')
+        for userid in range(1, users + 1):
+            file.write(f'{"," if userid > 1 else ""}\n"{userid}": {json.dumps(makeUser(rng, userid, items))}')
+        file.write('\n}')
+
+    with paths["notes"].open('w', encoding='utf-8') as file:
+        noted = sorted(rng.sample(range(1, users + 1), min(notes, users)))
+        json.dump({str(userid): makeNote(rng, userid) for userid in noted}, file, ensure_ascii=False)
+    return paths
@@ -0,0 +1,252 @@
+from discord.ext.commands import CommandError, CommandInvokeError
+from pathlib import Path
+from commands import lines
+from commands import compiled
+from commands import recordindex
+from commands import service
+from benchmarks import fixtures
+from benchmarks import suite
+from benchmarks.fakediscord import FakeContext, FakeUser, AttachmentServer
+
+import statistics
+import argparse
+import tempfile
+import asyncio
+import random
+import time
+import json
+import os
+
+
+MIX = "viewNote=30,addNotes=10,changeInfo=5,showNote=10,getAsset=20,getCollectible=10,extractPart=5,getInfos=10"
+AUTHOR = FakeUser(1)
+STALL_MS = 50.0 # a loop wake up this late counts as a stall
+SAMPLE_INTERVAL = 0.01
+
+
+def parseMix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Workload:
+    # Picks arguments for each command from the loaded snapshot and notes, seeded so runs repeat
+
+    def __init__(self, snap: lines.Snapshot, noted: list, attachment, seed: int):
+        self.rng = random.Random(seed)
+        self.userids = list(snap.users_by_userid)
+        self.noted = noted or self.userids
+        codes = [details[1] for details in snap.items.values()]
+        self.codes = codes[:20] + self.rng.sample(codes, min(len(codes), 200)) # the popular ones come first in itemdetails
+        self.collectibles = [name[:self.rng.randint(3, len(name))] for name in self.rng.sample(list(snap.collectible_names), min(200, len(snap.collectible_names)))]
+        self.attachment = attachment
+
+    def pick(self, name: str):
+        # (args after ctx, what YesNoButtons should answer)
+        rng = self.rng
+        if name == "viewNote":
+            return (rng.choice(self.noted),), True
+        if name == "addNotes":
+            return (rng.choice(self.userids), 'load test note'), True
+        if name == "changeInfo":
+            return (rng.choice(self.noted), None, str(rng.randint(13, 60))), True
+        if name == "showNote":
+            return (rng.randint(0, 50),), True
+        if name == "getAsset":
+            return (rng.choice(self.codes), rng.choice([None, True, False])), True
+        if name == "getCollectible":
+            return (rng.choice(self.collectibles), rng.choice([None, True])), True
+        if name == "extractPart":
+            return (',', rng.choice(['1', '2', '1,3']), self.attachment, False), False
+        if name == "getInfos":
+            return (rng.choice(self.userids),), True
+        raise ValueError(f"{name} isn't a command the load test knows")
+
+
+async def invoke(myCommands, name: str, args: tuple, answer: bool) -> tuple:
+    # Runs the real command the way the bot does: checks, hooks, handler, then the error handler on failure
+    command = getattr(myCommands, name)
+    ctx = FakeContext(myCommands.client, AUTHOR, answer=answer)
+    ctx.command = command
+    start = time.perf_counter()
+    error = None
+    try:
+        await command.can_run(ctx)
+        await myCommands.beforeCommand(ctx)
+        await command(ctx, *args)
+        await ctx.settle()
+        await myCommands.afterCommand(ctx)
+    except Exception as e:
+        error = type(e.original if isinstance(e, CommandInvokeError) else e).__name__
+        try:
+            await myCommands.on_command_error(ctx, e if isinstance(e, CommandError) else CommandInvokeError(e))
+            error = None if ctx.sent else error # handled, the user got an answer
+        except Exception:
+            pass
+    return time.perf_counter() - start, error, ctx
+
+
+async def sampleLoop(lateness: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        lateness.append(max(0.0, loop.time() - start - SAMPLE_INTERVAL))
+
+
+def summarize(times: list) -> dict:
+    times = sorted(times)
+    if not times:
+        return {"calls": 0}
+    return {
+        "calls": len(times),
+        "mean_ms": statistics.fmean(times) * 1000,
+        "p50_ms": suite.percentile(times, 0.50) * 1000,
+        "p95_ms": suite.percentile(times, 0.95) * 1000,
+        "p99_ms": suite.percentile(times, 0.99) * 1000,
+        "max_ms": times[-1] * 1000,
+    }
+
+
+async def loadTest(myCommands, workload: Workload, mix: dict, users: int, requests: int, think: float) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    times = {name: [] for name in names}
+    errors = {}
+    sent = {"messages": 0, "files": 0, "bytes": 0, "clicks": 0}
+
+    async def user(index: int):
+        rng = random.Random(index)
+        for _ in range(requests):
+            name = rng.choices(names, weights)[0]
+            args, answer = workload.pick(name)
+            seconds, error, ctx = await invoke(myCommands, name, args, answer)
+            times[name].append(seconds)
+            if error:
+                errors[f'{name}: {error}'] = errors.get(f'{name}: {error}', 0) + 1
+            sent["messages"] += len(ctx.sent)
+            sent["files"] += sum(len(s.files) for s in ctx.sent)
+            sent["bytes"] += sum(len(data) for s in ctx.sent for _, data in s.files)
+            sent["clicks"] += ctx.clicks
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+
+    lateness = []
+    stop = asyncio.Event()
+    sampler = asyncio.get_running_loop().create_task(sampleLoop(lateness, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+
+    everything = [t for ts in times.values() for t in ts]
+    lateness.sort()
+    return {
+        "users": users,
+        "seconds": elapsed,
+        "commands_per_s": len(everything) / elapsed if elapsed else 0.0,
+        "all": summarize(everything),
+        "commands": {name: summarize(ts) for name, ts in times.items()},
+        "errors": errors,
+        "sent": sent,
+        "loop": {
+            "samples": len(lateness),
+            "lag_p99_ms": suite.percentile(lateness, 0.99) * 1000 if lateness else 0.0,
+            "lag_max_ms": lateness[-1] * 1000 if lateness else 0.0,
+            "stalls": sum(1 for late in lateness if late * 1000 >= STALL_MS),
+        },
+    }
+
+
+def setUp(directory: Path, users: int, items: int, seed: int) -> Path:
+    # Generated data in a scratch directory, laid out the way the bot reads it from its working directory
+    paths = fixtures.writeFixtures(directory, users, items, users // 10, seed)
+    lines.DB_PATH = paths["data"]
+    lines.ITEMS_PATH = paths["items"]
+    lines.COMPILE_SNAPSHOTS = False
+    compiled.SNAPSHOT_PATH = directory / 'data.snapshot'
+    recordindex.INDEX_PATH = directory / 'data.index'
+    suite.useNotes(directory, 'sqlite', paths["notes"])
+
+    whitelist = directory / Path("data\\whitelist.json")
+    whitelist.parent.mkdir(parents=True, exist_ok=True)
+    whitelist.write_text(json.dumps({str(AUTHOR.id): AUTHOR.name}), encoding='utf-8')
+    os.chdir(directory)
+    return paths["notes"]
+
+
+def report(result: dict):
+    print(f'{result["users"]} users: {result["commands_per_s"]:.1f} commands/s over {result["seconds"]:.1f}s')
+    for name, row in [("all", result["all"]), *result["commands"].items()]:
+        if row["calls"]:
+            print(f'  {name:<16} {row["calls"]:>6}  p50 {row["p50_ms"]:8.2f}  p95 {row["p95_ms"]:8.2f}  p99 {row["p99_ms"]:8.2f}  max {row["max_ms"]:8.2f} ms')
+    loop = result["loop"]
+    print(f'  event loop lag p99 {loop["lag_p99_ms"]:.2f} ms, max {loop["lag_max_ms"]:.2f} ms, {loop["stalls"]} stalls >= {STALL_MS:g} ms')
+    for error, count in result["errors"].items():
+        print(f'  error {error} x{count}')
+
+
+async def run(args, notesPath: Path | None):
+    from commands import commands as myCommands # reads data\whitelist.json from the working directory on import
+
+    myCommands.whitelist.setdefault(str(AUTHOR.id), AUTHOR.name)
+    lines.startWatching() # like the bot, the snapshot is read in place, not re-checked per command
+    snap = lines.loadDB()
+    noted = list(json.loads(notesPath.read_text(encoding='utf-8'))) if notesPath else []
+
+    server = AttachmentServer()
+    await server.start()
+    rng = random.Random(args.seed)
+    text = '\n'.join(f'{rng.randint(1, 10 ** 6)},{rng.choice(fixtures.WORDS)},{rng.randint(0, 99999)}' for _ in range(args.attachment_rows))
+    attachment = server.add('attachment.txt', text.encode('utf-8'))
+
+    results = []
+    try:
+        service.startMonitor()
+        workload = Workload(snap, noted, attachment, args.seed)
+        for users in (int(n) for n in args.users.split(',')):
+            result = await loadTest(myCommands, workload, parseMix(args.mix), users, args.requests, args.think / 1000)
+            report(result)
+            results.append(result)
+    finally:
+        await server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a command mix against the real handlers with a fake Discord, no network needed')
+    parser.add_argument('--users', default='1,8,32', help='concurrent users, comma separated for several runs')
+    parser.add_argument('--requests', type=int, default=50, help='commands per user')
+    parser.add_argument('--mix', default=MIX, help='command=weight, comma separated')
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between a user\'s commands, ms')
+    parser.add_argument('--size', type=int, default=20_000, help='generated users in data.json')
+    parser.add_argument('--items', type=int, default=suite.ITEMS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--attachment-rows', type=int, default=20_000, help='lines in the file extractPart gets')
+    parser.add_argument('--data', type=Path, help='run in this bot directory instead of generated data, notes get written to, use a copy')
+    parser.add_argument('--output', type=Path, help='write the results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        if args.data:
+            os.chdir(args.data)
+            notesPath = None
+        else:
+            notesPath = setUp(Path(tmp), args.size, args.items, args.seed)
+        try:
+            results = asyncio.run(run(args, notesPath))
+        finally:
+            os.chdir(cwd)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from commands import lines
+from commands import compiled
+from commands import recordindex
+from commands import notes
+from commands import ingest
+from commands import query
+from benchmarks import fixtures
+
+import multiprocessing
+import subprocess
+import statistics
+import argparse
+import platform
+import resource
+import tempfile
+import random
+import time
+import json
+import sys
+
+
+SIZES = (10_000, 100_000, 1_000_000)
+ITEMS = 2_000
+REGRESSION = 1.2 # --compare flags anything this much slower at p50
+NOISE_MS = 0.05 # below this a ratio is mostly timer noise
+PER_PAGE = 10 # notes per page, like showNote
+
+
+def rssMB() -> float:
+    # current resident set, Linux only, 0 elsewhere
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / (1 << 20)
+    except OSError:
+        return 0.0
+
+def peakRssMB() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB on Linux
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def measure(fn, inputs: list) -> dict:
+    # Latency per call, throughput over the whole run, and how far the process peak moved while it ran
+    peak = peakRssMB()
+    times = []
+    start = time.perf_counter()
+    for arg in inputs:
+        t = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    times.sort()
+    return {
+        "calls": len(times),
+        "mean_ms": statistics.fmean(times) * 1000,
+        "p50_ms": percentile(times, 0.50) * 1000,
+        "p95_ms": percentile(times, 0.95) * 1000,
+        "p99_ms": percentile(times, 0.99) * 1000,
+        "max_ms": times[-1] * 1000,
+        "ops_per_s": len(times) / total if total else 0.0,
+        "rss_mb": rssMB(),
+        "peak_rss_mb": peakRssMB(),
+        "peak_rss_growth_mb": peakRssMB() - peak,
+    }
+
+
+def coldLoad(_):
+    lines._snapshot = None
+    return lines.loadDB()
+
+def useNotes(directory: Path, backend: str, source: Path):
+    # Every backend starts from the same notes.json
+    backendDir = directory / backend
+    backendDir.mkdir()
+    notes.NOTE_PATH = backendDir / 'notes.json'
+    notes.LOCK_PATH = backendDir / 'notes.lock'
+    notes.NOTE_DB_PATH = backendDir / 'notes.db'
+    notes.JOURNAL_PATH = backendDir / 'notes.journal'
+    notes.NOTE_PATH.write_bytes(source.read_bytes())
+    notes.BACKEND = backend
+    notes._store = None
+    notes._search = None
+
+
+def runSize(users: int, items: int, seed: int, calls: int, noteCalls: int, backends: tuple) -> dict:
+    # Runs in its own process so peak RSS belongs to this size alone
+    rng = random.Random(seed)
+    results = {}
+    def record(name, fn, inputs):
+        results[name] = measure(fn, inputs)
+        row = results[name]
+        print(f'{users:>9} {name:<28} p50 {row["p50_ms"]:9.3f} ms  p99 {row["p99_ms"]:9.3f} ms  {row["ops_per_s"]:10.1f}/s  peak {row["peak_rss_mb"]:8.1f} MB', flush=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        start = time.perf_counter()
+        paths = fixtures.writeFixtures(directory, users, items, users // 10, seed)
+        generated = time.perf_counter() - start
+
+        lines.DB_PATH = paths["data"]
+        lines.ITEMS_PATH = paths["items"]
+        lines.COMPILE_SNAPSHOTS = False
+        compiled.SNAPSHOT_PATH = directory / 'data.snapshot'
+        recordindex.INDEX_PATH = directory / 'data.index'
+        ingest.DELTA_PATH = directory / 'data.delta'
+        ingest.DELTA_LOCK_PATH = directory / 'data.delta.lock'
+        lines.startWatching() # like the bot, queries read the current snapshot without a stat per call
+
+        record('loadDB json', coldLoad, [None])
+        snap = lines.loadDB()
+        compiled.writeSnapshot(snap, compiled.SNAPSHOT_PATH)
+        record('loadDB compiled', coldLoad, [None] * 3)
+        record('loadDB current', lambda _: lines.loadDB(), [None] * calls)
+        snap = lines.loadDB()
+
+        codes = {itemID: details[1] for itemID, details in snap.items.items()}
+        ranked = sorted(codes, key=lambda itemID: -len(snap.holders.get(itemID, ((), ()))[0]) - len(snap.holders.get(itemID, ((), ()))[1]))
+        popular = [codes[itemID] for itemID in ranked[:10]]
+        rare = [codes[itemID] for itemID in ranked[len(ranked) // 2:]]
+        names = list(snap.username_to_id)
+
+        record('findLimiteds popular', lambda code: lines.findLimiteds(code, None, snap), [rng.choice(popular) for _ in range(calls)])
+        record('findLimiteds rare', lambda code: lines.findLimiteds(code, True, snap), [rng.choice(rare) for _ in range(calls)])
+        record('findCollectibles', lambda prefix: lines.findCollectibles(prefix, None, snap), [f'{rng.choice(fixtures.MAKES)} model {rng.randint(1, 99)}' for _ in range(calls)])
+        record('getLines popular', lambda code: lines.getLines(lines.findLimiteds(code, None, snap), snap), [rng.choice(popular) for _ in range(max(1, calls // 10))])
+        record('getLines rare', lambda code: lines.getLines(lines.findLimiteds(code, None, snap), snap), [rng.choice(rare) for _ in range(calls)])
+        record('findUser', lines.findUser, [rng.choice(names) for _ in range(calls)])
+        record('getInfo', lines.getInfo, [str(rng.randint(1, users)) for _ in range(calls)])
+        record('scan username', lambda word: query.findUsers(f'u:{word}'), [rng.choice(fixtures.WORDS) for _ in range(max(1, calls // 20))])
+        record('scan value', lambda value: query.findUsers(f'value>{value}'), [rng.randint(0, 200_000) for _ in range(max(1, calls // 20))])
+
+        for backend in backends:
+            useNotes(directory, backend, paths["notes"])
+            noted = list(json.loads(paths["notes"].read_text(encoding='utf-8')))
+            record(f'notes {backend} first open', lambda _: notes.getStore(), [None])
+            record(f'notes {backend} addMessage', lambda userid: notes.addMessage(userid, 'benchmark note', creator='bench'),
+                   [rng.choice(noted) if rng.random() < 0.8 else str(users + rng.randint(1, users)) for _ in range(noteCalls)])
+            record(f'notes {backend} viewNote', notes.viewNote, [rng.choice(noted) for _ in range(calls)])
+            walk = [None] # showNote's paging: count, then each page from the last row of the one before, round again at the end
+            def pageAfter(_):
+                bounds = notes.viewNotesAfter(walk[0], PER_PAGE)[2]
+                walk[0] = bounds[1] if bounds else None
+            record(f'notes {backend} countNotes', lambda _: notes.countNotes(), [None] * calls)
+            record(f'notes {backend} page after', pageAfter, [None] * calls)
+            record(f'notes {backend} last page', lambda _: notes.viewNotesBefore(None, PER_PAGE), [None] * max(1, calls // 10))
+
+    return {"users": users, "items": items, "generate_s": generated, "ops": results}
+
+
+def gitCommit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(basePath: Path, newPath: Path) -> int:
+    base = json.loads(basePath.read_text(encoding='utf-8'))
+    new = json.loads(newPath.read_text(encoding='utf-8'))
+    print(f'{base["commit"]} -> {new["commit"]}')
+    regressions = 0
+    for size, run in new["sizes"].items():
+        for name, row in run["ops"].items():
+            old = base["sizes"].get(size, {}).get("ops", {}).get(name)
+            if not old or not old["p50_ms"]:
+                continue
+            ratio = row["p50_ms"] / old["p50_ms"]
+            flag = ' REGRESSION' if ratio > REGRESSION and row["p50_ms"] > NOISE_MS else ''
+            regressions += bool(flag)
+            print(f'{size:>9} {name:<28} {old["p50_ms"]:9.3f} -> {row["p50_ms"]:9.3f} ms ({ratio:5.2f}x){flag}')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time loadDB, the find* queries, getLines, findUser, getInfo, filter scans and the notes operations on generated data')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='user counts, comma separated')
+    parser.add_argument('--items', type=int, default=ITEMS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--calls', type=int, default=200, help='calls per read operation')
+    parser.add_argument('--note-calls', type=int, default=50, help='calls per notes write')
+    parser.add_argument('--backends', default='sqlite,json,journal')
+    parser.add_argument('--output', type=Path, help='defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BASE', 'NEW'), help='compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare))
+
+    commit = gitCommit()
+    report = {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "sizes": {},
+    }
+    backends = tuple(backend.strip() for backend in args.backends.split(',') if backend.strip())
+    for users in (int(size) for size in args.sizes.split(',')):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            report["sizes"][str(users)] = pool.submit(runSize, users, args.items, args.seed, args.calls, args.note_calls, backends).result()
+
+    output = args.output or Path('benchmarks') / 'results' / f'{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+import threading
+
+
+class ResultCache:
+    # LRU of encoded result files, bounded by total payload bytes (size is given when it isn't len(payload)). Keys end with the snapshot
+    # version, so a new snapshot can never serve old results; the old entries are dropped as
+    # soon as a newer version is stored, and results for an older one are never stored.
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple] = OrderedDict() # key -> (payload, size)
+        self.lock = threading.Lock()
+        self.size = 0
+        self.version = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: tuple, payload, size: int | None = None):
+        size = len(payload) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            version = key[-1]
+            if self.version is not None and version < self.version:
+                return # a query that started on the previous snapshot, finishing after the swap
+            if version != self.version:
+                self.stats["invalidations"] += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (payload, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.stats["evictions"] += 1
+
+    def getStats(self) -> dict:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
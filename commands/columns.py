@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import Dict, List
+
+try:
+    import numpy as np
+except ImportError: # numpy is optional, lines.py falls back to the postings index without it
+    np = None
+
+
+available = np is not None
+
+
+@dataclass
+class Columns:
+    userids: "np.ndarray" # int64, sorted, one row per user
+    private: "np.ndarray" # bool
+    terminated: "np.ndarray" # bool
+    verified: "np.ndarray" # bool
+    value: "np.ndarray" # int64, precomputed portfolio value
+    asset_indptr: "np.ndarray" # CSR user x item, row i owns asset_items[asset_indptr[i]:asset_indptr[i+1]]
+    asset_items: "np.ndarray" # int32 index into item_ids
+    asset_counts: "np.ndarray" # int32 copies held
+    item_ids: List[str]
+    item_index: Dict[str, int]
+    collectible_indptr: "np.ndarray" # CSR user x collectible, indexes into the snapshot's sorted collectible_names
+    collectible_items: "np.ndarray"
+
+
+def buildColumns(snap) -> Columns:
+    keys = sorted(snap.users_by_userid, key=int)
+    n = len(keys)
+
+    userids = np.fromiter((int(k) for k in keys), dtype=np.int64, count=n)
+    private = np.zeros(n, dtype=bool)
+    terminated = np.zeros(n, dtype=bool)
+    verified = np.zeros(n, dtype=bool)
+
+    item_ids = sorted(snap.item_value)
+    item_index = {itemID: i for i, itemID in enumerate(item_ids)}
+    collectible_index = {name: i for i, name in enumerate(snap.collectible_names)}
+
+    asset_indptr = np.zeros(n + 1, dtype=np.int64)
+    collectible_indptr = np.zeros(n + 1, dtype=np.int64)
+    asset_items, asset_counts, collectible_items = [], [], []
+
+    for row, key in enumerate(keys):
+        user = snap.users_by_userid[key]
+        private[row] = bool(user.private)
+        terminated[row] = bool(user.terminated)
+        verified[row] = bool(user.verified)
+
+        for itemID, amount in user.assetCounts():
+            if itemID not in item_index:
+                item_index[itemID] = len(item_ids)
+                item_ids.append(itemID)
+            asset_items.append(item_index[itemID])
+            asset_counts.append(amount)
+        asset_indptr[row + 1] = len(asset_items)
+
+        seen = set()
+        for collectible in user.collectibles:
+            index = collectible_index.get(collectible.lower())
+            if index is not None and index not in seen: # terminated users have no collectible postings
+                seen.add(index)
+                collectible_items.append(index)
+        collectible_indptr[row + 1] = len(collectible_items)
+
+    asset_items = np.asarray(asset_items, dtype=np.int32)
+    asset_counts = np.asarray(asset_counts, dtype=np.int32)
+
+    return Columns(
+        userids=userids,
+        private=private,
+        terminated=terminated,
+        verified=verified,
+        value=sumValues(asset_indptr, asset_items, asset_counts, item_ids, snap.item_value),
+        asset_indptr=asset_indptr,
+        asset_items=asset_items,
+        asset_counts=asset_counts,
+        item_ids=item_ids,
+        item_index=item_index,
+        collectible_indptr=collectible_indptr,
+        collectible_items=np.asarray(collectible_items, dtype=np.int32),
+    )
+
+
+def sumValues(indptr, items, counts, item_ids: List[str], item_value: Dict[str, int]) -> "np.ndarray":
+    # Unpriced items count as 0, same as the snapshot's user_value
+    prices = np.asarray([item_value.get(itemID) or 0 for itemID in item_ids], dtype=np.int64)
+    totals = np.concatenate(([0], np.cumsum(prices[items] * counts, dtype=np.int64)))
+    return totals[indptr[1:]] - totals[indptr[:-1]]
+
+def rowsOf(indptr: "np.ndarray", mask: "np.ndarray") -> "np.ndarray":
+    # CSR entry positions -> owning rows, deduped and ascending
+    positions = np.flatnonzero(mask)
+    return np.unique(np.searchsorted(indptr, positions, side='right') - 1)
+
+def filterRows(cols: Columns, rows: "np.ndarray", verified: bool | None = None) -> List[int]:
+    keep = ~cols.terminated[rows]
+    if verified is not None:
+        keep &= cols.verified[rows] == bool(verified)
+    return cols.userids[rows[keep]].tolist()
+
+def findHolders(cols: Columns, itemID: str, verified: bool | None = None) -> List[int]:
+    index = cols.item_index.get(itemID)
+    if index is None:
+        return []
+    return filterRows(cols, rowsOf(cols.asset_indptr, cols.asset_items == index), verified)
+
+def findCollectibleHolders(cols: Columns, start: int, end: int, verified: bool | None = None) -> List[int]:
+    # start/end is the bisected prefix range over the sorted collectible names
+    if start >= end:
+        return []
+    items = cols.collectible_items
+    return filterRows(cols, rowsOf(cols.collectible_indptr, (items >= start) & (items < end)), verified)
+
+def findRows(cols: Columns, userids) -> "np.ndarray":
+    wanted = np.asarray([int(userid) for userid in userids], dtype=np.int64)
+    rows = np.searchsorted(cols.userids, wanted)
+    rows = np.minimum(rows, max(len(cols.userids) - 1, 0))
+    found = (cols.userids[rows] == wanted) if len(cols.userids) else np.zeros(len(wanted), dtype=bool)
+    rows = rows[found]
+    return rows[~cols.terminated[rows]]
+
+def setValues(cols: Columns, user_value: Dict[str, int], userids) -> None:
+    userids = list(userids)
+    if not userids:
+        return
+    rows = np.searchsorted(cols.userids, np.asarray([int(userid) for userid in userids], dtype=np.int64))
+    cols.value[rows] = [user_value.get(str(userid), 0) for userid in userids]
@@ -1,522 +1,693 @@
-from discord.ext import commands
-from discord.ui import Button, View
-from commands import notes
-from commands import lines
-
-import discord
-import json
-import io
-import math
-
-intents = discord.Intents.all()
-intents.message_content = True
-client = commands.Bot(command_prefix="$", intents=intents, help_command=None)
-
-with open('data\\whitelist.json') as whitelistFile:
-    whitelist = json.load(whitelistFile)
-
-def whitelistCheck():
-    def predicate(ctx: commands.Context):
-        return str(ctx.author.id) in whitelist
-    return commands.check(predicate)
-
-class YesNoButtons(View):
-        def __init__(self):
-            super().__init__()
-            self.result = None
-
-        @discord.ui.button(label="Yes", style=discord.ButtonStyle.green)
-        async def yesButton(self, interaction: discord.Interaction):
-            self.result = True
-            self.stop()
-        
-
-        @discord.ui.button(label="No", style=discord.ButtonStyle.red)
-        async def noButton(self, interaction: discord.Interaction):
-            self.result = False
-            self.stop()
-
-
-@client.command()
-@whitelistCheck()
-async def viewNotes(ctx, userid: str = None):
-    if userid is None:
-        await ctx.reply(f"Incorrect use, $viewNotes 'userid'")
-        return
-    
-    await viewNote(ctx, userid)
-    
-@client.hybrid_command(name="viewnotes", usage="/viewnotes", help='View notes for specified user')
-@whitelistCheck()
-async def viewNote(ctx, userid: str):
-    s = notes.viewNote(userid)
-    if s:
-        msg = s.pop(next(reversed(s))) # notes are the last item in the dict, pop it and save it, inorder to print it separately
-        s = json.dumps(s, indent=4)
-
-        await ctx.send(f'```json\n{s}```' + f'```\n{msg}```')
-    else:
-        await ctx.send(f'No notes for this user, use /changeInfo or /addNote to create a note')
-
-
-
-@client.command()
-@whitelistCheck()
-async def addNote(ctx, userid: str | None = None, *, message: str | None = None):
-    if not message or not userid:
-        await ctx.send(f"Incorrect usage of the command. $addNote 'userid' 'message (multiline notes permited)'" + f'\nuserid: {userid}\nmessage: {message}')
-        return
-    await addNotes(ctx, userid, message)
-
-@client.hybrid_command(name="addnote", usage="/addnote", help='Appends a note for specified user')
-@whitelistCheck()
-async def addNotes(ctx, userid: str, message: str):
-    
-    creator = whitelist.get(ctx.author.id)
-    notes.addMessage(userid, message, creator=creator)
-    await ctx.send(f"Added note for {userid}\nFor longer & custom notes, use $addNotes")
-
-
-
-@client.hybrid_command(name="changeinfo", usage="/changeinfo", help='Change attributes for a specified username, age, note, etc')
-@whitelistCheck()
-async def changeInfo(ctx, userid: str, username: str = None, age: str = None, profilePictureRating: str = None, message: str = None):
-    
-    s = notes.viewNote(userid)
-
-    if not s:
-        await ctx.send(f'No notes for this user, use changeInfo or addNote to create a note')
-        return
-
-    view = YesNoButtons()
-    embed = discord.Embed(
-        description=f"There's already an entry for {userid}\nDo you want to overwrite?",
-        color=discord.Color.purple()
-    )
-
-    message = await ctx.send(embed=embed, view=view)
-
-    await view.wait()
-    await message.delete()
-
-    if view.result is False:
-        return
-    
-    creator = whitelist.get(ctx.author.id)
-    notes.changeInfo(userid, username, age, profilePictureRating, message, creator=creator)
-
-    msg = s.pop(next(reversed(s)))
-    s = json.dumps(s, indent=4)
-
-    await ctx.send(f'```json\n{s}```' + f'```\n{msg}```')
-        
-
-@client.command()
-@whitelistCheck()
-async def showNotes(ctx, page: str = '0'):
-
-    if page.isdigit():
-        page = int(page)
-    else:
-        await ctx.send("Parameter isn't an integer, $showNotes 'Page Number'")
-        return
-    
-    await showNote(ctx, page)
-    
-@client.hybrid_command(name="shownote", usage="/shownotes", help='Shows all the created notes')
-@whitelistCheck()
-async def showNote(ctx, page: int = 0):
-    ENTRY_PER_PAGE = 10
-
-    s1, s2 = notes.viewNotes()
-
-    NUMPAGES = math.ceil(len(s1) / ENTRY_PER_PAGE)
-
-    if page > NUMPAGES:
-        pageStart = NUMPAGES
-
-    if page == 0:
-        pageStart = 1
-    else:
-        pageStart = page
-
-
-    class Page(View):
-        currPage: int
-
-        def __init__(self, currPage = 0):
-            super().__init__(timeout=30)
-            self.currPage = currPage
-
-        async def getPageEntries(self):
-            pageEntriesIds = list()
-            pageEntriesUsernames = list()
-
-            start = self.currPage * ENTRY_PER_PAGE
-
-            for i, x in enumerate(s1[start:]):
-                if i >= ENTRY_PER_PAGE:
-                    break
-                pageEntriesIds.append(x)
-                pageEntriesUsernames.append(s2[i+start])
-
-            
-            return pageEntriesIds, pageEntriesUsernames
-        
-        async def getEmbed(self):
-
-            ids, usernames = await self.getPageEntries()
-
-            embed = discord.Embed(
-                title="List of notes",
-                description=f"Page {self.currPage+1}/{NUMPAGES}",
-                color=discord.Color.from_rgb(10, 10, 10)
-            )
-
-            embed.add_field(
-                name = '',
-                value=f"{':\n'.join(ids) + ':'}",
-                inline=True
-            )
-            embed.add_field(
-                name = '',
-                value=f"{'\n'.join(usernames)}",
-                inline=True
-            )
-
-            return embed
-        
-        def updateButtons(self):
-
-            self.prevButton.disabled = (self.currPage == 0)
-            self.nextButton.disabled = (self.currPage == NUMPAGES - 1)
-        
-        @discord.ui.button(label='<', style=discord.ButtonStyle.secondary)
-        async def prevButton(self, interaction: discord.Interaction, button: Button):
-            self.currPage -= 1
-
-            self.updateButtons()
-
-            embed = await self.getEmbed()
-
-            await interaction.response.edit_message(embed=embed, view=self)
-
-        @discord.ui.button(label='>', style=discord.ButtonStyle.secondary)
-        async def nextButton(self, interaction: discord.Interaction, button: Button):
-            self.currPage += 1
-
-            self.updateButtons()
-
-            embed = await self.getEmbed()
-
-            await interaction.response.edit_message(embed=embed, view=self)
-        
-        @discord.ui.button(label='First', style=discord.ButtonStyle.secondary)
-        async def firstButton(self, interaction: discord.Interaction, button: Button):
-            self.currPage = 0
-
-            self.updateButtons()
-
-            embed = await self.getEmbed()
-
-            await interaction.response.edit_message(embed=embed, view=self)
-        
-        @discord.ui.button(label='Last', style=discord.ButtonStyle.secondary)
-        async def lastButton(self, interaction: discord.Interaction, button: Button):
-            self.currPage = NUMPAGES - 1
-
-            self.updateButtons()
-
-            embed = await self.getEmbed()
-
-            await interaction.response.edit_message(embed=embed, view=self)
-
-    p = Page(pageStart-1)
-    p.updateButtons()
-   
-    embed = await p.getEmbed()
-
-    await ctx.send(embed=embed, view=p)
-
-
-
-@client.command()
-@whitelistCheck()
-async def removeNote(ctx, userid: str | None = None):
-    if not userid:
-        await ctx.send(f"Incorrect usage of the command. $removeNote 'userid'" + f'\nuserid: {userid}')
-        return
-    
-    await removeNotes(ctx, userid)
-
-@client.hybrid_command(name="removenote", usage="/removenote", help='Remove all notes from specified user')
-@whitelistCheck()
-async def removeNotes(ctx, userid: str):
-    
-    if notes.removeNote(userid) == True:
-        await ctx.send(f"Removed note for {userid}")
-    else:
-        await ctx.send(f"There is no note for {userid}")
-
-
-
-@client.command()
-@whitelistCheck()
-async def findUser(ctx, username: str = None):
-    if username is None:
-        await ctx.reply(f"Incorrect use, $findUser 'username'")
-        return
-    
-    await findUsers(ctx, username)
-
-@client.hybrid_command(name="findusers", usage="/finduser", help="Shows a list of userids based on given username")
-@whitelistCheck()
-async def findUsers(ctx, username: str):
-    s = lines.findUser(username.lower())
-
-    if not s:
-        embed = discord.Embed(
-        title='No userids found',
-        color=0x2F3136
-        )
-    else:
-        embed = discord.Embed(
-            title='List of userids found:',
-            description=f"{s}",
-            color=discord.Color.purple()
-            )
-    
-    embed.set_footer(text="Note: Usernames change, they can also be wrongly scraped\nUse 'userid' whenever possible at all times\nThis ensures the data you have is correct")
-
-    await ctx.send(embed=embed)
-
-
-
-@client.command()
-@whitelistCheck()
-async def getAssets(ctx, asset: str = None, verified:bool | None = None):
-    if asset is None:
-        await ctx.reply(f"Improper use, $getAssets 'asset' 'verified (yes/no)'")
-        return
-    
-    await getAsset(ctx, asset, verified)
-
-@client.hybrid_command(name="getasset", usage="/getassets", help='List users with a specified asset')
-@whitelistCheck()
-async def getAsset(ctx, asset: str, verified:bool | None = None):
-    users = lines.findLimiteds(asset, verified)
-    s = lines.getLines(users)
-
-    buf = io.BytesIO(s.encode("utf-8"))
-    buf.seek(0)
-    discord_file = discord.File(buf, filename="assets.txt")
-    await ctx.send(file=discord_file)
-
-
-
-@client.command()
-@whitelistCheck()
-async def getCollectibles(ctx, collectible: str = None, verified:bool | None = None):
-    if collectible is None:
-        await ctx.reply(f"Improper use, $getCollectibles 'collectible' 'verified (yes/no)'")
-        return
-    
-    await getCollectible(ctx, collectible, verified)
-
-@client.hybrid_command(name="getcollectible", usage="/getcollectible", help="List users with the specified collectible, collectible name can't be an acronym")
-@whitelistCheck()
-async def getCollectible(ctx, collectible: str, verified:bool | None = None):
-    users = lines.findCollectibles(collectible, verified)
-    s = lines.getLines(users)
-
-    buf = io.BytesIO(s.encode("utf-8"))
-    buf.seek(0)
-    discord_file = discord.File(buf, filename="collectibles.txt")
-    await ctx.send(file=discord_file)
-
-
-
-@client.command()
-@whitelistCheck()
-async def extractParts(ctx, char_to_seperate: str = None, index: int = None):
-    if not char_to_seperate or not index:
-        await ctx.send(f"Incorect usage of the command. $extractParts 'Character To Seperate' 'Index'" + f'\nuserid: {char_to_seperate}\nmessage: {index}')
-        return
-    
-    if not ctx.message.attachments:
-        await ctx.send("No attachments found.")
-        return
-    
-    file: discord.Attachment = ctx.message.attachments[0]
-    await extractParts(ctx, char_to_seperate, index, file)
-
-@client.hybrid_command(name="extractpart", usage="/extractparts", help='Extract a specified part from an attached file')
-@whitelistCheck()
-async def extractPart(ctx, char_to_seperate: str, index: int, file: discord.Attachment):
-    
-    view = YesNoButtons()
-    embed = discord.Embed(
-        description="Does your char have a space after?",
-        color=discord.Color.purple()
-    )
-
-    message = await ctx.send(embed=embed, view=view) # Slash commands in discord don't read spaces found after a string
-
-    await view.wait()
-    await message.delete()
-
-    if view.result is True:
-        char_to_seperate = char_to_seperate + " "
-
-    data = await file.read()
-    
-    try:
-        text = data.decode('utf-8')
-    except UnicodeDecodeError:
-        text = None
-    
-
-    s = lines.extractParts(text.splitlines(), char_to_seperate, index)
-    buf = io.BytesIO(s.encode("utf-8"))
-    buf.seek(0)
-    discord_file = discord.File(buf, filename="extractedParts.txt")
-    await ctx.send(f"Character to seperate by: `{char_to_seperate}`\nColumn #: `{index}`", file=discord_file)
-
-
-
-@client.command()
-@whitelistCheck()
-async def getInfo(ctx, userid: str = None):
-    if not userid:
-        await ctx.send('No userid provided')
-        return
-    
-    await getInfos(ctx, userid)
-    
-@client.hybrid_command(name="getinfos", usage="/getinfo", help='Shows all info for specified userid')
-@whitelistCheck()
-async def getInfos(ctx, userid: str):
-    data = lines.getInfo(userid)
-    if not data:
-        await ctx.send(f'No such user in db')
-        return
-    
-    s = json.dumps(data, indent=4)
-    buf = io.BytesIO(str(s).encode("utf-8"))
-    buf.seek(0)
-    discord_file = discord.File(buf, filename="info.txt")
-    await ctx.send(file=discord_file)
-
-
-
-@client.command()
-@whitelistCheck()
-async def help(ctx):
-    embed = discord.Embed(
-        description="List of commands.",
-        color=0x2F3136
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /viewnotes — View notes for the user\n" \
-        "‒ `userid`\n" \
-        "‒ `$viewNotes`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /addnote — Add a note to the user\n" \
-        "‒ `userid`, `message`\n" \
-        "‒ `$addNotes`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /removenote — Removed note for specified user\n" \
-        "‒ `userid`\n" \
-        "‒ `$removeNote`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /changeinfo — Edit user attributes\n" \
-        "‒ `userid`\n" \
-        "‒ `Optional: username, age, profilePictureRating, message`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /getassets — List users with an asset\n" \
-        "‒ `asset`\n" \
-        "‒ `Optional: verified`\n" \
-        "‒ `$getAssets`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /getCollectibles — List users with a collectible\n" \
-        "‒ `collectible`\n" \
-        "‒ `Optional: verified`\n" \
-        "‒ `$getCollectibles`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /extractparts — Extract parts from attached file\n" \
-        "‒ `Character To Seperate By`, `Index`, `Attached File`\n" \
-        "‒ `$extractParts`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /shownotes — Shows all the created notes\n"\
-            "‒ `Optional: Page Number`"\
-            "‒ `$showNotes`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /finduser — Shows a list of userids based on given username\n"\
-            "‒ `username`\n" \
-            "‒ `$findUser`",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /getinfo — Shows all info for specified userid\n" \
-        "‒ `userid`\n"\
-        "‒ `$getInfo`\n",
-        inline=False
-    )
-
-    embed.add_field(
-        name = '',
-        value="• /help — Show a list of commands",
-        inline=False
-    )
-
-    embed.set_footer(text="Use slash commands or $-prefix where supported.")
-    embed.timestamp = discord.utils.utcnow()
-
-    await ctx.send(embed=embed)
-    
-
-@client.event
-async def on_command_error(ctx, error):
-    if isinstance(error, commands.CheckFailure):
-        embed = discord.Embed(description="Whitelist only")
-        await ctx.send(embed=embed)
-        await ctx.send("https://tenor.com/view/i-love-you-i-love-you-so-much-gif-10862015092269957633")
-        return
-    raise error
-
+from discord.ext import commands
+from discord.ui import Button, View
+from commands import service
+from commands import resultfiles
+from commands import metrics
+from commands import lines
+
+import discord
+import asyncio
+import json
+import io
+import math
+import tempfile
+import time
+
+intents = discord.Intents.all()
+intents.message_content = True
+client = commands.Bot(command_prefix="$", intents=intents, help_command=None)
+
+with open('data\\whitelist.json') as whitelistFile:
+    whitelist = json.load(whitelistFile)
+
+def whitelistCheck():
+    def predicate(ctx: commands.Context):
+        return str(ctx.author.id) in whitelist
+    return commands.check(predicate)
+
+async def beforeCommand(ctx):
+    ctx.started = time.perf_counter()
+
+async def afterCommand(ctx):
+    # Runs after prefix commands and successful slash commands, on_command_error covers failed slash commands
+    started = getattr(ctx, 'started', None)
+    if started is None or ctx.command is None:
+        return
+    ctx.started = None
+    metrics.observe("command_seconds", ctx.command.qualified_name, time.perf_counter() - started)
+
+class YesNoButtons(View):
+        def __init__(self):
+            super().__init__()
+            self.result = None
+
+        @discord.ui.button(label="Yes", style=discord.ButtonStyle.green)
+        async def yesButton(self, interaction: discord.Interaction, button: Button):
+            self.result = True
+            self.stop()
+        
+
+        @discord.ui.button(label="No", style=discord.ButtonStyle.red)
+        async def noButton(self, interaction: discord.Interaction, button: Button):
+            self.result = False
+            self.stop()
+
+
+@client.command()
+@whitelistCheck()
+async def viewNotes(ctx, userid: str = None):
+    if userid is None:
+        await ctx.reply(f"Incorrect use, $viewNotes 'userid'")
+        return
+    
+    await viewNote(ctx, userid)
+    
+@client.hybrid_command(name="viewnotes", usage="/viewnotes", help='View notes for specified user')
+@whitelistCheck()
+async def viewNote(ctx, userid: str):
+    s = await service.viewNote(userid)
+    if s:
+        msg = s.pop(next(reversed(s))) # notes are the last item in the dict, pop it and save it, inorder to print it separately
+        s = json.dumps(s, indent=4)
+
+        await ctx.send(f'```json\n{s}```' + f'```\n{msg}```')
+    else:
+        await ctx.send(f'No notes for this user, use /changeInfo or /addNote to create a note')
+
+
+
+@client.command()
+@whitelistCheck()
+async def addNote(ctx, userid: str | None = None, *, message: str | None = None):
+    if not message or not userid:
+        await ctx.send(f"Incorrect usage of the command. $addNote 'userid' 'message (multiline notes permited)'" + f'\nuserid: {userid}\nmessage: {message}')
+        return
+    await addNotes(ctx, userid, message)
+
+@client.hybrid_command(name="addnote", usage="/addnote", help='Appends a note for specified user')
+@whitelistCheck()
+async def addNotes(ctx, userid: str, message: str):
+    
+    creator = whitelist.get(ctx.author.id)
+    await service.addMessage(userid, message, creator=creator)
+    await ctx.send(f"Added note for {userid}\nFor longer & custom notes, use $addNotes")
+
+
+
+@client.hybrid_command(name="changeinfo", usage="/changeinfo", help='Change attributes for a specified username, age, note, etc')
+@whitelistCheck()
+async def changeInfo(ctx, userid: str, username: str = None, age: str = None, profilePictureRating: str = None, message: str = None):
+    
+    s = await service.viewNote(userid)
+
+    if not s:
+        await ctx.send(f'No notes for this user, use changeInfo or addNote to create a note')
+        return
+
+    view = YesNoButtons()
+    embed = discord.Embed(
+        description=f"There's already an entry for {userid}\nDo you want to overwrite?",
+        color=discord.Color.purple()
+    )
+
+    prompt = await ctx.send(embed=embed, view=view)
+
+    await view.wait()
+    await prompt.delete()
+
+    if view.result is False:
+        return
+    
+    creator = whitelist.get(ctx.author.id)
+    await service.changeInfo(userid, username, age, profilePictureRating, message, creator=creator)
+
+    msg = s.pop(next(reversed(s)))
+    s = json.dumps(s, indent=4)
+
+    await ctx.send(f'```json\n{s}```' + f'```\n{msg}```')
+        
+
+@client.command()
+@whitelistCheck()
+async def showNotes(ctx, page: str = '0'):
+
+    if page.isdigit():
+        page = int(page)
+    else:
+        await ctx.send("Parameter isn't an integer, $showNotes 'Page Number'")
+        return
+    
+    await showNote(ctx, page)
+    
+@client.hybrid_command(name="shownote", usage="/shownotes", help='Shows all the created notes')
+@whitelistCheck()
+async def showNote(ctx, page: int = 0):
+    ENTRY_PER_PAGE = 10
+
+    NOTECOUNT = await service.countNotes()
+    NUMPAGES = math.ceil(NOTECOUNT / ENTRY_PER_PAGE)
+
+    if page == 0:
+        pageStart = 1
+    else:
+        pageStart = min(page, NUMPAGES)
+
+
+    class Page(View):
+        currPage: int
+
+        def __init__(self, currPage = 0):
+            super().__init__(timeout=30)
+            self.currPage = currPage
+            self.bounds = None # first and last (userid, username) shown, the buttons page on from them
+
+        async def getPageEntries(self, after = None, before = None, last = False):
+            # Only a page picked by number is looked up by offset, paging from the rows shown costs the same on any page
+            if last:
+                return await service.viewNotesBefore(None, NOTECOUNT - (NUMPAGES - 1) * ENTRY_PER_PAGE)
+            if after is not None:
+                return await service.viewNotesAfter(after, ENTRY_PER_PAGE)
+            if before is not None:
+                return await service.viewNotesBefore(before, ENTRY_PER_PAGE)
+            return await service.viewNotesPage(self.currPage, ENTRY_PER_PAGE)
+        
+        async def getEmbed(self, **where):
+
+            ids, usernames, self.bounds = await self.getPageEntries(**where)
+
+            embed = discord.Embed(
+                title="List of notes",
+                description=f"Page {self.currPage+1}/{NUMPAGES}",
+                color=discord.Color.from_rgb(10, 10, 10)
+            )
+
+            embed.add_field(
+                name = '',
+                value=f"{':\n'.join(ids) + ':'}",
+                inline=True
+            )
+            embed.add_field(
+                name = '',
+                value=f"{'\n'.join(usernames)}",
+                inline=True
+            )
+
+            return embed
+        
+        def updateButtons(self):
+
+            self.prevButton.disabled = (self.currPage == 0)
+            self.nextButton.disabled = (self.currPage == NUMPAGES - 1)
+        
+        @discord.ui.button(label='<', style=discord.ButtonStyle.secondary)
+        async def prevButton(self, interaction: discord.Interaction, button: Button):
+            self.currPage -= 1
+
+            self.updateButtons()
+
+            embed = await self.getEmbed(before=self.bounds and self.bounds[0])
+
+            await interaction.response.edit_message(embed=embed, view=self)
+
+        @discord.ui.button(label='>', style=discord.ButtonStyle.secondary)
+        async def nextButton(self, interaction: discord.Interaction, button: Button):
+            self.currPage += 1
+
+            self.updateButtons()
+
+            embed = await self.getEmbed(after=self.bounds and self.bounds[1])
+
+            await interaction.response.edit_message(embed=embed, view=self)
+        
+        @discord.ui.button(label='First', style=discord.ButtonStyle.secondary)
+        async def firstButton(self, interaction: discord.Interaction, button: Button):
+            self.currPage = 0
+
+            self.updateButtons()
+
+            embed = await self.getEmbed()
+
+            await interaction.response.edit_message(embed=embed, view=self)
+        
+        @discord.ui.button(label='Last', style=discord.ButtonStyle.secondary)
+        async def lastButton(self, interaction: discord.Interaction, button: Button):
+            self.currPage = NUMPAGES - 1
+
+            self.updateButtons()
+
+            embed = await self.getEmbed(last=True)
+
+            await interaction.response.edit_message(embed=embed, view=self)
+
+    p = Page(pageStart-1)
+    p.updateButtons()
+   
+    embed = await p.getEmbed()
+
+    await ctx.send(embed=embed, view=p)
+
+
+
+@client.command()
+@whitelistCheck()
+async def searchNote(ctx, *, query: str | None = None):
+    if not query:
+        await ctx.reply(f"Incorrect use, $searchNote 'words, \"a phrase\" or prefix*'")
+        return
+
+    await searchNotes(ctx, query)
+
+@client.hybrid_command(name="searchnotes", usage="/searchnotes", help='Search the text of all notes, supports "phrases" and prefix*')
+@whitelistCheck()
+async def searchNotes(ctx, query: str):
+    results = await service.searchNotes(query)
+
+    if not results:
+        embed = discord.Embed(
+        title='No notes found',
+        color=0x2F3136
+        )
+    else:
+        embed = discord.Embed(
+            title=f'Notes matching {query}',
+            color=discord.Color.purple()
+            )
+        for userid, username, text in results:
+            embed.add_field(name=f'{userid}: {username}', value=text or '-', inline=False)
+
+    await ctx.send(embed=embed)
+
+
+
+@client.command()
+@whitelistCheck()
+async def removeNote(ctx, userid: str | None = None):
+    if not userid:
+        await ctx.send(f"Incorrect usage of the command. $removeNote 'userid'" + f'\nuserid: {userid}')
+        return
+    
+    await removeNotes(ctx, userid)
+
+@client.hybrid_command(name="removenote", usage="/removenote", help='Remove all notes from specified user')
+@whitelistCheck()
+async def removeNotes(ctx, userid: str):
+    
+    if await service.removeNote(userid) == True:
+        await ctx.send(f"Removed note for {userid}")
+    else:
+        await ctx.send(f"There is no note for {userid}")
+
+
+
+@client.command()
+@whitelistCheck()
+async def findUser(ctx, username: str = None):
+    if username is None:
+        await ctx.reply(f"Incorrect use, $findUser 'username'")
+        return
+    
+    await findUsers(ctx, username)
+
+@client.hybrid_command(name="findusers", usage="/finduser", help="Shows a list of userids based on given username")
+@whitelistCheck()
+async def findUsers(ctx, username: str):
+    s = await service.findUser(username.lower())
+    similar = await service.searchUsers(username) if not s else None
+
+    if similar:
+        embed = discord.Embed(
+            title='No exact match, closest usernames:',
+            description='\n'.join(f"{name}: {', '.join(ids)}" for name, ids in similar),
+            color=discord.Color.purple()
+            )
+    elif not s:
+        embed = discord.Embed(
+        title='No userids found',
+        color=0x2F3136
+        )
+    else:
+        embed = discord.Embed(
+            title='List of userids found:',
+            description=f"{s}",
+            color=discord.Color.purple()
+            )
+    
+    embed.set_footer(text="Note: Usernames change, they can also be wrongly scraped\nUse 'userid' whenever possible at all times\nThis ensures the data you have is correct")
+
+    await ctx.send(embed=embed)
+
+
+
+def packParts(parts, limit: int):
+    # Discord applies the upload limit to a whole message and takes at most 10 attachments, so parts are grouped
+    # until the next one would go over either; a part is never over the limit on its own (see resultfiles.PartWriter)
+    messages = []
+    batch, total = [], 0
+    for filename, fp in parts:
+        size = fp.seek(0, io.SEEK_END)
+        fp.seek(0)
+        if batch and (len(batch) == 10 or total + size > limit):
+            messages.append(batch)
+            batch, total = [], 0
+        batch.append((filename, fp))
+        total += size
+    if batch:
+        messages.append(batch)
+    return messages
+
+async def sendResult(ctx, result: resultfiles.Result):
+    note = result.note
+    if len(result.parts) > 1:
+        note = f"{result.rows} rows split into {len(result.parts)} files\n{note}".strip()
+    size = sum(fp.seek(0, io.SEEK_END) for _, fp in result.parts)
+    limit = ctx.guild.filesize_limit if ctx.guild else resultfiles.FILE_LIMIT
+    with metrics.timer("send_seconds", ctx.command.qualified_name if ctx.command else ''):
+        for batch in packParts(result.parts, limit):
+            files = [discord.File(fp, filename=filename) for filename, fp in batch]
+            await ctx.send(note[:2000] or None, files=files)
+            note = ''
+    metrics.add("bytes_written_total", "discord upload", size)
+
+def resultOptions(ctx, format, columns, compress):
+    limit = ctx.guild.filesize_limit if ctx.guild else resultfiles.FILE_LIMIT
+    return resultfiles.parseOptions(format, columns, compress, limit)
+
+@client.command()
+@whitelistCheck()
+async def getAssets(ctx, asset: str = None, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    if asset is None:
+        await ctx.reply(f"Improper use, $getAssets 'asset' 'verified (yes/no)' 'format (txt/csv/ndjson)' 'columns (username,userid,...)' 'compress (gzip/zip)'")
+        return
+    
+    await getAsset(ctx, asset, verified, format, columns, compress)
+
+@client.hybrid_command(name="getasset", usage="/getassets", help='List users with a specified asset')
+@whitelistCheck()
+async def getAsset(ctx, asset: str, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    try:
+        options = resultOptions(ctx, format, columns, compress)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
+
+    result = await service.getAssetFile(asset, verified, options)
+    await sendResult(ctx, result)
+
+
+
+@client.command()
+@whitelistCheck()
+async def getCollectibles(ctx, collectible: str = None, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    if collectible is None:
+        await ctx.reply(f"Improper use, $getCollectibles 'collectible' 'verified (yes/no)' 'format (txt/csv/ndjson)' 'columns (username,userid,...)' 'compress (gzip/zip)'")
+        return
+    
+    await getCollectible(ctx, collectible, verified, format, columns, compress)
+
+@client.hybrid_command(name="getcollectible", usage="/getcollectible", help="List users with the specified collectible, collectible name can't be an acronym")
+@whitelistCheck()
+async def getCollectible(ctx, collectible: str, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    try:
+        options = resultOptions(ctx, format, columns, compress)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
+
+    result = await service.getCollectibleFile(collectible, verified, options)
+    await sendResult(ctx, result)
+
+
+
+@client.command()
+@whitelistCheck()
+async def queryAssets(ctx, expression: str = None, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    if expression is None:
+        await ctx.reply(f"Improper use, $queryAssets \"'asset' AND NOT 'asset' OR c:'collectible'\" 'verified (yes/no)' 'format (txt/csv/ndjson)' 'columns (username,userid,...)' 'compress (gzip/zip)'")
+        return
+    
+    await queryAsset(ctx, expression, verified, format, columns, compress)
+
+@client.hybrid_command(name="queryassets", usage="/queryassets", help='List users matching e.g. G82 AND NOT A80 OR c:bmw, c~m4, u:name, value>50000, private:yes')
+@whitelistCheck()
+async def queryAsset(ctx, expression: str, verified:bool | None = None, format: str = "txt", columns: str = None, compress: str = None):
+    try:
+        options = resultOptions(ctx, format, columns, compress)
+        result = await service.getQueryFile(expression, verified, options)
+    except ValueError as e: # bad options or a QueryError
+        await ctx.send(f"Couldn't run that query: {e}")
+        return
+
+    await sendResult(ctx, result)
+
+
+
+@client.command()
+@whitelistCheck()
+async def extractParts(ctx, char_to_seperate: str = None, index: str = None, quoted: bool = False):
+    if not char_to_seperate or not index:
+        await ctx.send(f"Incorect usage of the command. $extractParts 'Character To Seperate' 'Index (or 1,3)' 'quoted (yes/no)'" + f'\nuserid: {char_to_seperate}\nmessage: {index}')
+        return
+    
+    if not ctx.message.attachments:
+        await ctx.send("No attachments found.")
+        return
+    
+    file: discord.Attachment = ctx.message.attachments[0]
+    await extractPart(ctx, char_to_seperate, index, file, quoted)
+
+@client.hybrid_command(name="extractpart", usage="/extractparts", help='Extract the specified parts (e.g. 2 or 1,3) from an attached file')
+@whitelistCheck()
+async def extractPart(ctx, char_to_seperate: str, index: str, file: discord.Attachment, quoted: bool = False):
+    SPOOL_SIZE = 8 << 20 # bigger files go to a temp file on disk instead of memory
+
+    indexes = [x.strip() for x in str(index).split(',')]
+    if not all(x.isdigit() and int(x) > 0 for x in indexes):
+        await ctx.send(f"Index has to be a column number or a list like 1,3, got `{index}`")
+        return
+    
+    view = YesNoButtons()
+    embed = discord.Embed(
+        description="Does your char have a space after?",
+        color=discord.Color.purple()
+    )
+
+    message = await ctx.send(embed=embed, view=view) # Slash commands in discord don't read spaces found after a string
+
+    await view.wait()
+    await message.delete()
+
+    if view.result is True:
+        char_to_seperate = char_to_seperate + " "
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as source, tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as output:
+        await service.download(file.url, source)
+        stats = await service.extractPartsFile(source, output, char_to_seperate, [int(x) for x in indexes], quoted)
+
+        output.seek(0)
+        discord_file = discord.File(output, filename="extractedParts.txt")
+        await ctx.send(f"Character to seperate by: `{char_to_seperate}`\nColumn #: `{index}`\n"
+                       f"{stats['rows']} rows from {stats['bytes_in'] / (1 << 20):.1f} MB in {stats['seconds']:.2f}s ({stats['mb_per_s']:.1f} MB/s)", file=discord_file)
+
+
+
+@client.command()
+@whitelistCheck()
+async def getInfo(ctx, userid: str = None):
+    if not userid:
+        await ctx.send('No userid provided')
+        return
+    
+    await getInfos(ctx, userid)
+    
+@client.hybrid_command(name="getinfos", usage="/getinfo", help='Shows all info for specified userid')
+@whitelistCheck()
+async def getInfos(ctx, userid: str):
+    data = await service.getInfo(userid)
+    if not data:
+        await ctx.send(f'No such user in db')
+        return
+    
+    s = json.dumps(data, indent=4)
+    buf = io.BytesIO(str(s).encode("utf-8"))
+    buf.seek(0)
+    discord_file = discord.File(buf, filename="info.txt")
+    await ctx.send(file=discord_file)
+
+
+
+def statsTable(rows, limit: int = 8) -> str:
+    table = [f'{"":<22}{"n":>6}{"p50":>9}{"p95":>9}{"p99":>9}']
+    for label, count, p50, p95, p99 in rows[:limit]:
+        table.append(f'{label[:21]:<22}{count:>6}{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}{p99 * 1000:>9.1f}')
+    return '```\n' + '\n'.join(table) + '\n```' if rows else 'Nothing yet'
+
+@client.hybrid_command(name="stats", usage="/stats", help='Latency per command, lock waits, bytes and rows scanned since the bot started')
+@whitelistCheck()
+async def showStats(ctx):
+    embed = discord.Embed(title="Stats since start (ms)", color=0x2F3136)
+    embed.add_field(name="Commands", value=statsTable(metrics.summary("command_seconds")), inline=False)
+    embed.add_field(name="Storage and queries", value=statsTable(metrics.summary("call_seconds")), inline=False)
+    embed.add_field(name="Lock waits", value=statsTable(metrics.summary("lock_wait_seconds")), inline=False)
+    embed.add_field(name="Discord uploads", value=statsTable(metrics.summary("send_seconds")), inline=False)
+
+    totals = [f'{label}: {value / (1 << 20):.1f} MB read' for label, value in metrics.totals("bytes_read_total")[:4]]
+    totals += [f'{label}: {value / (1 << 20):.1f} MB written' for label, value in metrics.totals("bytes_written_total")[:4]]
+    totals += [f'{label}: {int(value)} rows' for label, value in metrics.totals("rows_scanned_total")[:6]]
+    embed.add_field(name="I/O and rows", value='\n'.join(totals) or 'Nothing yet', inline=False)
+
+    service_stats = service.getStats()
+    snapshot_stats = lines.getStats()
+    embed.add_field(name="Bot", value=f"Loop lag avg {service_stats['lag_avg_ms']:.1f} ms, max {service_stats['lag_max_ms']:.1f} ms\n"
+                    f"Result cache hit rate {service_stats['results_hit_rate']:.0%} ({service_stats['results_entries']} files)\n"
+                    f"Snapshot v{snapshot_stats['version']}, last reload {snapshot_stats['last_reload_seconds']:.2f}s", inline=False)
+    errors = metrics.totals("command_errors_total")
+    if errors:
+        embed.add_field(name="Errors", value=', '.join(f'{label}: {int(value)}' for label, value in errors[:8]), inline=False)
+    await ctx.send(embed=embed)
+
+
+
+@client.command()
+@whitelistCheck()
+async def help(ctx):
+    embed = discord.Embed(
+        description="List of commands.",
+        color=0x2F3136
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /viewnotes — View notes for the user\n" \
+        "‒ `userid`\n" \
+        "‒ `$viewNotes`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /addnote — Add a note to the user\n" \
+        "‒ `userid`, `message`\n" \
+        "‒ `$addNotes`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /removenote — Removed note for specified user\n" \
+        "‒ `userid`\n" \
+        "‒ `$removeNote`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /changeinfo — Edit user attributes\n" \
+        "‒ `userid`\n" \
+        "‒ `Optional: username, age, profilePictureRating, message`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /getassets — List users with an asset\n" \
+        "‒ `asset`\n" \
+        "‒ `Optional: verified, format (txt/csv/ndjson), columns, compress (gzip/zip)`\n" \
+        "‒ `$getAssets`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /getCollectibles — List users with a collectible\n" \
+        "‒ `collectible`\n" \
+        "‒ `Optional: verified, format (txt/csv/ndjson), columns, compress (gzip/zip)`\n" \
+        "‒ `$getCollectibles`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /queryassets — List users matching a query over assets and collectibles\n" \
+        "‒ `expression, e.g. G82 AND NOT A80 OR c:\"nissan 350z\"`\n" \
+        "‒ `c~m4 collectible containing, u:name username containing, value>50000, private:yes/no`\n" \
+        "‒ `Optional: verified, format (txt/csv/ndjson), columns, compress (gzip/zip)`\n" \
+        "‒ `$queryAssets`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /extractparts — Extract parts from attached file\n" \
+        "‒ `Character To Seperate By`, `Index`, `Attached File`\n" \
+        "‒ `$extractParts`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /searchnotes — Search the text of all notes\n" \
+        "‒ `words, \"a phrase\" or prefix*`\n" \
+        "‒ `$searchNote`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /shownotes — Shows all the created notes\n"\
+            "‒ `Optional: Page Number`"\
+            "‒ `$showNotes`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /finduser — Shows a list of userids based on given username\n"\
+            "‒ `username`\n" \
+            "‒ `$findUser`",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /getinfo — Shows all info for specified userid\n" \
+        "‒ `userid`\n"\
+        "‒ `$getInfo`\n",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /stats — Latency, lock waits and I/O per command",
+        inline=False
+    )
+
+    embed.add_field(
+        name = '',
+        value="• /help — Show a list of commands",
+        inline=False
+    )
+
+    embed.set_footer(text="Use slash commands or $-prefix where supported.")
+    embed.timestamp = discord.utils.utcnow()
+
+    await ctx.send(embed=embed)
+    
+
+@client.event
+async def on_command_error(ctx, error):
+    await afterCommand(ctx)
+    if ctx.command is not None:
+        metrics.add("command_errors_total", ctx.command.qualified_name)
+    if isinstance(error, commands.CheckFailure):
+        embed = discord.Embed(description="Whitelist only")
+        await ctx.send(embed=embed)
+        await ctx.send("https://tenor.com/view/i-love-you-i-love-you-so-much-gif-10862015092269957633")
+        return
+    original = error
+    while hasattr(original, 'original'): # hybrid commands wrap the handler's exception twice
+        original = original.original
+    if isinstance(original, asyncio.TimeoutError):
+        await ctx.send("That took too long, try again in a bit")
+        return
+    raise error
+
@@ -0,0 +1,343 @@
+from collections.abc import Sequence
+from typing import Dict, List, Tuple
+from pathlib import Path
+from array import array
+from commands import lines
+from commands import overlay
+
+import bisect
+import struct
+import mmap
+import json
+import sys
+
+
+SNAPSHOT_PATH = Path("data\\data.snapshot")
+MAGIC = b"DBSNAP01"
+HEADER = struct.Struct("<8sQ") # magic, manifest length
+
+# File layout: MAGIC | manifest length | manifest json | sections, each 8 byte aligned.
+# The manifest carries the source stamps/digests, itemdetails, the item/collectible posting
+# directories and where every section lives; everything per user sits in the typed sections.
+
+
+class StringTable(Sequence):
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class SortedView(Sequence):
+    # Strings picked out of the table through an index column, used for bisecting usernames
+    def __init__(self, strings: StringTable, order: memoryview):
+        self.strings = strings
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.strings[self.order[i]]
+
+
+class RowMap(overlay.Overlay):
+    # str(userid) -> decode(row), looked up by bisecting the sorted userid column.
+    # Writes (repricing, deltas) land in the overlay, the mapped file is read only.
+    def __init__(self, userids: memoryview, decode, summarize=None):
+        super().__init__()
+        self.userids = userids
+        self.decode = decode
+        self.summarize = summarize
+
+    def row(self, key):
+        try:
+            userid = int(key)
+        except (TypeError, ValueError):
+            return None
+        row = bisect.bisect_left(self.userids, userid)
+        if row < len(self.userids) and self.userids[row] == userid:
+            return row
+        return None
+
+    def lookup(self, key):
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.decode(row)
+
+    def baseContains(self, key):
+        return self.row(key) is not None
+
+    def summary(self, key):
+        # lines.summarize(self[key]) straight from the columns, only users a delta changed get decoded
+        if key in self.overlay:
+            user = self.overlay[key]
+            return lines.summarize(user) if user is not None else None
+        row = self.row(key)
+        return self.summarize(row) if row is not None else None
+
+    def baseKeys(self):
+        return (str(userid) for userid in self.userids)
+
+    def baseLen(self):
+        return len(self.userids)
+
+
+class UsernameMap(overlay.Overlay):
+    # lowercased username -> [userid, ...]
+    def __init__(self, names: SortedView, rows: memoryview, userids: memoryview):
+        super().__init__()
+        self.names = names
+        self.rows = rows
+        self.userids = userids
+
+    def lookup(self, key):
+        start = bisect.bisect_left(self.names, key)
+        end = bisect.bisect_right(self.names, key, start)
+        if start == end:
+            raise KeyError(key)
+        return [str(self.userids[self.rows[i]]) for i in range(start, end)]
+
+    def baseKeys(self):
+        last = None
+        for name in self.names:
+            if name != last:
+                yield name
+                last = name
+
+    def prefixed(self, prefix: str):
+        # The keys starting with prefix, bisected out of the sorted names instead of decoding every one
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + chr(0x10FFFF), start)
+        overlay, last = self.overlay, None
+        for i in range(start, end):
+            name = self.names[i]
+            if name != last and overlay.get(name, name) is not None:
+                yield name
+            last = name
+        for name, ids in overlay.items():
+            if ids is not None and name.startswith(prefix) and not self.baseContains(name):
+                yield name
+
+    def baseLen(self):
+        return sum(1 for _ in self.baseKeys())
+
+
+class PostingMap(overlay.Overlay):
+    def __init__(self, directory: Dict[str, list], postings: memoryview):
+        super().__init__()
+        self.directory = directory
+        self.postings = postings
+
+    def lookup(self, key):
+        start, middle, end = self.directory[key]
+        return (self.postings[start:middle], self.postings[middle:end])
+
+    def baseContains(self, key):
+        return key in self.directory
+
+    def baseKeys(self):
+        return iter(self.directory)
+
+    def baseLen(self):
+        return len(self.directory)
+
+
+def writeSnapshot(snap, path: Path = SNAPSHOT_PATH) -> None:
+    strings: Dict[str, int] = {}
+    def intern(s: str) -> int:
+        index = strings.get(s)
+        if index is None:
+            index = strings[s] = len(strings)
+        return index
+
+    keys = sorted(snap.users_by_userid, key=int)
+    userids = array('q')
+    flags = array('B')
+    usernames = array('I')
+    ages = array('I')
+    values = array('q')
+    collectible_indptr = array('Q', [0])
+    collectible_str = array('I')
+    asset_indptr = array('Q', [0])
+    asset_item = array('I')
+    variant_indptr = array('Q', [0])
+    variant_str = array('I')
+
+    for key in keys:
+        user = snap.users_by_userid[key]
+        userids.append(int(key))
+        flags.append(bool(user.private) | bool(user.terminated) << 1 | bool(user.verified) << 2)
+        usernames.append(intern(user.username or ""))
+        ages.append(intern(str(user.age or "")))
+        values.append(snap.user_value.get(key, 0))
+        collectible_str.extend(intern(c) for c in user.collectibles)
+        collectible_indptr.append(len(collectible_str))
+        for itemID, variants in user.assets.items():
+            asset_item.append(intern(itemID))
+            variant_str.extend(intern(str(v)) for v in variants)
+            variant_indptr.append(len(variant_str))
+        asset_indptr.append(len(asset_item))
+
+    name_order = sorted(range(len(keys)), key=lambda row: (snap.users_by_userid[keys[row]].username or "").lower())
+    name_rows = array('I', name_order)
+    name_str = array('I', (intern((snap.users_by_userid[keys[row]].username or "").lower()) for row in name_order))
+
+    postings = array('q')
+    def directory(holders) -> Dict[str, list]:
+        out = {}
+        for key, (unverified, verified) in holders.items():
+            start = len(postings)
+            postings.extend(unverified)
+            middle = len(postings)
+            postings.extend(verified)
+            out[key] = [start, middle, len(postings)]
+        return out
+
+    holders = directory(snap.holders)
+    collectible_holders = directory(snap.collectible_holders)
+
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for s in strings: # dicts keep insertion order, which is the interned index
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+
+    sections = {
+        "strings": array('B', blob), "string_offsets": offsets,
+        "userids": userids, "flags": flags, "usernames": usernames, "ages": ages, "values": values,
+        "collectible_indptr": collectible_indptr, "collectible_str": collectible_str,
+        "asset_indptr": asset_indptr, "asset_item": asset_item,
+        "variant_indptr": variant_indptr, "variant_str": variant_str,
+        "name_rows": name_rows, "name_str": name_str,
+        "postings": postings,
+    }
+
+    manifest = {
+        "stamps": snap.stamps,
+        "digests": snap.digests,
+        "items": snap.items,
+        "unpriced": snap.unpriced,
+        "holders": holders,
+        "collectible_holders": collectible_holders,
+        "collectible_names": snap.collectible_names,
+        "sections": {},
+    }
+    position = 0
+    for name, column in sections.items():
+        manifest["sections"][name] = [position, len(column), column.typecode]
+        position += -(-len(column) * column.itemsize // 8) * 8
+
+    header = json.dumps(manifest).encode('utf-8')
+    start = -(-(HEADER.size + len(header)) // 8) * 8
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with tmp.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(b'\0' * (start - HEADER.size - len(header)))
+        for name, column in sections.items():
+            if sys.byteorder != 'little':
+                column = array(column.typecode, column)
+                column.byteswap()
+            data = column.tobytes()
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+        f.flush()
+    tmp.replace(path)
+
+
+def readManifest(path: Path) -> Tuple[dict, int] | Tuple[None, int]:
+    try:
+        with path.open('rb') as f:
+            magic, length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                return None, 0
+            return json.loads(f.read(length)), -(-(HEADER.size + length) // 8) * 8
+    except (OSError, struct.error, ValueError):
+        return None, 0
+
+
+def openColumns(path: Path, stamps: tuple) -> Tuple[dict, Dict[str, memoryview]] | None:
+    # Only used when it was compiled from exactly these data.json/itemdetails.json files.
+    # Every process mapping the file shares the same pages, see scan.py
+    if sys.byteorder != 'little' or not path.exists():
+        return None
+    manifest, start = readManifest(path)
+    if manifest is None or [list(s) for s in stamps] != manifest["stamps"]:
+        return None
+
+    with path.open('rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    columns = {}
+    for name, (offset, length, typecode) in manifest["sections"].items():
+        size = array(typecode).itemsize
+        columns[name] = view[start + offset:start + offset + length * size].cast(typecode)
+    return manifest, columns
+
+
+def openSnapshot(path: Path, stamps: tuple):
+    opened = openColumns(path, stamps)
+    if opened is None:
+        return None
+    manifest, columns = opened
+
+    strings = StringTable(columns["strings"], columns["string_offsets"])
+    pool = lines.StringPool() # decoded users intern into it, it goes when this snapshot does
+    c = columns
+
+    def decodeUser(row: int):
+        flags = c["flags"][row]
+        assets = {}
+        for a in range(c["asset_indptr"][row], c["asset_indptr"][row + 1]):
+            assets[strings[c["asset_item"][a]]] = [strings[v] for v in c["variant_str"][c["variant_indptr"][a]:c["variant_indptr"][a + 1]]]
+        return lines.User.from_dict({
+            "username": strings[c["usernames"][row]],
+            "id": c["userids"][row],
+            "age": strings[c["ages"][row]],
+            "private": bool(flags & 1),
+            "terminated": bool(flags & 2),
+            "verified": bool(flags & 4),
+            "collectibles": [strings[s] for s in c["collectible_str"][c["collectible_indptr"][row]:c["collectible_indptr"][row + 1]]],
+            "assets": assets,
+        }, pool)
+
+    def summarizeUser(row: int):
+        flags = c["flags"][row]
+        return strings[c["usernames"][row]], c["userids"][row], strings[c["ages"][row]], bool(flags & 1), bool(flags & 2), bool(flags & 4)
+
+    users = RowMap(c["userids"], decodeUser, summarizeUser)
+    user_value = RowMap(c["userids"], lambda row: c["values"][row])
+    item_value, name_to_id = lines.buildItems(manifest["items"])
+
+    return lines.Snapshot(
+        users_by_userid=users,
+        username_to_id=UsernameMap(SortedView(strings, c["name_str"]), c["name_rows"], c["userids"]),
+        items=manifest["items"],
+        item_value=item_value,
+        name_to_id=name_to_id,
+        holders=PostingMap(manifest["holders"], c["postings"]),
+        collectible_names=manifest["collectible_names"],
+        collectible_holders=PostingMap(manifest["collectible_holders"], c["postings"]),
+        user_value=user_value,
+        unpriced=manifest["unpriced"],
+        stamps=stamps,
+        digests=tuple(manifest["digests"]),
+        strings=pool,
+    )
+
+
+if __name__ == '__main__':
+    lines.ENGINE = "index"
+    stamps = (lines.fileStamp(lines.DB_PATH), lines.fileStamp(lines.ITEMS_PATH))
+    digests = (lines.fileDigest(lines.DB_PATH), lines.fileDigest(lines.ITEMS_PATH))
+    writeSnapshot(lines.buildSnapshot(stamps, digests), SNAPSHOT_PATH)
+    print(f'Compiled {lines.DB_PATH} and {lines.ITEMS_PATH} into {SNAPSHOT_PATH}')
@@ -0,0 +1,169 @@
+from typing import Dict, List, Tuple
+from filelock import FileLock
+from pathlib import Path
+from commands import lines
+from commands import metrics
+
+import argparse
+import json
+import sys
+import os
+
+
+DELTA_PATH = Path("data\\data.delta")
+DELTA_LOCK_PATH = Path("data\\data.delta.lock")
+USER_OPS = ("upsert", "delete")
+ITEM_OPS = ("price", "item")
+
+# A delta is NDJSON, one op per line:
+#   {"op": "upsert", "id": "123", "user": {...}}   the whole record, as data.json would have it
+#   {"op": "delete", "id": "123"}
+#   {"op": "price", "id": "456", "value": 1500}    the price the bot values item 456 at
+#   {"op": "item", "id": "456", "details": [...]}  a whole itemdetails.json entry
+# User ops go to the journal at DELTA_PATH: a header line naming the data.json they apply on top of,
+# then the ops, only ever appended. Item ops are written into itemdetails.json, which gets repriced as usual.
+
+
+def parseOps(text: str) -> List[dict]:
+    ops = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {number}: not JSON ({e})")
+        if not isinstance(op, dict) or op.get("op") not in USER_OPS + ITEM_OPS:
+            raise ValueError(f"line {number}: op has to be one of {', '.join(USER_OPS + ITEM_OPS)}")
+
+        kind = op["op"]
+        if kind == "upsert":
+            user = op.get("user")
+            if not isinstance(user, dict):
+                raise ValueError(f"line {number}: upsert needs the user record")
+            userid = str(op.get("id", user.get("id")))
+            try:
+                lines.readUser(userid, user, lines.StringPool())
+            except ValueError as e:
+                raise ValueError(f"line {number}: {e}")
+            ops.append({"op": kind, "id": userid, "user": user})
+        elif kind == "delete":
+            if not str(op.get("id")).isdigit():
+                raise ValueError(f"line {number}: delete needs a numeric id")
+            ops.append({"op": kind, "id": str(op["id"])})
+        elif kind == "price":
+            if op.get("id") is None or isinstance(op.get("value"), bool) or not isinstance(op.get("value"), (int, float)):
+                raise ValueError(f"line {number}: price needs an item id and a number value")
+            ops.append({"op": kind, "id": str(op["id"]), "value": op["value"]})
+        else:
+            details = op.get("details")
+            if op.get("id") is None or not isinstance(details, list) or len(details) < 4 or not all(isinstance(v, (int, float)) for v in details[2:4]):
+                raise ValueError(f"line {number}: item needs an id and [name, code, msrp, resale, ...] details")
+            ops.append({"op": kind, "id": str(op["id"]), "details": details})
+    return ops
+
+
+def journalStamp(path: Path | None = None) -> tuple | None:
+    path = path or DELTA_PATH
+    try:
+        return lines.fileStamp(path)
+    except OSError:
+        return None
+
+def readHeader(path: Path) -> dict | None:
+    try:
+        with path.open('rb') as f:
+            header = f.readline()
+        return json.loads(header) if header.endswith(b'\n') else None
+    except (OSError, ValueError):
+        return None
+
+def readOps(base: str, offset: int = 0, path: Path | None = None) -> Tuple[List[dict], int]:
+    # The ops appended after offset, complete lines only; nothing when the journal belongs to another data.json.
+    # Appends are whole lines in one write and a reset is a replace, so reading needs no lock.
+    path = path or DELTA_PATH
+    try:
+        with path.open('rb') as f:
+            header = f.readline()
+            if not header.endswith(b'\n') or json.loads(header).get("base") != base:
+                return [], offset
+            offset = max(offset, len(header))
+            f.seek(offset)
+            data = f.read()
+    except (OSError, ValueError):
+        return [], offset
+
+    end = data.rfind(b'\n') + 1
+    metrics.add("bytes_read_total", path.name, end)
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()], offset + end
+
+def appendOps(ops: List[dict], path: Path | None = None, lock_path: Path | None = None):
+    # A journal for an older data.json is dropped, the rewritten data.json already has (or replaced) what it held
+    path, lock_path = path or DELTA_PATH, lock_path or DELTA_LOCK_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with metrics.acquired("data.delta.lock", FileLock(str(lock_path))):
+        stamp = list(lines.fileStamp(lines.DB_PATH))
+        header = readHeader(path)
+        if header is None or header.get("stamp") != stamp: # only hash data.json when it may have changed
+            digest = lines.fileDigest(lines.DB_PATH)
+            if header is None or header.get("base") != digest:
+                tmp = path.with_suffix('.delta.tmp')
+                tmp.write_bytes(json.dumps({"base": digest, "stamp": stamp}).encode('utf-8') + b'\n')
+                tmp.replace(path)
+
+        data = b''.join(json.dumps(op, ensure_ascii=False).encode('utf-8') + b'\n' for op in ops)
+        with path.open('ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.add("bytes_written_total", path.name, len(data))
+
+def applyItemOps(ops: List[dict], path: Path | None = None):
+    # itemdetails.json is small, it is rewritten whole and the watcher reprices only the holders of what moved
+    path = path or lines.ITEMS_PATH
+    itemdetails = lines.loadData(path)
+    items: Dict[str, list] = itemdetails.setdefault("items", {})
+    for op in ops:
+        if op["op"] == "item":
+            items[op["id"]] = op["details"]
+            continue
+        details = items.get(op["id"])
+        if details is None:
+            raise ValueError(f"item {op['id']} isn't in {path.name}, send it as an item op first")
+        details[3 if details[3] != -1 else 2] = op["value"] # the same slot buildItems reads the value from
+
+    tmp = path.with_suffix('.json.tmp')
+    tmp.write_text(json.dumps(itemdetails), encoding='utf-8')
+    tmp.replace(path)
+
+
+def ingest(text: str, refresh: bool = True) -> dict:
+    # Validates the whole delta before anything is written. With refresh the new snapshot is live on return,
+    # otherwise (the CLI, another process) the bot's watcher picks it up on its next tick.
+    ops = parseOps(text)
+    userOps = [op for op in ops if op["op"] in USER_OPS]
+    itemOps = [op for op in ops if op["op"] in ITEM_OPS]
+    if itemOps:
+        applyItemOps(itemOps)
+    if userOps:
+        appendOps(userOps)
+
+    summary = {kind: sum(1 for op in ops if op["op"] == kind) for kind in USER_OPS + ITEM_OPS}
+    if refresh:
+        summary["version"] = lines.refreshDB().version
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply NDJSON deltas (user upserts/deletes, item prices) without rewriting data.json')
+    parser.add_argument('files', nargs='+', help="delta files, - for stdin")
+    args = parser.parse_args()
+
+    for name in args.files:
+        text = sys.stdin.read() if name == '-' else Path(name).read_text(encoding='utf-8')
+        summary = ingest(text, refresh=False)
+        print(f'{name}: ' + ', '.join(f'{count} {kind}' for kind, count in summary.items() if count))
+
+
+if __name__ == '__main__':
+    main()
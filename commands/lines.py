@@ -1,160 +1,809 @@
-from dataclasses import dataclass
-from typing import Dict, List, Any
-from pathlib import Path
-
-import json
-
- 
-DB_PATH = Path("data\\data.json")
-ITEMS_PATH = Path("data\\itemdetails.json")
- 
-@dataclass
-class User:
-    username: str
-    userid: int
-    age: str
-    private: bool
-    terminated: bool
-    verified: bool
-    collectibles: List[str]
-    assets: Dict[str, List[str]]
- 
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> "User":
-        return cls(
-            username=data.get("username", ""),
-            userid=data.get("id", 0),
-            private=data.get("private", False),
-            terminated=data.get("terminated", False),
-            verified=data.get("verified", False),
-            collectibles=data.get("collectibles") or [],
-            assets=data.get("assets") or {},
-        )
- 
-def loadData(path: Path) -> dict:
-    with path.open('r', encoding='utf-8') as file:
-        return json.load(file)
- 
-_db_raw: Dict[str, dict] | None = None # raw version of the db
-_users_by_userid: Dict[str, User] | None = None # userid -> userObj
-_items: Dict[str, list] | None = None # Dict of all the collectibles
-_item_value: Dict[str, int] | None = None # Values of each asset
-_name_to_id: Dict[str, str] | None = None # List of names for an asset
-_username_to_id: Dict[str, str] # List of ids for any given username
-
-def loadDB():
-    global _db_raw, _users_by_userid, _items, _item_value, _name_to_id, _username_to_id
-    _db_raw = loadData(DB_PATH)
-    _users_by_userid = {}
-    _username_to_id = {}
-    for userid, userDetails in _db_raw.items():
-        userObj = User.from_dict(userDetails)
-        _users_by_userid[userid] = userObj
-        if _username_to_id.get(userObj.username):
-            newList = _username_to_id.get(userObj.username) + [userid]
-            _username_to_id[userObj.username.lower()] = newList
-        else:
-            _username_to_id[userObj.username.lower()] = [userid]
-
-    _items = loadData(ITEMS_PATH).get("items", {})
-
-    _item_value = {}
-    _name_to_id = {}
-
-    for item_id, values in _items.items():
-        value = values[3] if values[3] != -1 else values[2] # if values[3] is -1 it means you can't buy officially, use resale price instead of msrp
-        _item_value[item_id] = value
-        for name in values[:2]:
-            if name:
-                key = name.lower()
-                if key not in _name_to_id:
-                    _name_to_id[key] = item_id
-
- 
-def getValue(asset: str):
-    return _item_value.get(str(asset))
- 
-def findAssetID(asset: str):
-    return _name_to_id.get(asset.lower())
- 
-def findLimiteds(asset: str, verified: bool | None = None):
-    loadDB()
-    itemID = findAssetID(asset)
- 
-    if itemID:
-        users = list()
-        for user in _users_by_userid.values():
-            if user.terminated:
-                continue
-
-            if itemID not in user.assets:
-                continue
-
-            if verified is None or user.verified == verified:
-                users.append(user.userid)
-
-        return users
-    else:
-        return []
- 
-def getInfo(userid: str):
-    loadDB()
-    data = _db_raw.get(userid)
-
-    return data
- 
- 
-def findCollectibles(collectible: str, verified: bool | None = None):
-    loadDB()
-    users = list()
- 
-    for user in _users_by_userid.values():
-        if user.terminated:
-            continue
-        
-        if verified is None or user.verified == verified:
-            for x in user.collectibles:
-                if x.lower().startswith(collectible.lower()):
-                    users.append(user.userid)
-                    break
-    
-    return users
- 
-def extractParts(lines: list[str], charToSplit: str, index: int):
-    parts = list()
- 
-    index = int(index) - 1
-
-    for line in lines:
-        line = line.strip()
-        if line:
-            newLine = line.split(charToSplit)
-            if len(newLine) >= index:
-                part = newLine[index]
-                parts.append(part)
-    
-    return '\n'.join(parts)
- 
-def getLines(userids: list[str]):
-    lines = list()
- 
-    for userid in userids:
-        user = _users_by_userid.get(str(userid))
- 
-        if user:
-            if user.terminated == False:
-                value = 0
-                for limited, amount in user.assets.items():
-                    value +=  getValue(limited) * len(amount)
-    
-                lines.append(f'{user.username}, {user.userid}, {user.age}, {value}, {user.private}, {user.terminated}, {user.verified}')
-
-    new_line = ['username, userid, profilePictureRating, age, private, terminated, verified'] + lines
-    return '\n'.join(new_line)
-
-def findUser(username: str):
-    loadDB()
-    lines = _username_to_id.get(username)
-    if lines is None:
-        return False
-    return '\n'.join(lines)
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Any, Tuple
+from pathlib import Path
+from array import array
+from commands import columns
+from commands import compiled
+from commands import trigrams
+from commands import metrics
+from commands import recordindex
+from commands import overlay
+from commands import ingest
+
+import threading
+import hashlib
+import sys
+import codecs
+import time
+import csv
+import io
+import bisect
+import heapq
+import json
+
+
+DB_PATH = Path("data\\data.json")
+ITEMS_PATH = Path("data\\itemdetails.json")
+COMPILE_SNAPSHOTS = True # compile the snapshot in the background after a JSON load, so the next start can mmap it
+ENGINE = "index" # "columns" runs queries as numpy mask/gather ops over columns.Columns, see benchmarks/columns.py
+
+class StringPool:
+    # Item ids, variants and collectible names repeat across users, each is kept once and referred to by index.
+    # One per snapshot built from data.json, shared with the snapshots deltas make from it and dropped with them.
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def intern(self, s: str) -> int:
+        i = self.index.get(s)
+        if i is None:
+            with self.lock:
+                i = self.index.get(s)
+                if i is None:
+                    i = self.index[s] = len(self.strings)
+                    self.strings.append(s)
+        return i
+
+    def __getitem__(self, i: int) -> str:
+        return self.strings[i]
+
+EMPTY = array('I') # shared by every user without collectibles/assets, never written to
+
+
+@dataclass(slots=True)
+class User:
+    username: str
+    userid: int
+    age: str
+    private: bool
+    terminated: bool
+    verified: bool
+    collectible_ids: array # strings indexes, EMPTY when there are none
+    asset_data: array # [n, n item ids, n variant counts, the variants of each item in turn], all strings indexes
+    strings: StringPool # the snapshot's pool the indexes point into
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], strings: StringPool) -> "User":
+        intern = strings.intern
+        collectibles = data.get("collectibles")
+        assets = data.get("assets")
+        asset_data = EMPTY
+        if assets:
+            asset_data = array('I', [len(assets)])
+            asset_data.extend(map(intern, assets))
+            asset_data.extend(map(len, assets.values()))
+            asset_data.extend(intern(str(v)) for variants in assets.values() for v in variants)
+        age = data.get("age", "")
+        return cls(
+            username=data.get("username", ""),
+            userid=data.get("id", 0),
+            age=sys.intern(age) if isinstance(age, str) else age,
+            private=data.get("private", False),
+            terminated=data.get("terminated", False),
+            verified=data.get("verified", False),
+            collectible_ids=array('I', map(intern, collectibles)) if collectibles else EMPTY,
+            asset_data=asset_data,
+            strings=strings,
+        )
+
+    def assetCounts(self):
+        # (item id, how many), what values and holders need, without building the variant lists
+        data = self.asset_data
+        if not data:
+            return
+        n = data[0]
+        for i in range(1, n + 1):
+            yield self.strings[data[i]], data[i + n]
+
+    @property
+    def collectibles(self) -> List[str]:
+        strings = self.strings
+        return [strings[i] for i in self.collectible_ids]
+
+    @property
+    def assets(self) -> Dict[str, List[str]]:
+        data = self.asset_data
+        if not data:
+            return {}
+        n = data[0]
+        strings = self.strings
+        assets = {}
+        position = 2 * n + 1
+        for i in range(1, n + 1):
+            count = data[i + n]
+            assets[strings[data[i]]] = [strings[v] for v in data[position:position + count]]
+            position += count
+        return assets
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "username": self.username,
+            "id": self.userid,
+            "age": self.age,
+            "private": self.private,
+            "terminated": self.terminated,
+            "verified": self.verified,
+            "collectibles": self.collectibles,
+            "assets": self.assets,
+        }
+
+def loadData(path: Path) -> dict:
+    metrics.add("bytes_read_total", path.name, path.stat().st_size)
+    with path.open('r', encoding='utf-8') as file:
+        return json.load(file)
+
+def loadText(path: Path) -> str:
+    metrics.add("bytes_read_total", path.name, path.stat().st_size)
+    with path.open('r', encoding='utf-8') as file:
+        return file.read()
+
+
+@dataclass
+class Snapshot:
+    users_by_userid: Dict[str, User] # userid -> userObj
+    username_to_id: Dict[str, List[str]] # List of ids for any given username
+    items: Dict[str, list] # Dict of all the collectibles
+    item_value: Dict[str, int] # Values of each asset
+    name_to_id: Dict[str, str] # List of names for an asset
+    holders: Dict[str, Tuple[array, array]] = field(default_factory=dict) # item id -> (unverified, verified) sorted holder ids, terminated users left out
+    collectible_names: List[str] = field(default_factory=list) # sorted lowercased collectible names, searched with bisect
+    collectible_holders: Dict[str, Tuple[array, array]] = field(default_factory=dict) # lowercased collectible -> (unverified, verified) sorted holder ids
+    user_value: Dict[str, int] = field(default_factory=dict) # userid -> total value of the priced assets
+    unpriced: Dict[str, List[str]] = field(default_factory=dict) # userid -> asset ids missing from itemdetails.json
+    stamps: Tuple[tuple, tuple] = () # (mtime, size) of data.json and itemdetails.json
+    digests: Tuple[str, str] = () # content hash of data.json and itemdetails.json
+    records: Dict[str, dict | None] = field(default_factory=dict) # userid -> record from the delta journal, None once deleted
+    delta_stamp: tuple | None = None # (mtime, size) of the delta journal when it was last read
+    delta_offset: int = 0 # bytes of the journal already applied
+    version: int = 0
+    columns: Any = None # columns.Columns, built on first use when ENGINE is "columns"
+    trigrams: Any = None # trigrams.TrigramIndex over username_to_id, built in the background once the snapshot is live
+    trigrams_from: Any = None # while trigrams is None: the snapshot deltas were applied on top of, whose index is built first
+    trigram_changes: tuple = () # and the (added, removed) names of those deltas, layered onto that index once it is there
+    strings: StringPool = field(default_factory=StringPool) # what the users' indexes point into, see StringPool
+
+
+_snapshot: Snapshot | None = None # current snapshot, every query runs against this
+_refresh_lock = threading.Lock() # one rebuild at a time, queries never take it while the watcher runs
+_lazy_lock = threading.Lock() # columns/trigrams built on first use
+_trigram_lock = threading.Lock() # one trigram build at a time
+_watching = False
+_stats = {"hits": 0, "misses": 0, "reloads": 0, "reprices": 0, "deltas": 0, "skipped_ops": 0, "last_reload_seconds": 0.0}
+
+
+def fileStamp(path: Path) -> tuple:
+    st = path.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+def fileDigest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with path.open('rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def buildSnapshot(stamps: tuple = (), digests: tuple = (), version: int = 0) -> Snapshot:
+    # One pass over the text: users are converted a record at a time and their byte offsets go into data.index,
+    # the whole file is never held as a parsed tree
+    text = loadText(DB_PATH)
+    index = recordindex.IndexBuilder()
+    strings = StringPool()
+    users_by_userid = {}
+    for userid, offset, length, userDetails in recordindex.scanRecords(text):
+        users_by_userid[userid] = User.from_dict(userDetails, strings)
+        index.add(userid, offset, length)
+    del text
+    if stamps:
+        saveIndex(index, stamps[0])
+
+    username_to_id = {}
+    for userid, userObj in users_by_userid.items():
+        username_to_id.setdefault(userObj.username.lower(), []).append(userid)
+
+    items = loadData(ITEMS_PATH).get("items", {})
+    item_value, name_to_id = buildItems(items)
+
+    holders = buildHolders(users_by_userid)
+    collectible_holders = buildCollectibleHolders(users_by_userid)
+
+    user_value = {}
+    unpriced = {}
+    for userid, user in users_by_userid.items():
+        if not user.terminated:
+            setUserValue(userid, user, item_value, user_value, unpriced)
+
+    return Snapshot(
+        users_by_userid=users_by_userid,
+        username_to_id=username_to_id,
+        items=items,
+        item_value=item_value,
+        name_to_id=name_to_id,
+        holders=holders,
+        collectible_names=sorted(collectible_holders),
+        collectible_holders=collectible_holders,
+        user_value=user_value,
+        unpriced=unpriced,
+        stamps=stamps,
+        digests=digests,
+        version=version,
+        strings=strings,
+    )
+
+
+def saveIndex(index: recordindex.IndexBuilder, stamp: tuple):
+    try:
+        index.write(stamp, recordindex.INDEX_PATH)
+    except OSError as e: # getInfo falls back to the snapshot until the next load writes it
+        print(f'Could not write {recordindex.INDEX_PATH}: {e}')
+
+def buildItems(items: Dict[str, list]) -> Tuple[Dict[str, int], Dict[str, str]]:
+    item_value = {}
+    name_to_id = {}
+
+    for item_id, values in items.items():
+        value = values[3] if values[3] != -1 else values[2] # if values[3] is -1 it means you can't buy officially, use resale price instead of msrp
+        item_value[item_id] = value
+        for name in values[:2]:
+            if name:
+                key = name.lower()
+                if key not in name_to_id:
+                    name_to_id[key] = item_id
+
+    return item_value, name_to_id
+
+def setUserValue(userid: str, user: User, item_value: Dict[str, int], user_value: Dict[str, int], unpriced: Dict[str, List[str]]):
+    value = 0
+    missing = list()
+    for limited, amount in user.assetCounts():
+        price = item_value.get(limited)
+        if price is None:
+            missing.append(limited)
+        else:
+            value += price * amount
+
+    user_value[userid] = value
+    if missing:
+        unpriced[userid] = missing
+    else:
+        unpriced.pop(userid, None)
+
+def repriceSnapshot(snap: Snapshot, items: Dict[str, list]) -> Snapshot:
+    # Only the holders of items whose price moved (or that appeared/disappeared) get their totals redone.
+    # Returns a new snapshot, the old one stays untouched for queries still running on it.
+    item_value, name_to_id = buildItems(items)
+    changed = {itemID for itemID in item_value.keys() | snap.item_value.keys() if item_value.get(itemID) != snap.item_value.get(itemID)}
+
+    affected = set()
+    for itemID in changed:
+        postings = snap.holders.get(itemID)
+        if postings:
+            affected.update(selectPostings(postings))
+
+    user_value = snap.user_value.copy()
+    unpriced = dict(snap.unpriced)
+    for userid in affected:
+        userid = str(userid)
+        setUserValue(userid, snap.users_by_userid[userid], item_value, user_value, unpriced)
+
+    cols = snap.columns
+    if cols is not None:
+        cols = replace(cols, value=cols.value.copy())
+        columns.setValues(cols, user_value, affected)
+
+    return replace(snap, items=items, item_value=item_value, name_to_id=name_to_id, user_value=user_value, unpriced=unpriced, columns=cols)
+
+def postingKeys(user: User | None) -> Tuple[list, list]:
+    # (item ids, lowercased collectibles) the user is a holder of, none while terminated
+    if user is None or user.terminated:
+        return [], []
+    return [itemID for itemID, _ in user.assetCounts()], [name.lower() for name in user.collectibles]
+
+def readUser(userid: str, record, strings: StringPool) -> User:
+    # An upsert's record the way applyDelta takes it, ValueError when the id isn't numeric or it isn't shaped like data.json's
+    if not userid.isdigit():
+        raise ValueError(f"user id {userid!r} isn't numeric")
+    if not isinstance(record, dict) or str(record.get("id", userid)) != userid:
+        raise ValueError(f"user {userid} needs a record with the same id")
+    try:
+        user = User.from_dict(record, strings)
+        user.username.lower()
+        [name.lower() for name in user.collectibles]
+        list(user.assetCounts())
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"user {userid} isn't a {DB_PATH.name} record ({e})")
+    return user
+
+def updatePostings(current, changes: Dict[str, Dict[int, bool | None]]):
+    # changes: key -> {userid: verified, None to drop it}; only the touched keys get new arrays
+    layered = overlay.layer(current)
+    for key, states in changes.items():
+        lists = (array('q'), array('q'))
+        for postings, old in zip(lists, current.get(key, ((), ()))):
+            if len(old):
+                postings.frombytes(memoryview(old).cast('B'))
+        for userid, verified in states.items():
+            for postings in lists:
+                i = bisect.bisect_left(postings, userid)
+                if i < len(postings) and postings[i] == userid:
+                    del postings[i]
+            if verified is not None:
+                postings = lists[verified]
+                postings.insert(bisect.bisect_left(postings, userid), userid)
+        if lists[0] or lists[1]:
+            layered[key] = lists
+        elif key in layered:
+            del layered[key]
+    return layered
+
+def applyDelta(snap: Snapshot, ops: List[dict]) -> Snapshot:
+    # Upserts/deletes from the delta journal. Only the touched users, their names, postings and values are redone,
+    # every map is layered over the old snapshot's, which stays as it was for queries still running on it.
+    users = overlay.layer(snap.users_by_userid)
+    records = dict(snap.records)
+    names: Dict[str, Dict[str, bool]] = {} # lowercased username -> {userid: still has it}
+    changes = ({}, {}) # holders, collectible holders
+    for op in ops:
+        userid = op["id"]
+        try: # parseOps turns these away, a journal written before it did is skipped over rather than failing every reload
+            new = readUser(userid, op.get("user"), snap.strings) if op["op"] == "upsert" else None
+        except ValueError as e:
+            print(f'Skipping {op["op"]} in {ingest.DELTA_PATH}: {e}')
+            _stats["skipped_ops"] += 1
+            continue
+        old = users.get(userid)
+        for which, keys in enumerate(postingKeys(old)):
+            for key in keys:
+                changes[which].setdefault(key, {})[int(userid)] = None
+        if old is not None:
+            names.setdefault(old.username.lower(), {})[userid] = False
+            del users[userid]
+        if new is not None:
+            users[userid] = new
+            names.setdefault(new.username.lower(), {})[userid] = True
+            for which, keys in enumerate(postingKeys(new)):
+                for key in keys:
+                    changes[which].setdefault(key, {})[int(userid)] = bool(new.verified)
+        records[userid] = op.get("user")
+
+    username_to_id = overlay.layer(snap.username_to_id)
+    added, removed = [], []
+    for name, present in names.items():
+        before = username_to_id.get(name) or []
+        ids = [userid for userid in before if present.get(userid, True)]
+        ids += [userid for userid, there in present.items() if there and userid not in ids]
+        if ids and not before:
+            added.append(name)
+        elif before and not ids:
+            removed.append(name)
+        if ids:
+            username_to_id[name] = ids
+        elif before:
+            del username_to_id[name]
+
+    names_index, names_from, names_changes = snap.trigrams, None, ()
+    if names_index is None: # still being built, buildTrigrams layers these on once it is
+        names_from = snap.trigrams_from or snap
+        names_changes = snap.trigram_changes + ((added, removed),) if added or removed else snap.trigram_changes
+    elif added or removed:
+        names_index = names_index.changed(added, removed)
+        if names_index.layered() > trigrams.LAYER_MAX:
+            names_index = trigrams.TrigramIndex(username_to_id)
+
+    holders = updatePostings(snap.holders, changes[0])
+    collectible_holders = updatePostings(snap.collectible_holders, changes[1])
+    collectible_names = snap.collectible_names
+    for name in changes[1]:
+        i = bisect.bisect_left(collectible_names, name)
+        listed = i < len(collectible_names) and collectible_names[i] == name
+        if listed != (name in collectible_holders):
+            if collectible_names is snap.collectible_names:
+                collectible_names = list(collectible_names)
+            if listed:
+                del collectible_names[i]
+            else:
+                collectible_names.insert(i, name)
+
+    user_value = overlay.layer(snap.user_value)
+    unpriced = dict(snap.unpriced)
+    for userid in {op["id"] for op in ops}:
+        user = users.get(userid)
+        if user is None or user.terminated:
+            if userid in user_value:
+                del user_value[userid]
+            unpriced.pop(userid, None)
+        else:
+            setUserValue(userid, user, snap.item_value, user_value, unpriced)
+
+    return replace(snap, users_by_userid=users, username_to_id=username_to_id, holders=holders, collectible_names=collectible_names,
+                   collectible_holders=collectible_holders, user_value=user_value, unpriced=unpriced, records=records,
+                   columns=None, trigrams=names_index, trigrams_from=names_from, trigram_changes=names_changes)
+
+def replayDelta(snap: Snapshot, journal: tuple | None) -> Snapshot:
+    # Whatever the journal gained since this snapshot last read it, as long as it was written for this data.json
+    if snap.delta_stamp == journal:
+        return snap
+    ops, offset = ingest.readOps(snap.digests[0] if snap.digests else "", snap.delta_offset)
+    if ops:
+        snap = applyDelta(snap, ops)
+        _stats["deltas"] += len(ops)
+    snap.delta_stamp, snap.delta_offset = journal, offset
+    return snap
+
+def validateSnapshot(snap: Snapshot):
+    # A scraper caught mid-write usually fails json.load already, this catches the rest before anything is swapped in
+    for itemID, values in snap.items.items():
+        if not isinstance(values, list) or len(values) < 4 or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values[2:4]):
+            raise ValueError(f"item {itemID} in {ITEMS_PATH.name} isn't [name, code, msrp, resale, ...]")
+    for itemID, value in snap.item_value.items():
+        if not isinstance(value, (int, float)):
+            raise ValueError(f"item {itemID} has no usable price")
+    for itemID, postings in list(snap.holders.items())[:100]:
+        for userid in list(selectPostings(postings))[:10]:
+            if str(userid) not in snap.users_by_userid:
+                raise ValueError(f"holder {userid} of {itemID} is not a user")
+
+
+def buildHolders(users_by_userid: Dict[str, User]) -> Dict[str, Tuple[array, array]]:
+    postings: Dict[str, Tuple[list, list]] = {}
+    for userid, user in users_by_userid.items():
+        if user.terminated:
+            continue
+        for itemID, _ in user.assetCounts():
+            postings.setdefault(itemID, ([], []))[bool(user.verified)].append(int(userid))
+
+    return {itemID: (array('q', sorted(unverified)), array('q', sorted(verified))) for itemID, (unverified, verified) in postings.items()}
+
+def buildCollectibleHolders(users_by_userid: Dict[str, User]) -> Dict[str, Tuple[array, array]]:
+    postings: Dict[str, Tuple[set, set]] = {}
+    lowered = {} # strings index -> lowercased name, every user here comes from the same pool
+    for userid, user in users_by_userid.items():
+        if user.terminated:
+            continue
+        for collectible in user.collectible_ids:
+            name = lowered.get(collectible)
+            if name is None:
+                name = lowered[collectible] = user.strings[collectible].lower()
+            postings.setdefault(name, (set(), set()))[bool(user.verified)].add(int(userid))
+
+    return {name: (array('q', sorted(unverified)), array('q', sorted(verified))) for name, (unverified, verified) in postings.items()}
+
+def unionPostings(postings):
+    last = None
+    for userid in heapq.merge(*postings):
+        if userid != last:
+            yield userid
+            last = userid
+
+def selectPostings(postings: Tuple[array, array], verified: bool | None = None):
+    if verified is None:
+        return heapq.merge(*postings)
+    return postings[bool(verified)]
+
+
+def loadDB() -> Snapshot:
+    # With the watcher running this is just a read of the current reference, a reload never happens inline
+    snap = _snapshot
+    if snap is not None and _watching:
+        _stats["hits"] += 1
+        return snap
+    return refreshDB()
+
+def refreshDB() -> Snapshot:
+    # Builds the next snapshot on the side and swaps the single reference once it is complete and valid.
+    # Cheap stat check first, only hash the files when mtime/size moved so a touch doesn't cost a rebuild
+    global _snapshot
+    with metrics.acquired("snapshot refresh", _refresh_lock):
+        current = _snapshot
+        stamps = (fileStamp(DB_PATH), fileStamp(ITEMS_PATH))
+        journal = ingest.journalStamp()
+        if current is not None and current.stamps == stamps and current.delta_stamp == journal:
+            _stats["hits"] += 1
+            return current
+
+        _stats["misses"] += 1
+        start = time.perf_counter()
+        snap = current if current is not None and current.stamps == stamps else nextSnapshot(current, stamps)
+        if snap is not current and (fileStamp(DB_PATH), fileStamp(ITEMS_PATH)) != stamps:
+            raise ValueError(f"{DB_PATH.name} or {ITEMS_PATH.name} changed while it was read, retried next tick")
+        snap = replayDelta(snap, journal)
+        if snap is current:
+            return current
+
+        validateSnapshot(snap)
+        snap.version = current.version + 1 if current else 1
+        _snapshot = snap
+        _stats["last_reload_seconds"] = time.perf_counter() - start
+        print(f'Loaded data snapshot v{snap.version} in {_stats["last_reload_seconds"]:.2f}s')
+        if snap.trigrams is None: # searchUsers only has exact and prefix matches until it is built
+            threading.Thread(target=buildTrigrams, daemon=True).start()
+        return snap
+
+def nextSnapshot(current: Snapshot | None, stamps: tuple) -> Snapshot:
+    snap = compiled.openSnapshot(compiled.SNAPSHOT_PATH, stamps)
+    if snap is not None:
+        # data.index was counted off data.json itself, a compiled file holding a different number of users is rebuilt
+        index = recordindex.getIndex(DB_PATH, stamps[0], recordindex.INDEX_PATH)
+        if index is None or len(index.userids) == len(snap.users_by_userid):
+            _stats["reloads"] += 1
+            return snap
+        print(f'{compiled.SNAPSHOT_PATH} has {len(snap.users_by_userid)} users, {DB_PATH.name} has {len(index.userids)}, rebuilding it')
+
+    unchanged = current is not None and current.stamps[0] == stamps[0] # a price update doesn't rehash data.json
+    digests = (current.digests[0] if unchanged else fileDigest(DB_PATH), fileDigest(ITEMS_PATH))
+    if current is not None and current.digests == digests:
+        current.stamps = stamps
+        return current
+
+    if current is not None and current.digests[0] == digests[0]: # only the prices moved
+        snap = repriceSnapshot(current, loadData(ITEMS_PATH).get("items", {}))
+        snap.stamps, snap.digests = stamps, digests
+        _stats["reprices"] += 1
+        return snap
+
+    snap = buildSnapshot(stamps, digests)
+    _stats["reloads"] += 1
+    if COMPILE_SNAPSHOTS:
+        threading.Thread(target=compileSnapshot, args=(snap,), daemon=True).start()
+    return snap
+
+def startWatching():
+    # Called by the background watcher, from then on only it reloads (see service.watchDB)
+    global _watching
+    _watching = True
+
+def compileSnapshot(snap: Snapshot):
+    try:
+        compiled.writeSnapshot(snap, compiled.SNAPSHOT_PATH)
+    except OSError as e: # the old snapshot may still be mapped on Windows; the next reload retries
+        print(f'Could not compile {compiled.SNAPSHOT_PATH}: {e}')
+
+def getColumns(snap: Snapshot):
+    if ENGINE != "columns" or not columns.available:
+        return None
+    with _lazy_lock:
+        if snap.columns is None:
+            snap.columns = columns.buildColumns(snap)
+        return snap.columns
+
+def buildTrigrams():
+    # Started by refreshDB after the swap. Builds the index of the snapshot the live one's deltas started from,
+    # then layers their names on, until the live snapshot has one; a delta landing meanwhile just goes round again
+    with _trigram_lock:
+        while True:
+            snap = _snapshot
+            if snap is None or snap.trigrams is not None:
+                return
+            base = snap.trigrams_from or snap
+            index = base.trigrams or trigrams.TrigramIndex(base.username_to_id)
+            with _lazy_lock:
+                base.trigrams = base.trigrams or index
+            for added, removed in snap.trigram_changes:
+                index = index.changed(added, removed)
+            if index.layered() > trigrams.LAYER_MAX:
+                index = trigrams.TrigramIndex(snap.username_to_id)
+            with _lazy_lock:
+                if snap.trigrams is None:
+                    snap.trigrams, snap.trigrams_from = index, None
+
+def getTrigrams(snap: Snapshot) -> trigrams.TrigramIndex:
+    # buildTrigrams does this for the live snapshot, this covers snapshots made some other way (benchmarks)
+    with _lazy_lock:
+        if snap.trigrams is None:
+            snap.trigrams = trigrams.TrigramIndex(snap.username_to_id)
+        return snap.trigrams
+
+def getStats() -> dict:
+    stats = dict(_stats)
+    stats["version"] = _snapshot.version if _snapshot else 0
+    return stats
+
+
+def getValue(asset: str, snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    return snap.item_value.get(str(asset))
+
+def findAssetID(asset: str, snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    return snap.name_to_id.get(asset.lower())
+
+def findLimiteds(asset: str, verified: bool | None = None, snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    itemID = findAssetID(asset, snap)
+
+    cols = getColumns(snap)
+    if cols is not None:
+        return columns.findHolders(cols, itemID, verified) if itemID else []
+
+    postings = snap.holders.get(itemID) if itemID else None
+
+    if postings:
+        users = list(selectPostings(postings, verified))
+        metrics.add("rows_scanned_total", "findLimiteds", len(users))
+        return users
+    else:
+        return []
+
+def getInfo(userid: str):
+    # The record exactly as data.json has it, read through data.index; rebuilt from the snapshot until the index exists
+    snap = loadDB()
+    if userid in snap.records: # changed by a delta since data.json was written
+        return snap.records[userid]
+    index = recordindex.getIndex(DB_PATH, snap.stamps[0], recordindex.INDEX_PATH) if snap.stamps else None
+    if index is not None:
+        record = index.get(userid)
+        if record is not None:
+            return record
+    user = snap.users_by_userid.get(userid) # not indexed, or data.json was rewritten and the watcher hasn't caught up yet
+    return user.to_dict() if user else None
+
+
+def collectibleRange(prefix: str, snap: Snapshot) -> Tuple[int, int]:
+    prefix = prefix.lower()
+    names = snap.collectible_names
+    start = bisect.bisect_left(names, prefix)
+    end = bisect.bisect_left(names, prefix + chr(0x10FFFF), start)
+    return start, end
+
+def findCollectibleNames(prefix: str, snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    start, end = collectibleRange(prefix, snap)
+    return snap.collectible_names[start:end]
+
+def findCollectibleNamesContaining(text: str, snap: Snapshot | None = None):
+    # Substring match, a pass over the distinct collectible names rather than over every user holding one
+    snap = snap or loadDB()
+    text = text.lower()
+    return [name for name in snap.collectible_names if text in name]
+
+def findCollectibles(collectible: str, verified: bool | None = None, snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    cols = getColumns(snap)
+    if cols is not None:
+        return columns.findCollectibleHolders(cols, *collectibleRange(collectible, snap), verified)
+
+    postings = [selectPostings(snap.collectible_holders[name], verified) for name in findCollectibleNames(collectible, snap)]
+    users = list(unionPostings(postings))
+    metrics.add("rows_scanned_total", "findCollectibles", len(users))
+    return users
+
+def iterLines(chunks, encoding: str = 'utf-8'):
+    # bytes chunks -> text lines (line endings kept), undecodable bytes become U+FFFD instead of failing the whole file
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).splitlines(keepends=True)
+        rest = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        yield from lines
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+def iterParts(lines, charToSplit: str, indexes: list[int], quoted: bool = False):
+    # Columns are 1-based, several columns are joined back with charToSplit.
+    # quoted=True reads the lines as CSV, so "a, b" stays one field; it needs a single character separator.
+    # The fields are written back as CSV too, quoted where needed, so the output reads back into the same fields.
+    indexes = [int(index) - 1 for index in indexes]
+
+    join = charToSplit.join
+    if quoted and len(charToSplit) == 1:
+        rows = csv.reader(lines, delimiter=charToSplit)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=charToSplit, lineterminator='')
+        def join(parts):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(parts)
+            return buffer.getvalue()
+    else:
+        rows = (line.split(charToSplit) for line in (line.strip() for line in lines) if line)
+
+    for row in rows:
+        parts = [row[index] for index in indexes if len(row) > index]
+        if parts:
+            yield join(parts)
+
+def extractParts(lines: list[str], charToSplit: str, index: int):
+    return '\n'.join(iterParts(lines, charToSplit, [index]))
+
+def extractPartsFile(source, output, charToSplit: str, indexes: list[int], quoted: bool = False, chunk_size: int = 1 << 16):
+    # Streams source (binary file) into output (binary file) a chunk at a time, returns throughput numbers
+    start = time.perf_counter()
+    stats = {"bytes_in": 0, "bytes_out": 0, "rows": 0}
+
+    def chunks():
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            stats["bytes_in"] += len(chunk)
+            yield chunk
+
+    batch = list()
+    for part in iterParts(iterLines(chunks()), charToSplit, indexes, quoted):
+        batch.append(part)
+        if len(batch) >= 1000:
+            stats["bytes_out"] += output.write(('\n'.join(batch) + '\n').encode('utf-8'))
+            stats["rows"] += len(batch)
+            batch.clear()
+    if batch:
+        stats["bytes_out"] += output.write(('\n'.join(batch) + '\n').encode('utf-8'))
+        stats["rows"] += len(batch)
+
+    metrics.add("rows_scanned_total", "extractParts", stats["rows"])
+    stats["seconds"] = time.perf_counter() - start
+    stats["mb_per_s"] = stats["bytes_in"] / (1 << 20) / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def userValues(userids: list[str], snap: Snapshot):
+    # (userid, value, userSummary) for every known, non terminated user, in the order asked for
+    cols = getColumns(snap)
+    if cols is not None:
+        rows = columns.findRows(cols, userids)
+        for userid, value in zip(cols.userids[rows].tolist(), cols.value[rows].tolist()):
+            yield str(userid), value, userSummary(str(userid), snap)
+        return
+
+    for userid in userids:
+        userid = str(userid)
+        summary = userSummary(userid, snap)
+
+        if summary:
+            if summary[4] == False:
+                yield userid, snap.user_value.get(userid, 0), summary
+
+RESULT_COLUMNS = ("username", "userid", "age", "value", "private", "terminated", "verified")
+
+def summarize(user: User) -> tuple:
+    return user.username, user.userid, user.age, user.private, user.terminated, user.verified
+
+def userSummary(userid: str, snap: Snapshot) -> tuple | None:
+    # What userRows shows of a user; a compiled snapshot reads it from its columns instead of decoding every asset
+    users = snap.users_by_userid
+    if isinstance(users, compiled.RowMap):
+        return users.summary(userid)
+    user = users.get(userid)
+    return summarize(user) if user is not None else None
+
+def userRows(userids: list[str], snap: Snapshot, unpriced: set | None = None):
+    # One RESULT_COLUMNS tuple per listed user, collecting the assets left out of the values into unpriced
+    for userid, value, summary in userValues(userids, snap):
+        if unpriced is not None:
+            unpriced.update(snap.unpriced.get(userid, ()))
+        yield summary[:3] + (value,) + summary[3:]
+
+def unpricedLine(unpriced: set) -> str:
+    return f'Unpriced assets left out of the values: {", ".join(sorted(unpriced))}'
+
+def getLines(userids: list[str], snap: Snapshot | None = None):
+    snap = snap or loadDB()
+    unpriced = set()
+
+    new_line = [', '.join(RESULT_COLUMNS)]
+    new_line.extend(', '.join(map(str, row)) for row in userRows(userids, snap, unpriced))
+    metrics.add("rows_scanned_total", "getLines", len(new_line) - 1)
+    if unpriced:
+        new_line.append(unpricedLine(unpriced))
+    return '\n'.join(new_line)
+
+def findUser(username: str):
+    snap = loadDB()
+    lines = snap.username_to_id.get(username)
+    if lines is None:
+        return False
+    return '\n'.join(lines)
+
+def searchUsers(query: str, limit: int = 10):
+    # [(username, [userid, ...])] ranked exact, prefix, substring, then typo distance
+    snap = loadDB()
+    results = list()
+    if snap.trigrams is not None:
+        found = snap.trigrams.search(query, limit)
+    else:
+        names = snap.username_to_id
+        found = trigrams.scanNames(names.prefixed(query.lower()) if isinstance(names, compiled.UsernameMap) else names, query, limit)
+    for name, _ in found:
+        ids = snap.username_to_id.get(name) or []
+        user = snap.users_by_userid.get(ids[0]) if ids else None
+        results.append((user.username if user else name, ids))
+    return results
@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from pathlib import Path
+
+import threading
+import bisect
+import time
+
+
+METRICS_PATH = Path("data\\metrics.prom") # Prometheus text format, point node_exporter's textfile collector at it
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(22)) # 0.1 ms up to about 3.5 minutes, upper bounds in seconds
+
+# metric -> (label name, help), histograms are in seconds
+HISTOGRAMS = {
+    "command_seconds": ("command", "Discord command latency, from invoke to the handler returning"),
+    "call_seconds": ("fn", "Storage/query function run time on a worker"),
+    "queue_seconds": ("fn", "Time a storage/query call waited for a free worker"),
+    "lock_wait_seconds": ("lock", "Time spent waiting to acquire a lock"),
+    "send_seconds": ("command", "Time spent uploading result files to Discord"),
+}
+COUNTERS = {
+    "command_errors_total": ("command", "Commands that ended in an error"),
+    "bytes_read_total": ("source", "Bytes read from disk or downloaded"),
+    "bytes_written_total": ("target", "Bytes written to disk or uploaded"),
+    "rows_scanned_total": ("query", "Postings, users or lines walked to answer a query"),
+}
+
+
+class Histogram:
+    # Fixed buckets: observing is a bisect and two adds, quantiles are interpolated within a bucket
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, str], Histogram] = {}
+_counters: Dict[Tuple[str, str], float] = {}
+
+
+def observe(metric: str, label: str, seconds: float):
+    with _lock:
+        histogram = _histograms.get((metric, label))
+        if histogram is None:
+            histogram = _histograms[(metric, label)] = Histogram()
+        histogram.observe(seconds)
+
+def add(metric: str, label: str, amount: float = 1):
+    with _lock:
+        _counters[(metric, label)] = _counters.get((metric, label), 0) + amount
+
+@contextmanager
+def timer(metric: str, label: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric, label, time.perf_counter() - start)
+
+@contextmanager
+def acquired(label: str, lock):
+    # Use in place of `with lock:`, records how long getting in took
+    start = time.perf_counter()
+    with lock:
+        observe("lock_wait_seconds", label, time.perf_counter() - start)
+        yield
+
+
+def summary(metric: str) -> List[Tuple[str, int, float, float, float]]:
+    # [(label, count, p50, p95, p99)] busiest first, seconds
+    with _lock:
+        rows = [(label, h.count, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                for (name, label), h in _histograms.items() if name == metric]
+    return sorted(rows, key=lambda row: -row[1])
+
+def totals(metric: str) -> List[Tuple[str, float]]:
+    with _lock:
+        rows = [(label, value) for (name, label), value in _counters.items() if name == metric]
+    return sorted(rows, key=lambda row: -row[1])
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus(gauges: Dict[str, float] = {}) -> str:
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    out = []
+    for metric, (labelName, help) in HISTOGRAMS.items():
+        series = sorted((label, data) for (name, label), data in histograms.items() if name == metric)
+        if not series:
+            continue
+        out.append(f'# HELP bot_{metric} {help}')
+        out.append(f'# TYPE bot_{metric} histogram')
+        for label, (counts, total, count) in series:
+            labels = f'{labelName}="{escape(label)}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                out.append(f'bot_{metric}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            out.append(f'bot_{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            out.append(f'bot_{metric}_sum{{{labels}}} {total}')
+            out.append(f'bot_{metric}_count{{{labels}}} {count}')
+
+    for metric, (labelName, help) in COUNTERS.items():
+        series = sorted((label, value) for (name, label), value in counters.items() if name == metric)
+        if not series:
+            continue
+        out.append(f'# HELP bot_{metric} {help}')
+        out.append(f'# TYPE bot_{metric} counter')
+        for label, value in series:
+            out.append(f'bot_{metric}{{{labelName}="{escape(label)}"}} {value}')
+
+    for name, value in gauges.items():
+        if isinstance(value, (int, float)):
+            out.append(f'# TYPE bot_{name} gauge')
+            out.append(f'bot_{name} {float(value)}')
+    return '\n'.join(out) + '\n'
+
+def writePrometheus(path: Path = METRICS_PATH, gauges: Dict[str, float] = {}):
+    # tmp + replace so the collector never reads half a file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(prometheus(gauges), encoding='utf-8')
+    tmp.replace(path)
@@ -1,177 +1,227 @@
-from dataclasses import dataclass
-from typing import Dict, List, Any, Optional
-from pathlib import Path
-from filelock import FileLock
-from datetime import datetime, timezone
-
-import json
-
-NOTE_PATH = Path("data\\notes.json")
-LOCK_PATH = NOTE_PATH.with_suffix(".lock")
-
-
-@dataclass
-class Note:
-    userid: str
-    username: Optional[str]
-    age: Optional[str]
-    profilePictureRating: Optional[str]
-    message: Optional[str]
-    creator: Optional[str]
-    createdAt: Optional[str]
-
-    @classmethod
-    def from_dict(cls, userid, data: Dict[str, Any] = '', creator = '') -> "Note":
-        data = data or {}
-        return cls(
-            userid=userid,
-            username=data.get("username", ""),
-            email=data.get("profilePictureRating", ""),
-            age=data.get("age", ""),
-            message=data.get("message", ""),
-            creator=data.get("creator", creator),
-            createdAt = data.get("createdAt", datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"))
-        )
-
-    def addMessage(self, message: str):
-        if self.message:
-            self.message = self.message + f'\n\n{message}'
-        else:
-            self.message = message
-
-    def changeInfo(self, username=None, age=None, profilePictureRating=None, message=None):
-        if username is not None:
-            self.username = username
-        if age is not None:
-            self.age = age
-        if profilePictureRating is not None:
-            self.profilePictureRating = profilePictureRating
-        if message is not None:
-            self.message = message
-
-
-def loadData(path: Path) -> dict:
-    if not path.exists():
-        return {}
-    with path.open('r', encoding='utf-8') as file:
-        return json.load(file)
-
-
-def save_db(db: Dict[str, List[Dict[str, Any]]], path: Path = NOTE_PATH) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix('.tmp')
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(db, f, ensure_ascii=False, indent=2)
-        f.flush()
-    tmp.replace(path)
-
-
-def addMessage(userid: str, message: str, lock_timeout: float = 5.0, creator = ''):
-    lock = FileLock(str(LOCK_PATH), timeout=lock_timeout)
-    with lock:
-        db = loadData(NOTE_PATH)
-        userData = db.get(userid)
-        if userData is None:
-            userObj = Note.from_dict(userid, userData, creator=creator)
-        else:
-            userObj = Note.from_dict(userid, userData)
-        userObj.addMessage(message)
-        db[userid] = {
-            "userid": userid,
-            "username": userObj.username,
-            "profilePictureRating": userObj.profilePictureRating,
-            "age": userObj.age,
-            "creator": userObj.creator,
-            "createdAt": userObj.createdAt,
-            "message": userObj.message 
-        }
-        save_db(db)
-
-
-def viewNote(userid: str):
-    lock = FileLock(str(LOCK_PATH))
-    with lock:
-        db = loadData(NOTE_PATH)
-        userData = db.get(userid)
-        if userData is None:
-            return None
-
-        return userData
-
-
-def changeInfo(userid: str, username = None, age = None, profilePictureRating=None, message=None, creator = ''):
-    updates = {k: v for k, v in {
-        "username": username,
-        "age": age,
-        "profilePictureRating": profilePictureRating,
-        "message": message,
-    }.items() if v is not None}
-
-    if not updates:
-        return
-
-    lock = FileLock(str(LOCK_PATH))
-    with lock:
-        db = loadData(NOTE_PATH)
-        userData = db.get(userid)
-        if userData is None:
-            userObj = Note.from_dict(userid, userData, creator=creator)
-        else:
-            userObj = Note.from_dict(userid, userData)
-        userObj.changeInfo(**updates)
-        db[userid] = {
-            "userid": userid,
-            "username": userObj.username,
-            "profilePictureRating": userObj.profilePictureRating,
-            "age": userObj.age,
-            "creator": userObj.creator,
-            "createdAt": userObj.createdAt,
-            "message": userObj.message
-        }
-        save_db(db)
-
-def removeNote(userid: str, lock_timeout: float = 5.0):
-    lock = FileLock(str(LOCK_PATH), timeout=lock_timeout)
-    with lock:
-        db = loadData(NOTE_PATH)
-        if userid in db:
-            del db[userid]
-            save_db(db)
-            return True
-        else:
-            return False
-
-def sort_key(item):
-    parts = item.split(':', 1)
-    if len(parts) == 1 or not parts[1]:
-        return (1, 0) # keep items with no username at the end
-    return (0, parts[1].strip().lower())
-
-def viewNotes(lock_timeout: float = 5.0):
-    lock = FileLock(str(LOCK_PATH), timeout=lock_timeout)
-    with lock:
-        listOfIds = list()
-        db = loadData(NOTE_PATH)
-        for k, v in db.items():
-            name = v.get("username")
-            if name:
-                listOfIds.append(f'{k}:{v.get("username")}')
-            else:
-                listOfIds.append(f'{k}:')
-
-        sorted_data = sorted(listOfIds, key=sort_key)
-
-        listOfIds.clear()
-        listOfUsernames = list()
-        
-        for line in sorted_data:
-            line: str = line.split(':')
-            listOfIds.append(line[0])
-            if line[1]:
-                listOfUsernames.append(line[1])
-            else:
-                listOfUsernames.append('-')
-
-
-        return listOfIds, listOfUsernames
-
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
+from pathlib import Path
+from datetime import datetime, timezone
+from commands import storage
+from commands import notesearch
+from commands import metrics
+
+import threading
+import json
+
+NOTE_PATH = Path("data\\notes.json")
+LOCK_PATH = NOTE_PATH.with_suffix(".lock")
+NOTE_DB_PATH = Path("data\\notes.db")
+JOURNAL_PATH = NOTE_PATH.with_suffix(".journal")
+# Only "json" keeps the notes parsed in process behind storage.RWLock. "sqlite" reads each note with a primary key
+# lookup instead, no FileLock and no parse, which costs about what checking a cache against the files would.
+BACKEND = "sqlite" # "json" keeps everything in notes.json like before, "journal" keeps notes.json but appends changes to a journal
+
+
+@dataclass
+class Note:
+    userid: str
+    username: Optional[str]
+    age: Optional[str]
+    profilePictureRating: Optional[str]
+    message: Optional[str]
+    creator: Optional[str]
+    createdAt: Optional[str]
+
+    @classmethod
+    def from_dict(cls, userid, data: Dict[str, Any] = '', creator = '') -> "Note":
+        data = data or {}
+        return cls(
+            userid=userid,
+            username=data.get("username", ""),
+            profilePictureRating=data.get("profilePictureRating", ""),
+            age=data.get("age", ""),
+            message=data.get("message", ""),
+            creator=data.get("creator", creator),
+            createdAt = data.get("createdAt", datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"))
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "userid": self.userid,
+            "username": self.username,
+            "profilePictureRating": self.profilePictureRating,
+            "age": self.age,
+            "creator": self.creator,
+            "createdAt": self.createdAt,
+            "message": self.message
+        }
+
+    def addMessage(self, message: str):
+        if self.message:
+            self.message = self.message + f'\n\n{message}'
+        else:
+            self.message = message
+
+    def changeInfo(self, username=None, age=None, profilePictureRating=None, message=None):
+        if username is not None:
+            self.username = username
+        if age is not None:
+            self.age = age
+        if profilePictureRating is not None:
+            self.profilePictureRating = profilePictureRating
+        if message is not None:
+            self.message = message
+
+
+def loadData(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    metrics.add("bytes_read_total", path.name, path.stat().st_size)
+    with path.open('r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_db(db: Dict[str, List[Dict[str, Any]]], path: Path = NOTE_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(db, f, ensure_ascii=False, indent=2)
+        f.flush()
+    metrics.add("bytes_written_total", path.name, tmp.stat().st_size)
+    tmp.replace(path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def getStore():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        if BACKEND == "sqlite":
+            _store = storage.SqliteStore(NOTE_DB_PATH)
+            _store.migrate(NOTE_PATH)
+        elif BACKEND == "journal":
+            _store = storage.JournalStore(NOTE_PATH, JOURNAL_PATH, LOCK_PATH)
+        else:
+            _store = storage.JsonStore(NOTE_PATH, LOCK_PATH)
+        return _store
+
+_search = None
+_search_lock = threading.Lock()
+
+def getSearch():
+    # Built from the store on the first search, kept current by every change made through this module
+    global _search
+    with _search_lock:
+        if _search is None:
+            _search = notesearch.NoteSearch(getStore().items())
+        return _search
+
+def indexNote(userid: str):
+    # Called after a change is committed. The note is read again under the lock, so two changes racing to get here
+    # leave the last committed one indexed, and one committed while getSearch() builds is either in the build or re-read after it
+    with _search_lock:
+        if _search is None:
+            return
+        record = getStore().get(userid)
+        if record is None:
+            _search.remove(userid)
+        else:
+            _search.update(userid, record)
+
+def exportNotes(path: Path = NOTE_PATH):
+    db = dict(getStore().items())
+    save_db(db, path)
+    return len(db)
+
+
+def addMessage(userid: str, message: str, lock_timeout: float = 5.0, creator = ''):
+    def apply(userData):
+        if userData is None:
+            userObj = Note.from_dict(userid, userData, creator=creator)
+        else:
+            userObj = Note.from_dict(userid, userData)
+        userObj.addMessage(message)
+        return userObj.to_dict()
+
+    getStore().update(userid, apply, lock_timeout)
+    indexNote(userid)
+
+
+def viewNote(userid: str):
+    userData = getStore().get(userid)
+    if userData is None:
+        return None
+
+    return userData
+
+
+def changeInfo(userid: str, username = None, age = None, profilePictureRating=None, message=None, creator = ''):
+    updates = {k: v for k, v in {
+        "username": username,
+        "age": age,
+        "profilePictureRating": profilePictureRating,
+        "message": message,
+    }.items() if v is not None}
+
+    if not updates:
+        return
+
+    def apply(userData):
+        if userData is None:
+            userObj = Note.from_dict(userid, userData, creator=creator)
+        else:
+            userObj = Note.from_dict(userid, userData)
+        userObj.changeInfo(**updates)
+        return userObj.to_dict()
+
+    getStore().update(userid, apply)
+    indexNote(userid)
+
+def removeNote(userid: str, lock_timeout: float = 5.0):
+    if getStore().delete(userid, lock_timeout):
+        indexNote(userid)
+        return True
+    return False
+
+def countNotes():
+    return getStore().count()
+
+def notePage(rows):
+    # ids, usernames and the first/last (userid, username) to page on from
+    listOfIds = list()
+    listOfUsernames = list()
+    for k, name in rows:
+        listOfIds.append(k)
+        listOfUsernames.append(name if name else '-')
+
+    return listOfIds, listOfUsernames, (tuple(rows[0]), tuple(rows[-1])) if rows else None
+
+def viewNotesPage(page: int, perPage: int = 10):
+    # One page of the notes sorted by username, served from the store's index. Skipping to a page walks the
+    # rows in front of it, moving on from a page uses viewNotesAfter/viewNotesBefore which don't
+    return notePage(getStore().page(page * perPage, perPage))
+
+def viewNotesAfter(row, perPage: int = 10):
+    # The page after the one that ended with row, the first page for None
+    return notePage(getStore().pageAfter(row, perPage))
+
+def viewNotesBefore(row, perPage: int = 10):
+    # The page before the one that started with row, the last perPage notes for None
+    return notePage(getStore().pageBefore(row, perPage))
+
+def snippet(text: str, query: str, width: int = 60):
+    text = text or ''
+    lowered = text.lower()
+    hits = [lowered.find(token) for token in notesearch.tokenize(query)]
+    hits = [hit for hit in hits if hit >= 0]
+    start = max(0, min(hits) - width // 2) if hits else 0
+    part = text[start:start + width * 2].replace('\n', ' ')
+    return ('...' if start else '') + part + ('...' if start + width * 2 < len(text) else '')
+
+def searchNotes(query: str, limit: int = 10):
+    # [(userid, username, snippet)] best match first
+    results = list()
+    for userid, _ in getSearch().search(query, limit):
+        userData = getStore().get(userid)
+        if userData:
+            results.append((userid, userData.get("username") or '-', snippet(userData.get("message"), query)))
+    return results
@@ -0,0 +1,140 @@
+from typing import Dict, List, Any, Optional, Tuple
+from commands import metrics
+
+import threading
+import bisect
+import heapq
+import math
+import re
+
+
+TOKEN = re.compile(r"\w+")
+QUERY = re.compile(r'"([^"]*)"|(\S+)')
+MAX_EXPANSIONS = 200 # how many terms a prefix query like "sup*" may expand to
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def parseQuery(query: str) -> List[Tuple[str, List[str]]]:
+    # [("phrase", tokens) | ("prefix", [stem]) | ("term", [token])], every clause has to match
+    clauses = []
+    for phrase, word in QUERY.findall(query):
+        if phrase:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                clauses.append(("phrase", tokens))
+            elif tokens:
+                clauses.append(("term", tokens))
+        elif word.endswith('*') and tokenize(word):
+            clauses.append(("prefix", tokenize(word)[:1]))
+        else:
+            clauses.extend(("term", [token]) for token in tokenize(word))
+    return clauses
+
+
+class NoteSearch:
+    # Positional inverted index over username + message, kept up to date one note at a time
+
+    def __init__(self, notes: List[Tuple[str, Dict[str, Any]]] = ()):
+        self.lock = threading.Lock()
+        self.postings: Dict[str, Dict[str, List[int]]] = {} # term -> userid -> positions
+        self.terms: List[str] = [] # sorted, prefix queries bisect into it
+        self.docs: Dict[str, List[str]] = {} # userid -> tokens, so a note can be taken back out
+        self.total = 0
+        for userid, record in notes:
+            self.update(userid, record)
+
+    def update(self, userid: str, record: Dict[str, Any]):
+        # The username goes first, one position apart from the message so phrases don't run across them
+        tokens = tokenize(record.get("username")) + [''] + tokenize(record.get("message"))
+        with self.lock:
+            self.unindex(userid)
+            self.docs[userid] = tokens
+            self.total += len(tokens)
+            for position, token in enumerate(tokens):
+                if not token:
+                    continue
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = {}
+                    bisect.insort(self.terms, token)
+                postings.setdefault(userid, []).append(position)
+
+    def remove(self, userid: str):
+        with self.lock:
+            self.unindex(userid)
+
+    def unindex(self, userid: str):
+        # caller holds self.lock
+        tokens = self.docs.pop(userid, None)
+        if tokens is None:
+            return
+        self.total -= len(tokens)
+        for token in set(tokens):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(userid, None)
+            if not postings:
+                del self.postings[token]
+                del self.terms[bisect.bisect_left(self.terms, token)]
+
+    def expand(self, stem: str) -> List[str]:
+        start = bisect.bisect_left(self.terms, stem)
+        end = bisect.bisect_left(self.terms, stem + chr(0x10FFFF), start)
+        return self.terms[start:min(end, start + MAX_EXPANSIONS)]
+
+    def matches(self, kind: str, tokens: List[str]) -> Dict[str, int]:
+        # userid -> how often the clause occurs in the note
+        if kind == "term":
+            return {userid: len(positions) for userid, positions in self.postings.get(tokens[0], {}).items()}
+
+        if kind == "prefix":
+            counts: Dict[str, int] = {}
+            for term in self.expand(tokens[0]):
+                for userid, positions in self.postings[term].items():
+                    counts[userid] = counts.get(userid, 0) + len(positions)
+            return counts
+
+        lists = [self.postings.get(token) for token in tokens]
+        if not all(lists):
+            return {}
+        counts = {}
+        for userid in set.intersection(*(set(p) for p in sorted(lists, key=len))):
+            later = [set(postings[userid]) for postings in lists[1:]]
+            hits = sum(1 for start in lists[0][userid] if all(start + i + 1 in positions for i, positions in enumerate(later)))
+            if hits:
+                counts[userid] = hits
+        return counts
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        # Every clause must match, ranked by BM25 summed over the clauses
+        clauses = parseQuery(query)
+        if not clauses:
+            return []
+
+        with self.lock:
+            n = len(self.docs)
+            average = self.total / n if n else 0
+            results = sorted((self.matches(kind, tokens) for kind, tokens in clauses), key=len)
+            metrics.add("rows_scanned_total", "searchNotes", sum(map(len, results)))
+            if not results[0]:
+                return []
+
+            scores = {}
+            for userid in results[0]:
+                if not all(userid in counts for counts in results[1:]):
+                    continue
+                length = len(self.docs[userid])
+                score = 0.0
+                for counts in results:
+                    idf = math.log(1 + (n - len(counts) + 0.5) / (len(counts) + 0.5))
+                    tf = counts[userid]
+                    score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average))
+                scores[userid] = score
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,96 @@
+from collections.abc import Mapping
+from abc import ABC, abstractmethod
+
+import copy
+
+
+class Overlay(Mapping, ABC):
+    # Writes sit on top of a base that is never touched, so a new snapshot costs a copy of the writes only.
+    # A deleted key stays in the overlay as None, none of the snapshot maps store None as a value.
+
+    def __init__(self):
+        self.overlay = {}
+
+    @abstractmethod
+    def lookup(self, key):
+        ... # the base's value, KeyError when it has none
+
+    def baseContains(self, key) -> bool:
+        try:
+            self.lookup(key)
+            return True
+        except KeyError:
+            return False
+
+    @abstractmethod
+    def baseKeys(self):
+        ...
+
+    @abstractmethod
+    def baseLen(self) -> int:
+        ...
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            value = self.overlay[key]
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.lookup(key)
+
+    def __setitem__(self, key, value):
+        self.overlay[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.overlay[key] = None
+
+    def __contains__(self, key):
+        if key in self.overlay:
+            return self.overlay[key] is not None
+        return self.baseContains(key)
+
+    def __iter__(self):
+        overlay = self.overlay
+        for key in self.baseKeys():
+            if overlay.get(key, key) is not None:
+                yield key
+        for key, value in overlay.items():
+            if value is not None and not self.baseContains(key):
+                yield key
+
+    def __len__(self):
+        if not self.overlay:
+            return self.baseLen()
+        return sum(1 for _ in self)
+
+    def copy(self) -> "Overlay":
+        new = copy.copy(self)
+        new.overlay = dict(self.overlay)
+        return new
+
+
+class DictOverlay(Overlay):
+    def __init__(self, base: dict):
+        super().__init__()
+        self.base = base
+
+    def lookup(self, key):
+        return self.base[key]
+
+    def baseContains(self, key) -> bool:
+        return key in self.base
+
+    def baseKeys(self):
+        return iter(self.base)
+
+    def baseLen(self) -> int:
+        return len(self.base)
+
+
+def layer(mapping) -> Overlay:
+    # Something a delta can write to without touching the snapshot it came from
+    if isinstance(mapping, Overlay):
+        return mapping.copy()
+    return DictOverlay(mapping)
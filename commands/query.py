@@ -0,0 +1,198 @@
+from typing import List, Tuple
+from dataclasses import replace
+from commands import lines
+from commands import metrics
+from commands import scan
+
+import bisect
+import re
+
+
+TOKEN = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+PREFIX = re.compile(r'^([A-Za-z]+)([:~])(.*)$')
+PREFIXES = {"asset": "asset", "a": "asset", "collectible": "collectible", "c": "collectible", "user": "user", "u": "user", "private": "private"}
+VALUE = re.compile(r'(?i)^value(>=|<=|>|<|=)(\d+(?:\.\d+)?)$')
+
+
+class QueryError(ValueError):
+    pass
+
+
+# Parsed form: ("term", kind, name) | ("filter", scan.Filter) | ("and", [nodes]) | ("or", [nodes]) | ("not", node)
+# kind is "asset", "collectible" (prefix) or "contains" (collectible substring), all answered from postings.
+# Filters (u:name, value>N, private:yes) have no index behind them and are checked per user, see scan.py
+
+def tokenize(expression: str) -> List[str]:
+    return TOKEN.findall(expression)
+
+def parse(expression: str):
+    # NOT binds tightest, then AND (also implied between two terms), then OR
+    tokens = tokenize(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parseOr():
+        nodes = [parseAnd()]
+        while peek() == 'OR':
+            take()
+            nodes.append(parseAnd())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parseAnd():
+        nodes = [parseNot()]
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                take()
+            nodes.append(parseNot())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parseNot():
+        if peek() == 'NOT':
+            take()
+            return ("not", parseNot())
+        return parseAtom()
+
+    def parseAtom():
+        if peek() is None:
+            raise QueryError("Query ended early")
+        token = take()
+        if token == '(':
+            node = parseOr()
+            if peek() != ')':
+                raise QueryError("Missing )")
+            take()
+            return node
+        if token == ')' or token.upper() in ('AND', 'OR'):
+            raise QueryError(f"Unexpected {token}")
+
+        value = VALUE.match(token)
+        if value:
+            return ("filter", scan.Filter(values=((value.group(1), float(value.group(2))),)))
+
+        kind, name = "asset", token
+        prefixed = PREFIX.match(token)
+        if prefixed:
+            found, sep = PREFIXES.get(prefixed.group(1).lower()), prefixed.group(2)
+            if found and (sep == ':' or found == "collectible"): # c~bmw is a substring match
+                kind = "contains" if sep == '~' else found
+                name = prefixed.group(3)
+                if not name and peek() is not None and tokens[position].startswith('"'): # c:"bmw m4"
+                    name = take()
+        name = name.strip('"')
+        if not name:
+            raise QueryError(f"Empty {kind} name")
+        if kind == "user":
+            return ("filter", scan.Filter(usernames=(name.lower(),)))
+        if kind == "private":
+            if name.lower() not in ('yes', 'no'):
+                raise QueryError("private: takes yes or no")
+            return ("filter", scan.Filter(private=name.lower() == 'yes'))
+        return ("term", kind, name)
+
+    if not tokens:
+        raise QueryError("Empty query")
+    node = parseOr()
+    if position != len(tokens):
+        raise QueryError(f"Unexpected {tokens[position]}")
+    return node
+
+
+def intersect(small: List[int], large: List[int]) -> List[int]:
+    # walk the smaller list, bisect forward through the larger one
+    out = []
+    low = 0
+    for userid in small:
+        low = bisect.bisect_left(large, userid, low)
+        if low == len(large):
+            break
+        if large[low] == userid:
+            out.append(userid)
+    return out
+
+def subtract(left: List[int], right: List[int]) -> List[int]:
+    if not right:
+        return left
+    out = []
+    low = 0
+    for userid in left:
+        low = bisect.bisect_left(right, userid, low)
+        if low == len(right) or right[low] != userid:
+            out.append(userid)
+    return out
+
+
+def termPostings(kind: str, name: str, verified: bool | None, snap: lines.Snapshot) -> List[int]:
+    if kind in ("collectible", "contains"):
+        names = lines.findCollectibleNames(name, snap) if kind == "collectible" else lines.findCollectibleNamesContaining(name, snap)
+        postings = [lines.selectPostings(snap.collectible_holders[n], verified) for n in names]
+        users = list(lines.unionPostings(postings))
+    else:
+        itemID = lines.findAssetID(name, snap)
+        if itemID is None:
+            raise QueryError(f"Unknown asset {name}")
+        postings = snap.holders.get(itemID)
+        users = list(lines.selectPostings(postings, verified)) if postings else []
+    metrics.add("rows_scanned_total", "queryAssets", len(users))
+    return users
+
+def universe(verified: bool | None, snap: lines.Snapshot) -> List[int]:
+    # Only needed when a query has nothing but NOTs to start from
+    return scan.scanUsers(scan.Filter(verified=verified), snap)
+
+
+def evaluate(node, verified: bool | None, snap: lines.Snapshot) -> List[int]:
+    kind = node[0]
+    if kind == "term":
+        return termPostings(node[1], node[2], verified, snap)
+
+    if kind == "filter":
+        return scan.scanUsers(replace(node[1], verified=verified), snap)
+
+    if kind == "or":
+        return list(lines.unionPostings([evaluate(child, verified, snap) for child in node[1]]))
+
+    if kind == "not":
+        return subtract(universe(verified, snap), evaluate(node[1], verified, snap))
+
+    # and: intersect the positive parts smallest first, check the filters on what is left (one scan only when
+    # nothing else narrows it down), then take the NOTs out
+    positives = [evaluate(child, verified, snap) for child in node[1] if child[0] not in ("not", "filter")]
+    filters = [child[1] for child in node[1] if child[0] == "filter"]
+    negatives = [child[1] for child in node[1] if child[0] == "not"]
+    positives.sort(key=len)
+    if positives:
+        result = positives[0]
+    elif filters:
+        result = evaluate(("filter", filters.pop(0)), verified, snap)
+    else:
+        result = universe(verified, snap)
+    for postings in positives[1:]:
+        if not result:
+            return []
+        result = intersect(result, postings)
+    for flt in filters:
+        if not result:
+            return []
+        result = scan.filterUsers(result, flt, snap)
+    for child in negatives:
+        if not result:
+            break
+        result = subtract(result, evaluate(child, verified, snap))
+    return result
+
+
+def findUsers(expression: str, verified: bool | None = None) -> Tuple[List[int], lines.Snapshot]:
+    # Returns the snapshot it ran against as well, so getLines renders from the same one
+    snap = lines.loadDB()
+    return evaluate(parse(expression), verified, snap), snap
+
+def queryLines(expression: str, verified: bool | None = None) -> str:
+    users, snap = findUsers(expression, verified)
+    return lines.getLines(users, snap)
@@ -0,0 +1,158 @@
+from typing import Iterator, Tuple
+from pathlib import Path
+from array import array
+
+import threading
+import bisect
+import struct
+import json
+import sys
+import os
+
+
+INDEX_PATH = Path("data\\data.index")
+MAGIC = b"DBINDEX1"
+HEADER = struct.Struct("<8sqQQ") # magic, data.json mtime_ns, data.json size, records
+
+# File layout: MAGIC | stamp | count | userids (uint64, sorted) | offsets (uint64) | lengths (uint32).
+# Offsets are bytes into data.json where each user's record starts, so one user costs one seek and one read.
+
+WHITESPACE = json.decoder.WHITESPACE
+_decoder = json.JSONDecoder()
+
+
+def scanRecords(text: str) -> Iterator[Tuple[str, int, int, dict]]:
+    # Walks the top level object of data.json one value at a time: (userid, byte offset, byte length, record)
+    ascii = text.isascii() # then character and byte positions are the same
+    position = WHITESPACE.match(text, 0).end()
+    if text[position:position + 1] != '{':
+        raise json.JSONDecodeError("Expecting '{'", text, position)
+    position = WHITESPACE.match(text, position + 1).end()
+    if text[position:position + 1] == '}':
+        return
+
+    counted, byte = 0, 0
+    while True:
+        key, position = _decoder.raw_decode(text, position)
+        position = WHITESPACE.match(text, position).end()
+        if text[position:position + 1] != ':':
+            raise json.JSONDecodeError("Expecting ':' delimiter", text, position)
+        start = WHITESPACE.match(text, position + 1).end()
+        record, end = _decoder.raw_decode(text, start)
+        if ascii:
+            yield key, start, end - start, record
+        else:
+            byte += len(text[counted:start].encode('utf-8'))
+            length = len(text[start:end].encode('utf-8'))
+            byte, counted = byte + length, end
+            yield key, byte - length, length, record
+
+        position = WHITESPACE.match(text, end).end()
+        if text[position:position + 1] == '}':
+            return
+        if text[position:position + 1] != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", text, position)
+        position = WHITESPACE.match(text, position + 1).end()
+
+
+class IndexBuilder:
+    # Collects (userid, offset, length) while buildSnapshot scans, ids that aren't numbers are left to the snapshot
+    def __init__(self):
+        self.entries = {} # a repeated key points at its last record, like json.load
+
+    def add(self, key: str, offset: int, length: int):
+        if key.isdigit():
+            self.entries[int(key)] = (offset, length)
+
+    def write(self, stamp: tuple, path: Path = INDEX_PATH):
+        ordered = sorted(self.entries)
+        userids = array('Q', ordered)
+        offsets = array('Q', (self.entries[userid][0] for userid in ordered))
+        lengths = array('I', (self.entries[userid][1] for userid in ordered))
+        if sys.byteorder != 'little':
+            for column in (userids, offsets, lengths):
+                column.byteswap()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.index.tmp') # data.tmp is the compiled snapshot's
+        with tmp.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, stamp[0], stamp[1], len(userids)))
+            for column in (userids, offsets, lengths):
+                column.tofile(f)
+        tmp.replace(path)
+
+
+class RecordIndex:
+    def __init__(self, source: Path, stamp: tuple, userids: array, offsets: array, lengths: array):
+        self.source = source
+        self.stamp = stamp
+        self.userids = userids
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def find(self, userid: str) -> Tuple[int, int] | None:
+        try:
+            key = int(userid)
+        except (TypeError, ValueError):
+            return None
+        row = bisect.bisect_left(self.userids, key)
+        if row < len(self.userids) and self.userids[row] == key:
+            return self.offsets[row], self.lengths[row]
+        return None
+
+    def raw(self, userid: str) -> bytes | None:
+        # None as well once data.json was rewritten, the offsets only hold for the file they were taken from
+        found = self.find(userid)
+        if found is None:
+            return None
+        offset, length = found
+        with self.source.open('rb') as f:
+            st = os.fstat(f.fileno())
+            if (st.st_mtime_ns, st.st_size) != tuple(self.stamp):
+                return None
+            f.seek(offset)
+            return f.read(length)
+
+    def get(self, userid: str) -> dict | None:
+        # The record has to parse and be the one asked for, anything else means the file moved under the index
+        data = self.raw(userid)
+        if data is None:
+            return None
+        try:
+            record = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(record, dict) or str(record.get("id", int(userid))) != str(int(userid)):
+            return None
+        return record
+
+
+def readIndex(source: Path, stamp: tuple, path: Path = INDEX_PATH) -> RecordIndex | None:
+    # Only used when it was built from exactly this data.json
+    try:
+        with path.open('rb') as f:
+            magic, mtime, size, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or (mtime, size) != tuple(stamp):
+                return None
+            columns = []
+            for typecode in ('Q', 'Q', 'I'):
+                column = array(typecode)
+                column.fromfile(f, count)
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns.append(column)
+    except (OSError, EOFError, struct.error):
+        return None
+    return RecordIndex(source, stamp, *columns)
+
+
+_index: RecordIndex | None = None
+_lock = threading.Lock()
+
+def getIndex(source: Path, stamp: tuple, path: Path = INDEX_PATH) -> RecordIndex | None:
+    # Read once per data.json version, None until an index for that version exists
+    global _index
+    with _lock:
+        if _index is None or _index.stamp != stamp or _index.source != source:
+            _index = readIndex(source, stamp, path)
+        return _index
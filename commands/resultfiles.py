@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+from commands import lines
+from commands import metrics
+
+import tempfile
+import zipfile
+import json
+import gzip
+import csv
+import io
+
+
+FORMATS = ("txt", "csv", "ndjson")
+COMPRESSION = (None, "gzip", "zip")
+FILE_LIMIT = 10 << 20 # Discord's upload limit for unboosted servers, guilds report their own
+SPOOL_SIZE = 4 << 20 # a part stays in memory up to this, then moves to a temp file
+FLUSH_SIZE = 64 << 10
+HEADROOM = 1 << 20 # room for what the compressor holds back before it reaches the file
+
+
+@dataclass(frozen=True)
+class Options:
+    # Hashable so it can go into the result cache key
+    format: str = "txt"
+    columns: Tuple[str, ...] = lines.RESULT_COLUMNS
+    compression: str | None = None
+    limit: int = FILE_LIMIT
+
+@dataclass
+class Result:
+    parts: List[Tuple[str, object]] # (filename, binary file positioned at 0)
+    rows: int = 0
+    note: str = '' # for the message the files go out with
+
+
+def parseOptions(format: str | None = None, columns: str | None = None, compression: str | None = None, limit: int = FILE_LIMIT) -> Options:
+    # Raises ValueError with a message meant for the user
+    format = (format or "txt").lower()
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format}, use one of {', '.join(FORMATS)}")
+
+    compression = (compression or "").lower() or None
+    if compression in ("none", "no"):
+        compression = None
+    if compression == "gz":
+        compression = "gzip"
+    if compression not in COMPRESSION:
+        raise ValueError(f"Unknown compression {compression}, use gzip or zip")
+
+    picked = lines.RESULT_COLUMNS
+    if columns:
+        picked = tuple(column.strip().lower() for column in columns.split(',') if column.strip())
+        unknown = [column for column in picked if column not in lines.RESULT_COLUMNS]
+        if unknown or not picked:
+            raise ValueError(f"Unknown columns {', '.join(unknown)}, pick from {', '.join(lines.RESULT_COLUMNS)}")
+    return Options(format, picked, compression, limit)
+
+
+class PartWriter:
+    # Writes rows into numbered parts, starting a new one (header repeated) before a part would go over the limit
+
+    def __init__(self, name: str, options: Options):
+        self.name = name
+        self.options = options
+        self.parts = []
+        self.pending: List[bytes] = []
+        self.pendingSize = 0
+        self.written = 0
+        self.sink = None
+        self.archive = None
+        self.stream = None
+        self.header = self.encodeHeader()
+
+    def encodeHeader(self) -> bytes:
+        if self.options.format == "ndjson":
+            return b''
+        if self.options.format == "csv":
+            return self.encodeCsv(self.options.columns)
+        return (', '.join(self.options.columns) + '\n').encode("utf-8")
+
+    def encodeCsv(self, row) -> bytes:
+        text = io.StringIO()
+        csv.writer(text, lineterminator='\n').writerow(row)
+        return text.getvalue().encode("utf-8")
+
+    def encode(self, row: dict) -> bytes:
+        if self.options.format == "ndjson":
+            return (json.dumps({column: row[column] for column in self.options.columns}, ensure_ascii=False) + '\n').encode("utf-8")
+        values = [row[column] for column in self.options.columns]
+        if self.options.format == "csv":
+            return self.encodeCsv(values)
+        return (', '.join(map(str, values)) + '\n').encode("utf-8")
+
+    def filename(self, index: int) -> str:
+        base = self.name if index == 0 else f'{self.name}-{index + 1}'
+        return f'{base}.{self.options.format}'
+
+    def open(self):
+        self.sink = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        inner = self.filename(len(self.parts))
+        if self.options.compression == "gzip":
+            self.stream = gzip.GzipFile(filename=inner, mode='wb', fileobj=self.sink)
+        elif self.options.compression == "zip":
+            self.archive = zipfile.ZipFile(self.sink, 'w', zipfile.ZIP_DEFLATED)
+            self.stream = self.archive.open(inner, 'w', force_zip64=True)
+        else:
+            self.stream = self.sink
+        self.written = 0
+        self.rows = 0
+        self.put(self.header)
+
+    def size(self) -> int:
+        # Bytes the part would have on disk if the pending rows went in now
+        if self.options.compression:
+            return self.sink.tell() + self.pendingSize + HEADROOM
+        return self.written + self.pendingSize
+
+    def put(self, data: bytes):
+        self.pending.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stream.write(b''.join(self.pending))
+            self.written += self.pendingSize
+            self.pending.clear()
+            self.pendingSize = 0
+
+    def write(self, data: bytes):
+        if self.sink is None:
+            self.open()
+        elif self.rows and self.size() + len(data) > self.options.limit:
+            self.close()
+            self.open()
+        self.put(data)
+        self.rows += 1
+
+    def close(self):
+        self.flush()
+        if self.options.compression:
+            self.stream.close()
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+        filename = self.filename(len(self.parts))
+        if self.options.compression == "gzip":
+            filename += '.gz'
+        elif self.options.compression == "zip":
+            filename = filename.rsplit('.', 1)[0] + '.zip'
+        self.sink.seek(0)
+        self.parts.append((filename, self.sink))
+        self.sink = None
+
+    def finish(self) -> list:
+        if self.sink is None:
+            self.open() # an empty result still gets a file with the header
+        self.close()
+        return self.parts
+
+
+def writeResult(userids, snap: lines.Snapshot, name: str, options: Options = Options()) -> Result:
+    # Streams the rows straight into spooled parts, never holding the whole file as one string
+    writer = PartWriter(name, options)
+    unpriced = set()
+    rows = 0
+    for row in lines.userRows(userids, snap, unpriced):
+        writer.write(writer.encode(dict(zip(lines.RESULT_COLUMNS, row))))
+        rows += 1
+
+    metrics.add("rows_scanned_total", "resultFiles", rows)
+    note = ''
+    if unpriced and options.format == "txt":
+        writer.write((lines.unpricedLine(unpriced) + '\n').encode("utf-8"))
+    elif unpriced:
+        note = lines.unpricedLine(unpriced) # csv and ndjson stay machine readable
+    return Result(writer.finish(), rows, note)
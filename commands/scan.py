@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Tuple
+from pathlib import Path
+from array import array
+from commands import lines
+from commands import compiled
+from commands import metrics
+
+import multiprocessing
+import threading
+import operator
+import os
+
+
+WORKERS = max(1, min(8, (os.cpu_count() or 1) - 1)) # one core left for the bot itself
+SHARD_MIN = 50_000 # below this many users a scan stays in process, starting the shards costs more than it saves
+SHARDS_PER_WORKER = 2 # a slow shard (long usernames, cold pages) doesn't hold everyone else up
+CHECK_MAX = 20_000 # more candidates than this and a column scan beats decoding each of them from the mapped file
+COMPARE = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '=': operator.eq}
+
+# Filters that no index answers run as a scan over every user. When the compiled snapshot on disk is the one
+# being queried, the scan reads its columns instead of decoding users; with enough rows it is split into shards,
+# each worker process maps data.snapshot and scans its own range: the page cache holds the one copy every worker
+# reads from, and only the matching userids come back, packed. The rows are sorted by userid so the shards just
+# get concatenated. Users changed by a delta since the file was compiled are checked in the bot process instead.
+
+
+@dataclass(frozen=True)
+class Filter:
+    usernames: Tuple[str, ...] = () # lowercased, the username has to contain each of them
+    values: Tuple[Tuple[str, float], ...] = () # (comparison, amount) on the user's value, see COMPARE
+    private: bool | None = None
+    verified: bool | None = None
+
+    def accepts(self, private: bool, verified: bool, value: float, username: str) -> bool:
+        if self.verified is not None and verified != self.verified:
+            return False
+        if self.private is not None and private != self.private:
+            return False
+        for comparison, amount in self.values:
+            if not COMPARE[comparison](value, amount):
+                return False
+        if self.usernames:
+            name = username.lower()
+            return all(part in name for part in self.usernames)
+        return True
+
+
+def acceptsUser(flt: Filter, userid: str, snap: lines.Snapshot) -> bool:
+    user = snap.users_by_userid.get(userid)
+    if user is None or user.terminated:
+        return False
+    return flt.accepts(bool(user.private), bool(user.verified), snap.user_value.get(userid, 0), user.username)
+
+
+def scanShard(path: Path, stamps: tuple, start: int, end: int, flt: Filter) -> bytes | None:
+    # Runs in a worker, or in the bot for small scans. None when the file was recompiled since the bot picked it.
+    # The file is only mapped for the one scan: Windows can't replace a mapped file, and an idle worker holding it
+    # would keep compileSnapshot from ever writing the next one.
+    opened = compiled.openColumns(path, stamps)
+    if opened is None:
+        return None
+    _, c = opened
+    strings = compiled.StringTable(c["strings"], c["string_offsets"])
+    flags, values, userids, usernames = c["flags"], c["values"], c["userids"], c["usernames"]
+    names = bool(flt.usernames) # only decoded when a filter looks at them
+    out = array('q')
+    for row in range(start, end):
+        f = flags[row]
+        if f & 2: # terminated, left out like in the holder postings
+            continue
+        if flt.accepts(bool(f & 1), bool(f & 4), values[row], strings[usernames[row]] if names else ''):
+            out.append(userids[row])
+    return out.tobytes()
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+def getPool() -> ProcessPoolExecutor:
+    # spawn, the bot has threads running and a forked child could inherit a held lock
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def mappedRows(snap: lines.Snapshot) -> int:
+    # Rows in data.snapshot when it was compiled from the same files as snap, 0 when it can't be scanned for it
+    if not snap.stamps:
+        return 0
+    manifest, _ = compiled.readManifest(compiled.SNAPSHOT_PATH)
+    if manifest is None or manifest["stamps"] != [list(s) for s in snap.stamps]:
+        return 0
+    return manifest["sections"]["userids"][1]
+
+def scanShards(flt: Filter, snap: lines.Snapshot, rows: int) -> List[int] | None:
+    path = compiled.SNAPSHOT_PATH.resolve()
+    if WORKERS < 2 or rows < SHARD_MIN:
+        shards = [scanShard(path, snap.stamps, 0, rows, flt)]
+    else:
+        parts = WORKERS * SHARDS_PER_WORKER
+        bounds = [rows * i // parts for i in range(parts + 1)]
+        pool = getPool()
+        with metrics.timer("call_seconds", "scan.shards"):
+            futures = [pool.submit(scanShard, path, snap.stamps, start, end, flt) for start, end in zip(bounds, bounds[1:]) if end > start]
+            shards = [future.result() for future in futures]
+    if any(shard is None for shard in shards):
+        return None
+
+    changed = snap.records # upserted/deleted by a delta, the file still has them as data.json did
+    users = array('q')
+    for shard in shards:
+        users.frombytes(shard)
+    if not changed:
+        return users.tolist()
+    users = [userid for userid in users if str(userid) not in changed]
+    users.extend(int(userid) for userid in changed if userid.isdigit() and acceptsUser(flt, userid, snap))
+    return sorted(users)
+
+def scanUsers(flt: Filter, snap: lines.Snapshot | None = None) -> List[int]:
+    # Sorted userids of the users flt accepts, terminated users never match
+    snap = snap or lines.loadDB()
+    rows = mappedRows(snap)
+    if rows:
+        users = scanShards(flt, snap, rows)
+        if users is not None:
+            metrics.add("rows_scanned_total", "scan", rows)
+            return users
+
+    values = snap.user_value
+    users = []
+    scanned = 0
+    for userid, user in snap.users_by_userid.items():
+        scanned += 1
+        if not user.terminated and flt.accepts(bool(user.private), bool(user.verified), values.get(userid, 0), user.username):
+            users.append(int(userid))
+    metrics.add("rows_scanned_total", "scan", scanned)
+    return sorted(users)
+
+def filterUsers(userids: List[int], flt: Filter, snap: lines.Snapshot) -> List[int]:
+    # Candidates an index already narrowed down, usually cheaper to check one by one than to scan
+    if len(userids) > CHECK_MAX and mappedRows(snap):
+        accepted = set(scanUsers(flt, snap))
+        return [userid for userid in userids if userid in accepted]
+    metrics.add("rows_scanned_total", "scan", len(userids))
+    return [userid for userid in userids if acceptsUser(flt, str(userid), snap)]
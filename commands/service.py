@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+from commands import notes
+from commands import lines
+from commands import query
+from commands import cache
+from commands import resultfiles
+from commands import metrics
+from commands import ingest
+
+import functools
+import io
+import asyncio
+import aiohttp
+import time
+
+
+THREADS = 4 # storage and index lookups, they mostly wait on disk or release the GIL
+NOTES_TIMEOUT = 10.0
+LINES_TIMEOUT = 30.0
+EXTRACT_TIMEOUT = 300.0
+LAG_INTERVAL = 0.5
+RESULT_CACHE_BYTES = 64 << 20 # encoded /getasset, /getcollectible and /queryassets files kept for repeats
+RESULT_CACHE_ENTRY = 8 << 20 # bigger results are streamed from their temp files and not cached
+WATCH_INTERVAL = 10.0 # how often data.json/itemdetails.json and the delta journal are checked for changes
+METRICS_INTERVAL = 15.0 # how often metrics.METRICS_PATH is rewritten
+
+_threads = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="service")
+_monitor: asyncio.Task | None = None
+_watcher: asyncio.Task | None = None
+_exporter: asyncio.Task | None = None
+results = cache.ResultCache(RESULT_CACHE_BYTES)
+
+lag = {"last": 0.0, "max": 0.0, "avg": 0.0, "samples": 0} # event loop lag in seconds
+
+
+async def monitorLag(interval: float = LAG_INTERVAL):
+    # A sleep that wakes up late means something blocked the loop for that long
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        late = max(0.0, loop.time() - start - interval)
+        lag["last"] = late
+        lag["max"] = max(lag["max"], late)
+        lag["avg"] = late if not lag["samples"] else lag["avg"] * 0.9 + late * 0.1
+        lag["samples"] += 1
+
+def startMonitor():
+    global _monitor
+    if _monitor is None or _monitor.done():
+        _monitor = asyncio.get_running_loop().create_task(monitorLag())
+
+
+async def watchDB(interval: float = WATCH_INTERVAL):
+    # Reloads happen here, on a worker thread, and are swapped in whole; commands just read the current snapshot.
+    # A failed reload (scraper mid-write, bad data) keeps the old snapshot and is retried next tick.
+    lines.startWatching()
+    while True:
+        try:
+            await run(lines.refreshDB, timeout=None)
+        except Exception as e:
+            print(f'Data reload failed, keeping snapshot v{lines.getStats()["version"]}: {e!r}')
+        await asyncio.sleep(interval)
+
+async def exportMetrics(interval: float = METRICS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        gauges = {**getStats(), **{f"snapshot_{k}": v for k, v in lines.getStats().items()}}
+        try:
+            await run(metrics.writePrometheus, metrics.METRICS_PATH, gauges, timeout=None)
+        except OSError as e:
+            print(f'Could not write {metrics.METRICS_PATH}: {e}')
+
+def startBackground():
+    global _watcher, _exporter
+    startMonitor()
+    loop = asyncio.get_running_loop()
+    if _watcher is None or _watcher.done():
+        _watcher = loop.create_task(watchDB())
+    if _exporter is None or _exporter.done():
+        _exporter = loop.create_task(exportMetrics())
+
+
+def timedCall(label: str, queued: float, fn, *args, **kwargs):
+    # Runs on the worker thread, so queue wait and run time are told apart
+    start = time.perf_counter()
+    metrics.observe("queue_seconds", label, start - queued)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        metrics.observe("call_seconds", label, time.perf_counter() - start)
+
+async def run(fn, *args, timeout: float = LINES_TIMEOUT, **kwargs):
+    # Runs fn off the event loop. On timeout the caller gets asyncio.TimeoutError straight away,
+    # the worker finishes in the background since threads can't be killed.
+    startMonitor()
+    loop = asyncio.get_running_loop()
+    label = f'{fn.__module__.rsplit(".", 1)[-1]}.{fn.__name__}'
+    future = loop.run_in_executor(_threads, functools.partial(timedCall, label, time.perf_counter(), fn, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+def getStats() -> dict:
+    return {
+        "lag_last_ms": lag["last"] * 1000,
+        "lag_max_ms": lag["max"] * 1000,
+        "lag_avg_ms": lag["avg"] * 1000,
+        "lag_samples": lag["samples"],
+        "threads_queued": _threads._work_queue.qsize(),
+        **{f"results_{k}": v for k, v in results.getStats().items()},
+    }
+
+
+async def viewNote(userid: str):
+    return await run(notes.viewNote, userid, timeout=NOTES_TIMEOUT)
+
+async def addMessage(userid: str, message: str, creator = ''):
+    return await run(notes.addMessage, userid, message, creator=creator, timeout=NOTES_TIMEOUT)
+
+async def changeInfo(userid: str, username = None, age = None, profilePictureRating=None, message=None, creator = ''):
+    return await run(notes.changeInfo, userid, username, age, profilePictureRating, message, creator=creator, timeout=NOTES_TIMEOUT)
+
+async def removeNote(userid: str):
+    return await run(notes.removeNote, userid, timeout=NOTES_TIMEOUT)
+
+async def searchNotes(query: str, limit: int = 10):
+    return await run(notes.searchNotes, query, limit, timeout=NOTES_TIMEOUT)
+
+async def countNotes():
+    return await run(notes.countNotes, timeout=NOTES_TIMEOUT)
+
+async def viewNotesPage(page: int, perPage: int = 10):
+    return await run(notes.viewNotesPage, page, perPage, timeout=NOTES_TIMEOUT)
+
+async def viewNotesAfter(row, perPage: int = 10):
+    return await run(notes.viewNotesAfter, row, perPage, timeout=NOTES_TIMEOUT)
+
+async def viewNotesBefore(row, perPage: int = 10):
+    return await run(notes.viewNotesBefore, row, perPage, timeout=NOTES_TIMEOUT)
+
+
+def cached(key: tuple, name: str, find, snap: lines.Snapshot, options: resultfiles.Options) -> resultfiles.Result:
+    # key is (kind, normalized query, verified, options, snapshot version). Small results are kept as bytes,
+    # big ones go out straight from their spooled files so they're never copied into memory.
+    hit = results.get(key)
+    if hit is not None:
+        parts, rows, note = hit
+        return resultfiles.Result([(filename, io.BytesIO(payload)) for filename, payload in parts], rows, note)
+
+    result = resultfiles.writeResult(find(), snap, name, options)
+    size = sum(fp.seek(0, io.SEEK_END) for _, fp in result.parts)
+    for _, fp in result.parts:
+        fp.seek(0)
+    if size <= RESULT_CACHE_ENTRY:
+        parts = tuple((filename, fp.read()) for filename, fp in result.parts)
+        results.put(key, (parts, result.rows, result.note), size)
+        result.parts = [(filename, io.BytesIO(payload)) for filename, payload in parts]
+    return result
+
+def assetFile(asset: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    # find + render in one call so both run against the same snapshot
+    snap = lines.loadDB()
+    itemID = lines.findAssetID(asset, snap)
+    key = ("asset", itemID or asset.strip().lower(), verified, options, snap.version) # names of the same item share an entry
+    return cached(key, "assets", lambda: lines.findLimiteds(asset, verified, snap), snap, options)
+
+def collectibleFile(collectible: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    snap = lines.loadDB()
+    key = ("collectible", collectible.lower(), verified, options, snap.version)
+    return cached(key, "collectibles", lambda: lines.findCollectibles(collectible, verified, snap), snap, options)
+
+def queryFile(expression: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    snap = lines.loadDB()
+    key = ("query", ' '.join(query.tokenize(expression)).lower(), verified, options, snap.version)
+    return cached(key, "query", lambda: query.evaluate(query.parse(expression), verified, snap), snap, options)
+
+async def getAssetFile(asset: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    return await run(assetFile, asset, verified, options)
+
+async def getCollectibleFile(collectible: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    return await run(collectibleFile, collectible, verified, options)
+
+async def getQueryFile(expression: str, verified: bool | None = None, options: resultfiles.Options = resultfiles.Options()):
+    return await run(queryFile, expression, verified, options)
+
+async def findUser(username: str):
+    return await run(lines.findUser, username)
+
+async def searchUsers(query: str, limit: int = 10):
+    return await run(lines.searchUsers, query, limit)
+
+async def getInfo(userid: str):
+    return await run(lines.getInfo, userid)
+
+async def ingestDelta(text: str):
+    # NDJSON delta, see commands/ingest.py; the new snapshot is live when this returns
+    return await run(ingest.ingest, text, timeout=None)
+
+async def download(url: str, fp, chunk_size: int = 1 << 16):
+    # Streams an attachment into fp (e.g. a SpooledTemporaryFile) instead of holding it all in memory
+    size = 0
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                fp.write(chunk)
+                size += len(chunk)
+    metrics.add("bytes_read_total", "discord download", size)
+    return size
+
+async def extractPartsFile(source, output, charToSplit: str, indexes: list[int], quoted: bool = False):
+    return await run(lines.extractPartsFile, source, output, charToSplit, indexes, quoted, timeout=EXTRACT_TIMEOUT)
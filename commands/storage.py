@@ -0,0 +1,525 @@
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from pathlib import Path
+from filelock import FileLock
+from abc import ABC, abstractmethod
+from commands import notes
+from commands import metrics
+
+import threading
+import sqlite3
+import bisect
+import json
+import time
+import os
+
+
+NAME_COLUMNS = {"nameless": "coalesce(trim(username), '') = ''", "name_key": "lower(coalesce(trim(username), ''))"} # generated, so notes_by_key can be seeked
+NAME_ORDER = "nameless, name_key, userid" # same order and values as NameIndex.key
+NAME_ORDER_DESC = "nameless DESC, name_key DESC, userid DESC"
+ROW_KEY = "coalesce(trim(:username), '') = '', lower(coalesce(trim(:username), '')), :userid" # NAME_ORDER of a row passed in, SQLite's lower() isn't Python's
+FIELDS = ("userid", "username", "profilePictureRating", "age", "creator", "createdAt", "message") # same order notes.json has always used, message last
+
+
+class NoteStore(ABC):
+    # get/update/delete/items/names is all notes.py needs from a backend
+
+    @abstractmethod
+    def get(self, userid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update(self, userid: str, fn: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]], lock_timeout: float = 5.0) -> Dict[str, Any]:
+        # fn gets the current record (or None) and returns the new one, atomically
+        ...
+
+    @abstractmethod
+    def delete(self, userid: str, lock_timeout: float = 5.0) -> bool:
+        ...
+
+    @abstractmethod
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        ...
+
+    def names(self) -> List[Tuple[str, Optional[str]]]:
+        return [(userid, data.get("username")) for userid, data in self.items()]
+
+    def page(self, offset: int, limit: int) -> List[Tuple[str, Optional[str]]]:
+        # (userid, username) in showNote order, backends override this with an index
+        return NameIndex(self.names()).page(offset, limit)
+
+    def pageAfter(self, row: Optional[Tuple[str, Optional[str]]], limit: int) -> List[Tuple[str, Optional[str]]]:
+        # The page that follows row, a (userid, username) from the previous page; None for the first page.
+        # Unlike page() this costs the same however far into the notes it is, and still works if row was deleted.
+        return NameIndex(self.names()).after(row, limit)
+
+    def pageBefore(self, row: Optional[Tuple[str, Optional[str]]], limit: int) -> List[Tuple[str, Optional[str]]]:
+        # The limit rows in front of row, None for the last ones
+        return NameIndex(self.names()).before(row, limit)
+
+    def count(self) -> int:
+        return len(self.names())
+
+
+class NameIndex:
+    # Notes ordered by username (case insensitive, nameless ones last), kept sorted as notes change
+
+    def __init__(self, names: List[Tuple[str, Optional[str]]] = ()):
+        self.usernames = dict(names)
+        self.keys = sorted(self.key(userid, username) for userid, username in self.usernames.items())
+
+    @staticmethod
+    def key(userid: str, username: Optional[str]):
+        if username and username.strip():
+            return (0, username.strip().lower(), userid)
+        return (1, '', userid)
+
+    def set(self, userid: str, username: Optional[str]):
+        self.remove(userid)
+        self.usernames[userid] = username
+        bisect.insort(self.keys, self.key(userid, username))
+
+    def remove(self, userid: str):
+        if userid in self.usernames:
+            key = self.key(userid, self.usernames.pop(userid))
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def page(self, offset: int, limit: int) -> List[Tuple[str, Optional[str]]]:
+        return [(key[2], self.usernames[key[2]]) for key in self.keys[offset:offset + limit]]
+
+    def after(self, row: Optional[Tuple[str, Optional[str]]], limit: int) -> List[Tuple[str, Optional[str]]]:
+        start = bisect.bisect_right(self.keys, self.key(*row)) if row else 0
+        return [(key[2], self.usernames[key[2]]) for key in self.keys[start:start + limit]]
+
+    def before(self, row: Optional[Tuple[str, Optional[str]]], limit: int) -> List[Tuple[str, Optional[str]]]:
+        end = bisect.bisect_left(self.keys, self.key(*row)) if row else len(self.keys)
+        return [(key[2], self.usernames[key[2]]) for key in self.keys[max(0, end - limit):end]]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class RWLock:
+    # Many readers or one writer, writers get priority so a steady stream of reads can't starve them
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting = 0
+
+    def acquireRead(self):
+        with self.cond:
+            while self.writer or self.waiting:
+                self.cond.wait()
+            self.readers += 1
+
+    def releaseRead(self):
+        with self.cond:
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquireWrite(self):
+        with self.cond:
+            self.waiting += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waiting -= 1
+            self.writer = True
+
+    def releaseWrite(self):
+        with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+
+
+class JsonStore(NoteStore):
+    # The original layout, one notes.json rewritten on every change. The parsed file is cached
+    # in process and served under a shared read lock; the cross process FileLock is only taken
+    # to write, or to re-read the file after its mtime/size moved (someone else edited it).
+
+    def __init__(self, path: Path, lock_path: Path):
+        self.path = path
+        self.lock_path = lock_path
+        self.rw = RWLock()
+        self.db: Dict[str, Dict[str, Any]] | None = None
+        self.index = NameIndex()
+        self.stamp = None
+
+    def fileStamp(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def refresh(self):
+        # caller holds the write lock
+        stamp = self.fileStamp()
+        if self.db is None or stamp != self.stamp:
+            self.db = notes.loadData(self.path)
+            self.index = NameIndex((userid, record.get("username")) for userid, record in self.db.items())
+            self.stamp = stamp
+
+    def read(self, fn):
+        stamp = self.fileStamp()
+        with metrics.timer("lock_wait_seconds", "notes.json read"):
+            self.rw.acquireRead()
+        try:
+            if self.db is not None and stamp == self.stamp:
+                return fn(self.db)
+        finally:
+            self.rw.releaseRead()
+
+        with metrics.acquired("notes.lock", FileLock(str(self.lock_path))):
+            with metrics.timer("lock_wait_seconds", "notes.json write"):
+                self.rw.acquireWrite()
+            try:
+                self.refresh()
+                return fn(self.db)
+            finally:
+                self.rw.releaseWrite()
+
+    def write(self, fn, lock_timeout):
+        with metrics.acquired("notes.lock", FileLock(str(self.lock_path), timeout=lock_timeout)):
+            with metrics.timer("lock_wait_seconds", "notes.json write"):
+                self.rw.acquireWrite()
+            try:
+                self.refresh()
+                db = dict(self.db) # readers holding the old dict keep a consistent view
+                try:
+                    result, changed = fn(db)
+                    if changed:
+                        notes.save_db(db, self.path)
+                        self.db, self.stamp = db, self.fileStamp()
+                except BaseException:
+                    self.db = None # the index may already hold the change, rebuild both on the next access
+                    raise
+                return result
+            finally:
+                self.rw.releaseWrite()
+
+    def get(self, userid):
+        return self.read(lambda db: dict(db[userid]) if userid in db else None) # callers pop fields off the result
+
+    def update(self, userid, fn, lock_timeout=5.0):
+        def apply(db):
+            db[userid] = record = fn(db.get(userid))
+            self.index.set(userid, record.get("username"))
+            return record, True
+        return self.write(apply, lock_timeout)
+
+    def delete(self, userid, lock_timeout=5.0):
+        def apply(db):
+            if userid in db:
+                del db[userid]
+                self.index.remove(userid)
+                return True, True
+            else:
+                return False, False
+        return self.write(apply, lock_timeout)
+
+    def items(self):
+        return self.read(lambda db: [(userid, dict(record)) for userid, record in db.items()])
+
+    def names(self):
+        return self.read(lambda db: [(userid, record.get("username")) for userid, record in db.items()])
+
+    def page(self, offset, limit):
+        return self.read(lambda db: self.index.page(offset, limit))
+
+    def pageAfter(self, row, limit):
+        return self.read(lambda db: self.index.after(row, limit))
+
+    def pageBefore(self, row, limit):
+        return self.read(lambda db: self.index.before(row, limit))
+
+    def count(self):
+        return self.read(len)
+
+
+class SqliteStore(NoteStore):
+    # One row per note, WAL mode so readers never wait on a writer. SQLite does its own
+    # cross-process locking, the FileLock is not needed here.
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.local = threading.local() # sqlite connections can't be shared between threads
+        self.setup()
+
+    def connect(self) -> sqlite3.Connection:
+        con = getattr(self.local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), isolation_level=None, timeout=5.0)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self.local.con = con
+        return con
+
+    def setup(self):
+        con = self.connect()
+        con.execute(f"CREATE TABLE IF NOT EXISTS notes (userid TEXT PRIMARY KEY, {', '.join(f'{f} TEXT' for f in FIELDS[1:])})")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        con.execute("BEGIN IMMEDIATE") # another process may be adding the columns too
+        try:
+            columns = {row[1] for row in con.execute("PRAGMA table_xinfo(notes)")}
+            for name, expression in NAME_COLUMNS.items():
+                if name not in columns:
+                    con.execute(f"ALTER TABLE notes ADD COLUMN {name} GENERATED ALWAYS AS ({expression}) VIRTUAL")
+            con.execute("DROP INDEX IF EXISTS notes_by_name") # on the expressions, which SQLite sorts by but can't seek to a row in
+            con.execute(f"CREATE INDEX IF NOT EXISTS notes_by_key ON notes ({NAME_ORDER})")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+    def toDict(self, row) -> Dict[str, Any]:
+        return dict(zip(FIELDS, row))
+
+    def get(self, userid):
+        row = self.connect().execute(f"SELECT {', '.join(FIELDS)} FROM notes WHERE userid = ?", (userid,)).fetchone()
+        return self.toDict(row) if row else None
+
+    def put(self, con: sqlite3.Connection, userid: str, record: Dict[str, Any]):
+        con.execute(f"INSERT OR REPLACE INTO notes ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                    (userid, *(record.get(f) for f in FIELDS[1:])))
+
+    def update(self, userid, fn, lock_timeout=5.0):
+        con = self.connect()
+        con.execute(f"PRAGMA busy_timeout = {int(lock_timeout * 1000)}")
+        with metrics.timer("lock_wait_seconds", "notes.db write"): # waits out other writers for up to busy_timeout
+            con.execute("BEGIN IMMEDIATE")
+        try:
+            record = fn(self.get(userid))
+            self.put(con, userid, record)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return record
+
+    def delete(self, userid, lock_timeout=5.0):
+        con = self.connect()
+        con.execute(f"PRAGMA busy_timeout = {int(lock_timeout * 1000)}")
+        return con.execute("DELETE FROM notes WHERE userid = ?", (userid,)).rowcount > 0
+
+    def items(self):
+        rows = self.connect().execute(f"SELECT {', '.join(FIELDS)} FROM notes").fetchall()
+        return [(row[0], self.toDict(row)) for row in rows]
+
+    def names(self):
+        return self.connect().execute("SELECT userid, username FROM notes").fetchall()
+
+    def page(self, offset, limit):
+        # notes_by_key has exactly this order, so this walks the index instead of sorting; OFFSET still walks every skipped row
+        return self.connect().execute(f"SELECT userid, username FROM notes ORDER BY {NAME_ORDER} LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+
+    def pageAfter(self, row, limit):
+        # Seeks notes_by_key to row, so every page costs the same
+        if row is None:
+            return self.page(0, limit)
+        return self.connect().execute(f"SELECT userid, username FROM notes WHERE ({NAME_ORDER}) > ({ROW_KEY}) ORDER BY {NAME_ORDER} LIMIT :limit",
+                                      {"userid": row[0], "username": row[1], "limit": limit}).fetchall()
+
+    def pageBefore(self, row, limit):
+        where = f"WHERE ({NAME_ORDER}) < ({ROW_KEY})" if row is not None else ""
+        rows = self.connect().execute(f"SELECT userid, username FROM notes {where} ORDER BY {NAME_ORDER_DESC} LIMIT :limit",
+                                      {"userid": row and row[0], "username": row and row[1], "limit": limit}).fetchall()
+        return rows[::-1]
+
+    def count(self):
+        return self.connect().execute("SELECT count(*) FROM notes").fetchone()[0]
+
+    def migrate(self, json_path: Path) -> int:
+        # One time import of notes.json, remembered in meta so deleting notes later doesn't bring them back
+        con = self.connect()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if con.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                con.execute("COMMIT")
+                return 0
+            db = notes.loadData(json_path)
+            for userid, record in db.items():
+                self.put(con, userid, record)
+            con.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (str(json_path),))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return len(db)
+
+
+
+class JournalStore(NoteStore):
+    # notes.json stays the main store, but mutations only append a line to a journal.
+    # Concurrent writers share one fsync (group commit): whoever finds no flush running
+    # writes out everything queued so far, the rest wait for it. The journal is folded back
+    # into notes.json in the background every compact_every entries or compact_interval seconds.
+
+    def __init__(self, path: Path, journal_path: Path, lock_path: Path, compact_every: int = 1000, compact_interval: float = 60.0):
+        self.path = path
+        self.journal_path = journal_path
+        self.old_path = journal_path.with_suffix(journal_path.suffix + ".old")
+        self.lock_path = lock_path
+        self.compact_every = compact_every
+        self.cond = threading.Condition()
+        self.compacting = threading.Lock()
+        self.pending: List[bytes] = []
+        self.seq = 0 # last queued entry
+        self.durable = 0 # last fsynced entry
+        self.entries = 0 # entries in the journal since the last compaction
+        self.flushing = False
+
+        self.db = self.recover()
+        self.index = NameIndex((userid, record.get("username")) for userid, record in self.db.items())
+        self.journal = self.journal_path.open('ab')
+        if self.entries:
+            self.compact()
+
+        self.timer = threading.Thread(target=self.compactLoop, args=(compact_interval,), daemon=True)
+        self.timer.start()
+
+    def recover(self) -> Dict[str, Dict[str, Any]]:
+        with metrics.acquired("notes.lock", FileLock(str(self.lock_path))):
+            db = notes.loadData(self.path)
+        for journal in (self.old_path, self.journal_path): # a crash mid compaction leaves the older half in .old
+            if not journal.exists():
+                continue
+            with journal.open('rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # torn last line, it never got acknowledged
+                        break
+                    self.apply(db, entry)
+                    self.entries += 1
+        return db
+
+    def apply(self, db: Dict[str, Dict[str, Any]], entry: Dict[str, Any]):
+        if entry["op"] == "put":
+            db[entry["userid"]] = entry["record"]
+        else:
+            db.pop(entry["userid"], None)
+
+    def append(self, entry: Dict[str, Any]) -> int:
+        # caller holds self.cond
+        self.apply(self.db, entry)
+        if entry["op"] == "put":
+            self.index.set(entry["userid"], entry["record"].get("username"))
+        else:
+            self.index.remove(entry["userid"])
+        self.pending.append(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.seq += 1
+        return self.seq
+
+    def waitDurable(self, seq: int):
+        with metrics.acquired("notes.journal", self.cond):
+            while self.durable < seq:
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+
+                self.flushing = True
+                batch, self.pending = self.pending, []
+                upto = self.seq
+                self.cond.release()
+                try:
+                    metrics.add("bytes_written_total", self.journal_path.name, self.journal.write(b''.join(batch)))
+                    self.journal.flush()
+                    os.fsync(self.journal.fileno())
+                except BaseException:
+                    self.cond.acquire()
+                    self.pending[:0] = batch
+                    self.flushing = False
+                    self.cond.notify_all()
+                    raise
+                self.cond.acquire()
+                self.flushing = False
+                self.durable = upto
+                self.entries += len(batch)
+                self.cond.notify_all()
+
+            if self.entries >= self.compact_every and not self.compacting.locked():
+                threading.Thread(target=self.compact, daemon=True).start()
+
+    def get(self, userid):
+        with self.cond:
+            record = self.db.get(userid)
+            return dict(record) if record is not None else None # callers pop fields off the result
+
+    def update(self, userid, fn, lock_timeout=5.0):
+        with self.cond:
+            record = fn(self.db.get(userid))
+            seq = self.append({"op": "put", "userid": userid, "record": record})
+        self.waitDurable(seq)
+        return record
+
+    def delete(self, userid, lock_timeout=5.0):
+        with self.cond:
+            if userid not in self.db:
+                return False
+            seq = self.append({"op": "delete", "userid": userid})
+        self.waitDurable(seq)
+        return True
+
+    def items(self):
+        with self.cond:
+            return list(self.db.items())
+
+    def page(self, offset, limit):
+        with self.cond:
+            return self.index.page(offset, limit)
+
+    def pageAfter(self, row, limit):
+        with self.cond:
+            return self.index.after(row, limit)
+
+    def pageBefore(self, row, limit):
+        with self.cond:
+            return self.index.before(row, limit)
+
+    def count(self):
+        with self.cond:
+            return len(self.db)
+
+    def compact(self):
+        # Rotate the journal under the lock, then write notes.json without holding up writers.
+        # Entries queued after the rotation land in the new journal and replay on top of it.
+        with self.compacting:
+            with self.cond:
+                while self.flushing:
+                    self.cond.wait()
+                if not self.entries and not self.old_path.exists():
+                    return
+                db = dict(self.db)
+                self.journal.close()
+                if not self.old_path.exists():
+                    self.journal_path.replace(self.old_path)
+                else: # left over from a crash, keep it and start the new journal after it
+                    with self.old_path.open('ab') as old, self.journal_path.open('rb') as new:
+                        old.write(new.read())
+                    self.journal_path.unlink()
+                self.journal = self.journal_path.open('ab')
+                self.entries = 0
+
+            with metrics.acquired("notes.lock", FileLock(str(self.lock_path))):
+                notes.save_db(db, self.path)
+            self.old_path.unlink()
+
+    def compactLoop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.compact()
+            except OSError as e:
+                print(f'Could not compact {self.journal_path}: {e}')
+
+
+if __name__ == '__main__':
+    import sys
+    path = Path(sys.argv[2]) if len(sys.argv) > 2 else notes.NOTE_PATH
+    if sys.argv[1:2] == ['export']:
+        print(f'Exported {notes.exportNotes(path)} notes to {path}')
+    else:
+        print('Usage: python -m commands.storage export [path]')
@@ -0,0 +1,183 @@
+from collections import Counter
+from typing import Dict, List, Tuple
+from array import array
+
+import bisect
+import heapq
+import copy
+
+
+MAX_CANDIDATES = 20_000 # postings walked per typo search, typo tolerance is cut back for queries whose trigrams are too common
+VERIFY_MAX = 300 # candidates sharing the most trigrams that get an edit distance, the rest are left out
+LAYER_MAX = 5_000 # names added/removed by deltas kept beside the index before it is rebuilt
+
+START = '\x02'
+END = '\x03'
+
+
+def grams(name: str, padded: bool = True) -> set:
+    # Padding gives the first and last letters their own trigrams, so short names and typos at the ends still match
+    if padded:
+        name = f'{START}{START}{name}{END}'
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    # Levenshtein within a band of limit around the diagonal, limit + 1 once every path is over the limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        best = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] < cost:
+                cost = previous[j] + 1
+            if current[j - 1] < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+def rankName(name: str, query: str, typos: int) -> tuple | None:
+    # What search() ranks a single name by, used for the few names deltas added since the index was built
+    if name == query:
+        return (0, len(name))
+    if name.startswith(query):
+        return (1, len(name))
+    if len(query) >= 3 and query in name:
+        return (2, len(name))
+    d = distance(query, name, typos)
+    return (3 + d, len(name)) if d <= typos else None
+
+
+def scanNames(names, query: str, limit: int = 10) -> List[Tuple[str, int]]:
+    # search() while the index is still being built: only the exact and prefix matches, ranked the same way
+    query = query.lower()
+    found = heapq.nsmallest(limit, (name for name in names if name.startswith(query)), key=lambda name: (name != query, len(name), name))
+    return [(name, 0 if name == query else 1) for name in found]
+
+
+class TrigramIndex:
+    # names are the lowercased usernames, postings map a trigram to the sorted indexes of the names holding it.
+    # Built with the snapshot; a delta adds a small layer (added, removed) on top instead of a rebuild.
+
+    def __init__(self, names):
+        self.names: List[str] = sorted(names)
+        self.lengths = array('I', map(len, self.names))
+        postings: Dict[str, list] = {}
+        for index, name in enumerate(self.names):
+            padded = f'{START}{START}{name}{END}'
+            for gram in {padded[i:i + 3] for i in range(len(padded) - 2)}:
+                found = postings.get(gram)
+                if found is None:
+                    postings[gram] = [index]
+                else:
+                    found.append(index)
+        self.postings: Dict[str, array] = {gram: array('I', indexes) for gram, indexes in postings.items()}
+        self.added: List[str] = [] # sorted, not in names
+        self.removed: frozenset = frozenset() # in names, gone since
+
+    def indexed(self, name: str) -> bool:
+        i = bisect.bisect_left(self.names, name)
+        return i < len(self.names) and self.names[i] == name
+
+    def changed(self, added, removed) -> "TrigramIndex":
+        # A new index sharing this one's names and postings, the old one stays as it was
+        extra, gone = set(self.added), set(self.removed)
+        for name in removed:
+            extra.discard(name)
+            if self.indexed(name):
+                gone.add(name)
+        for name in added:
+            gone.discard(name)
+            if not self.indexed(name):
+                extra.add(name)
+        new = copy.copy(self)
+        new.added, new.removed = sorted(extra), frozenset(gone)
+        return new
+
+    def layered(self) -> int:
+        return len(self.added) + len(self.removed)
+
+    def prefixed(self, prefix: str, limit: int) -> List[int]:
+        # The shortest limit names starting with prefix, the range is sorted by name so ties stay in name order
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + chr(0x10FFFF), start)
+        return heapq.nsmallest(limit, range(start, end), key=self.lengths.__getitem__)
+
+    def containing(self, query: str, limit: int) -> List[int]:
+        # The shortest limit names containing query. Every one of them holds the query's rarest trigram,
+        # checking those names directly is cheaper than intersecting the other, longer postings.
+        rarest = min((self.postings.get(gram, ()) for gram in grams(query, padded=False)), key=len, default=())
+        names = self.names
+        found = [index for index in rarest if query in names[index]]
+        return heapq.nsmallest(limit, found, key=lambda index: (self.lengths[index], names[index]))
+
+    def similar(self, query: str, typos: int) -> Tuple[List[int], int]:
+        # Each typo breaks at most 3 trigrams, so a match misses at most 3 * typos of any set of the query's trigrams.
+        # Shared trigrams are counted over as many of the rarest as MAX_CANDIDATES allows, names of the wrong length
+        # are dropped, and only the VERIFY_MAX sharing the most are returned. Also returns the typos it could afford.
+        wanted = grams(query)
+        sizes = {gram: len(self.postings.get(gram, ())) for gram in wanted}
+        by_rarity = sorted(wanted, key=sizes.__getitem__)
+        while typos and sum(sizes[gram] for gram in by_rarity[:3 * typos + 1]) > MAX_CANDIDATES:
+            typos -= 1
+
+        counted = 3 * typos + 1
+        walked = sum(sizes[gram] for gram in by_rarity[:counted])
+        while counted < len(by_rarity) and walked + sizes[by_rarity[counted]] <= MAX_CANDIDATES:
+            walked += sizes[by_rarity[counted]]
+            counted += 1
+
+        hits = Counter()
+        for gram in by_rarity[:counted]:
+            hits.update(self.postings.get(gram, ()))
+        need = max(1, min(counted, len(wanted)) - 3 * typos)
+        low, high = len(query) - typos, len(query) + typos
+        lengths = self.lengths
+        found = [(shared, index) for index, shared in hits.items() if shared >= need and low <= lengths[index] <= high]
+        return [index for _, index in heapq.nlargest(VERIFY_MAX, found)], typos
+
+    def search(self, query: str, limit: int = 10, typos: int = 2) -> List[Tuple[str, int]]:
+        # Ranked (name, rank): exact, then prefix, then substring, then by edit distance
+        query = query.lower()
+        removed = self.removed
+        ranked = {}
+        def add(name, rank):
+            if name not in removed and (name not in ranked or rank < ranked[name]):
+                ranked[name] = rank
+
+        for index in self.prefixed(query, limit + len(removed)):
+            name = self.names[index]
+            add(name, (0 if name == query else 1, len(name)))
+
+        if len(query) >= 3 and len(ranked) < limit: # enough exact/prefix matches leave no room for substrings
+            for index in self.containing(query, limit + len(removed)):
+                add(self.names[index], (2, len(self.names[index])))
+
+        typos = min(typos, len(query) // 3)
+        if len(ranked) < limit: # a typo match never outranks the ones above
+            candidates, typos = self.similar(query, typos)
+            for index in candidates:
+                name = self.names[index]
+                d = distance(query, name, typos)
+                if d <= typos:
+                    add(name, (3 + d, len(name)))
+
+        for name in self.added:
+            found = rankName(name, query, typos)
+            if found is not None:
+                add(name, found)
+
+        best = heapq.nsmallest(limit, ranked.items(), key=lambda item: (item[1], item[0]))
+        return [(name, rank[0]) for name, rank in best]